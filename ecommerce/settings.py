@@ -41,13 +41,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover the rest of the stack (see store/metrics.py)
+    'store.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # also takes the place of django.contrib.auth's AuthenticationMiddleware
     'store.middleware.ShopFusionAuthMiddleware',
+    'store.middleware.RequestProfilerMiddleware',
     'store.middleware.AdminSessionPreserveMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
     'store.middleware.AdminRestrictMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -66,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.cart',
             ],
         },
     },
@@ -148,12 +152,84 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Global default restock per size when automatic restock is triggered
 RESTOCK_SIZE_QUANTITY = 2
 
+# Responsive product image derivatives (see store/images.py)
+PRODUCT_IMAGE_WIDTHS = [160, 320, 640, 960]
+# background worker processes rendering derivatives on upload; 0 disables it
+PRODUCT_IMAGE_WORKERS = 2
+
 # Auth redirects
 LOGIN_REDIRECT_URL = '/home/'
 # LOGOUT_REDIRECT_URL = '/public-home/' # Commented out
 
 LOGIN_URL = '/login/'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shopfusion',
+    },
+    # With several worker processes use a shared backend so catalog version
+    # bumps reach every worker, e.g.:
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': BASE_DIR / 'cache',
+    # },
+}
+
+# cache alias and lifetime (seconds) of cached catalog pages and fragments
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 600
+
+# Storefront pages requested without a session cookie skip the session and
+# CSRF cookie and are sent with ETag/Last-Modified and public Cache-Control
+# (max-age seconds below) so browsers and a caching proxy can keep them.
+STOREFRONT_HTTP_CACHE = True
+STOREFRONT_MAX_AGE = 60
+
+# Hold cart-line units for STOCK_RESERVATION_TTL seconds so they can't be
+# sold to someone else (expired holds are swept by `release_reservations`).
+STOCK_RESERVATIONS = False
+STOCK_RESERVATION_TTL = 900
+
+# Order history pages (served from OrderSummary rows)
+ORDER_HISTORY_PAGE_SIZE = 20
+ORDER_SUMMARY_THUMBNAILS = 4
+
+# Inventory ledger movements younger than this many seconds are left for
+# the next `compact_inventory` run
+INVENTORY_COMPACTION_LAG = 60
+
+# Batch concurrent checkouts of the same size into one stock UPDATE per
+# process (see store/group_commit.py; benchmark with `bench_hot_sku`).
+STOCK_GROUP_COMMIT = False
+STOCK_GROUP_COMMIT_WINDOW_MS = 2
+
+# Per-view latency/SQL metrics at /metrics (Prometheus text format), for
+# staff sessions or `Authorization: Bearer <METRICS_TOKEN>`. With several
+# worker processes set METRICS_DIR to a directory they share; each writes
+# its totals there every METRICS_FLUSH_INTERVAL seconds.
+METRICS_TOKEN = ''
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
+
+# Sampled cProfile request profiles, listed at /admin/profiles/ (see
+# store/profiling.py): a PROFILING_SAMPLE_RATE fraction of requests, staff
+# requests sending the PROFILING_HEADER header, and the next request for a
+# path that took over PROFILING_SLOW_MS. The newest PROFILING_MAX_PROFILES
+# are kept in PROFILING_DIR.
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_SLOW_MS = 1000
+PROFILING_HEADER = 'X-Profile'
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_PROFILES = 200
+
+# seconds a resolved request user is reused from the per-process cache.
+# Saving or deleting a user only clears the cache of the process that did
+# it, so deactivating a user or revoking is_staff takes up to this long to
+# reach the other worker processes.
+USER_CACHE_TTL = 30
+
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
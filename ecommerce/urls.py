@@ -20,9 +20,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views # Import Django's auth views
 from store.views import admin_logout_view # Import the custom admin logout view
+from store import views as store_views
 
 urlpatterns = [
     path('admin/logout/', admin_logout_view, name='admin_logout'), # Custom admin logout
+    # stored request profiles (see store/profiling.py), staff only
+    path('admin/profiles/', admin.site.admin_view(store_views.admin_profiles), name='admin_profiles'),
+    path('admin/profiles/<str:profile_id>/', admin.site.admin_view(store_views.admin_profile_detail), name='admin_profile_detail'),
+    path('admin/profiles/<str:profile_id>/download/', admin.site.admin_view(store_views.admin_profile_download), name='admin_profile_download'),
     path('admin/', admin.site.urls),
     path('', include('store.urls')),
 ]
@@ -2,32 +2,65 @@ from django.contrib import admin, messages
 from django import forms
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from .models import Category, Product, CartItem, Address, Order, SupportRequest, SizeStock
-from django.db.models import F
+from .models import Category, Product, CartItem, Address, Order, SupportRequest, SizeStock, StockMovement, update_stock_aggregates
+from .inventory import bulk_restock
+from .ledger import live_stock, live_stock_of, move, set_live
+from .orders import transition_orders
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 
 
 def restock_sizes_action(modeladmin, request, queryset):
-    count = 0
-    for ss in queryset:
-        default_qty = (ss.product.initial_total_stock // 5) if ss.product.initial_total_stock else 2
-        if default_qty <= 0:
-            default_qty = 2
-        if ss.restock_to(default_qty):
-            count += 1
+    count = bulk_restock(queryset)
     messages.success(request, f"Restocked {count} size(s).")
 restock_sizes_action.short_description = 'Restock selected sizes to default quantity'
 
 
+def live_status(live):
+    """Status label for a size with `live` units (the stored `status` lags until compaction)."""
+    return dict(SizeStock.STATUS_CHOICES)[SizeStock.STATUS_IN if live > 0 else SizeStock.STATUS_OUT]
+
+
+class LiveStatusFilter(admin.SimpleListFilter):
+    """Filter on the live stock (the queryset must be annotated with `live`)."""
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return SizeStock.STATUS_CHOICES
+
+    def queryset(self, request, queryset):
+        if self.value() == SizeStock.STATUS_IN:
+            return queryset.filter(live__gt=0)
+        if self.value() == SizeStock.STATUS_OUT:
+            return queryset.filter(live__lte=0)
+        return queryset
+
+
 class SizeStockInline(admin.TabularInline):
     model = SizeStock
     extra = 0
-    readonly_fields = ('status',)
+    readonly_fields = ('live_status',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(live=live_stock())
+
+    @admin.display(description='Status')
+    def live_status(self, obj):
+        if obj.pk is None:
+            return '-'
+        return live_status(obj.live if hasattr(obj, 'live') else live_stock_of(obj))
+
     class SizeStockInlineForm(forms.ModelForm):
         class Meta:
             model = SizeStock
-            fields = '__all__'
+            exclude = ('status',)
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if self.instance.pk:
+                # edit the live stock, not the ledger snapshot
+                self.initial['stock'] = live_stock_of(self.instance)
 
         def validate_unique(self):
             # Skip the default unique_together validation for product+size here
@@ -47,15 +80,22 @@ class SizeStockInline(admin.TabularInline):
                 size=size,
                 defaults={'stock': stock, 'status': SizeStock.STATUS_IN if stock > 0 else SizeStock.STATUS_OUT},
             )
-            if not created:
-                # Increment existing stock atomically to avoid race conditions
-                SizeStock.objects.filter(pk=ss.pk).update(stock=F('stock') + stock)
-                ss.refresh_from_db()
-                ss.mark_status()
-                if commit:
-                    ss.save(update_fields=['stock', 'status'])
+            if created:
+                update_stock_aggregates([(product.pk, size, stock, stock > 0)])
+            else:
+                # Add to the existing size as a restock movement
+                move(product.pk, size, stock, StockMovement.KIND_RESTOCK)
             return ss
 
+        def save_existing(self, form, obj, commit=True):
+            # The form edits the live stock: keep the snapshot and record the
+            # difference as a manual adjustment
+            target = obj.stock or 0
+            obj.save_details()
+            set_live(obj, target, StockMovement.KIND_ADJUST)
+            obj.refresh_from_db(fields=SizeStock.LEDGER_FIELDS)
+            return obj
+
     form = SizeStockInlineForm
     formset = SizeStockInlineFormset
 
@@ -67,16 +107,7 @@ class ProductAdmin(admin.ModelAdmin):
 
     def restock_product_sizes(self, request, queryset):
         """Restock all sizes for selected products to their per-size default."""
-        count = 0
-        for product in queryset:
-            sizes = SizeStock.objects.filter(product=product)
-            # compute per-size default
-            per_size_default = (product.initial_total_stock // 5) if product.initial_total_stock else getattr(settings, 'RESTOCK_SIZE_QUANTITY', 2)
-            if per_size_default <= 0:
-                per_size_default = getattr(settings, 'RESTOCK_SIZE_QUANTITY', 2)
-            for ss in sizes:
-                if ss.restock_to(per_size_default):
-                    count += 1
+        count = bulk_restock(SizeStock.objects.filter(product__in=queryset))
         messages.success(request, f"Restocked {count} size entries for selected products.")
 
     restock_product_sizes.short_description = 'Restock sizes for selected products to defaults'
@@ -93,9 +124,26 @@ class CartItemInline(admin.TabularInline):
     extra = 1
 
 
+def _order_status_action(status):
+    label = dict(Order.STATUS_CHOICES)[status]
+
+    def action(modeladmin, request, queryset):
+        moved, rejected = transition_orders(queryset.values_list('pk', flat=True), status)
+        if moved:
+            messages.success(request, f"Marked {len(moved)} order(s) as {label}.")
+        if rejected:
+            messages.warning(request, f"Skipped {len(rejected)} order(s) that cannot move to {label} from their current status.")
+    action.__name__ = f'mark_{status.lower()}'
+    action.short_description = f'Mark selected orders as {label}'
+    return action
+
+
 class OrderAdmin(admin.ModelAdmin):
     inlines = [CartItemInline]
     exclude = ('items',)
+    list_display = ('id', 'user', 'status', 'tracking_status', 'total', 'created_at')
+    list_filter = ('status',)
+    actions = [_order_status_action(status) for status, _ in Order.STATUS_CHOICES if status != Order.STATUS_PLACED]
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "user":
@@ -105,13 +153,30 @@ class OrderAdmin(admin.ModelAdmin):
 
 
 class SizeStockAdmin(admin.ModelAdmin):
-    list_display = ('product', 'size', 'stock', 'status')
-    list_filter = ('product__category', 'size', 'status')
+    list_display = ('product', 'size', 'live_stock', 'live_status')
+    list_filter = ('product__category', 'size', LiveStatusFilter)
     actions = [restock_sizes_action]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(live=live_stock())
+
+    @admin.display(description='Stock', ordering='live')
+    def live_stock(self, obj):
+        return obj.live
+
+    @admin.display(description='Status', ordering='live')
+    def live_status(self, obj):
+        return live_status(obj.live)
+
     class SizeStockAdminForm(forms.ModelForm):
         class Meta:
             model = SizeStock
-            fields = '__all__'
+            exclude = ('status',)
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if self.instance.pk:
+                self.initial['stock'] = live_stock_of(self.instance)
 
         def validate_unique(self):
             # Skip unique_together validation for admin form so save_model
@@ -148,15 +213,18 @@ class SizeStockAdmin(admin.ModelAdmin):
         if not change:
             existing = SizeStock.objects.filter(product=obj.product, size=obj.size).first()
             if existing:
-                # increment atomically
-                from django.db.models import F
-                SizeStock.objects.filter(pk=existing.pk).update(stock=F('stock') + (obj.stock or 0))
-                existing.refresh_from_db()
-                existing.mark_status()
-                existing.save(update_fields=['stock', 'status'])
+                move(existing.product_id, existing.size, obj.stock or 0, StockMovement.KIND_RESTOCK)
                 messages.success(request, f"Updated existing size stock for {obj.product} ({obj.size}).")
                 return
-        super().save_model(request, obj, form, change)
+            obj.mark_status()
+            super().save_model(request, obj, form, change)
+            update_stock_aggregates([(obj.product_id, obj.size, obj.stock or 0, (obj.stock or 0) > 0)])
+            return
+        # the form edits the live stock; keep the snapshot and record an adjustment
+        target = obj.stock or 0
+        obj.save_details()
+        set_live(obj, target, StockMovement.KIND_ADJUST)
+        obj.refresh_from_db(fields=SizeStock.LEDGER_FIELDS)
 
     def add_view(self, request, form_url='', extra_context=None):
         """Override add_view to gracefully handle duplicate product+size
@@ -181,18 +249,32 @@ class SizeStockAdmin(admin.ModelAdmin):
                     stock_val = 0
                 existing = SizeStock.objects.filter(product_id=product_id, size=size).first()
                 if existing:
-                    SizeStock.objects.filter(pk=existing.pk).update(stock=F('stock') + stock_val)
-                    existing.refresh_from_db()
-                    existing.mark_status()
-                    existing.save(update_fields=['stock', 'status'])
+                    move(existing.product_id, existing.size, stock_val, StockMovement.KIND_RESTOCK)
                     messages.success(request, f"Updated existing size stock for {existing.product} ({existing.size}).")
                     return HttpResponseRedirect(reverse('admin:store_sizestock_changelist'))
         return super().add_view(request, form_url, extra_context)
 
 
+class StockMovementAdmin(admin.ModelAdmin):
+    """Read-only audit trail of the inventory ledger."""
+    list_display = ('created_at', 'product', 'size', 'kind', 'delta')
+    list_filter = ('kind', 'size')
+    list_select_related = ('product',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Category)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(SizeStock, SizeStockAdmin)
+admin.site.register(StockMovement, StockMovementAdmin)
 admin.site.register(CartItem)
 admin.site.register(Address)
 admin.site.register(Order, OrderAdmin)
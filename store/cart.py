@@ -0,0 +1,146 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from . import ledger, reservations
+from .models import CartItem, SizeStock, StockReservation
+
+CENTS = Decimal('0.01')
+
+
+def upsert_lines(user, lines):
+    """Add [(product_id, size, quantity)] to `user`'s cart in a single statement.
+
+    Each line is inserted, or its quantity incremented on the
+    (user, product, size) unique key, only if the size exists and its stock
+    covers what is already in the cart plus `quantity`; other lines are left
+    out. Lines must not repeat a (product_id, size). Returns the affected
+    row count as reported by the database (0 when nothing was written).
+
+    With stock reservations on, units other shoppers hold don't count as
+    stock, and the written lines are (re)held; the size rows are locked for
+    the duration so two shoppers can't hold the same units.
+    """
+    lines = [(int(product_id), size, int(quantity)) for product_id, size, quantity in lines if int(quantity) > 0]
+    if not lines:
+        return 0
+    if not reservations.enabled():
+        return _upsert(user, lines)
+    keys = [(product_id, size) for product_id, size, _ in lines]
+    with transaction.atomic():
+        reservations.lock_sizes(keys)
+        written = _upsert(user, lines, exclude_held=True)
+        if written:
+            reservations.hold(user, keys)
+    return written
+
+
+def _upsert(user, lines, exclude_held=False):
+    cart_table = CartItem._meta.db_table
+    stock_table = SizeStock._meta.db_table
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    wanted = ' UNION ALL '.join(['SELECT %s AS product_id, %s AS size, %s AS qty'] * len(lines))
+    params = [now]
+    params += [value for line in lines for value in line]
+    params.append(user.pk)
+    held = ''
+    if exclude_held:
+        held = (
+            f' - COALESCE((SELECT SUM(r.quantity) FROM {StockReservation._meta.db_table} r '
+            'WHERE r.product_id = s.product_id AND r.size = s.size AND r.user_id <> %s AND r.expires_at > %s), 0)'
+        )
+        params += [user.pk, now]
+    select = (
+        f'SELECT {int(user.pk)}, s.product_id, s.size, w.qty, %s '
+        f'FROM {stock_table} s '
+        f'JOIN ({wanted}) w ON w.product_id = s.product_id AND w.size = s.size '
+        f'LEFT JOIN {cart_table} c ON c.user_id = %s AND c.product_id = s.product_id AND c.size = s.size '
+        f'WHERE {ledger.live_stock_sql("s")}{held} >= w.qty + COALESCE(c.quantity, 0)'
+    )
+    if connection.vendor == 'mysql':
+        conflict = f'ON DUPLICATE KEY UPDATE quantity = {cart_table}.quantity + VALUES(quantity)'
+    else:
+        conflict = (f'ON CONFLICT (user_id, product_id, size) '
+                    f'DO UPDATE SET quantity = {cart_table}.quantity + excluded.quantity')
+    sql = f'INSERT INTO {cart_table} (user_id, product_id, size, quantity, added_at) {select} {conflict}'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def add_item(user, product_id, size, quantity):
+    """Add one line to the cart (see `upsert_lines`). Returns False if the size is missing or short on stock."""
+    return upsert_lines(user, [(product_id, size, quantity)]) > 0
+
+
+def set_held_quantity(user, cart_item, quantity):
+    """Change a cart line's quantity and its hold (reservation mode).
+
+    Returns False, changing nothing, when the size's stock minus other
+    shoppers' holds doesn't cover `quantity`.
+    """
+    key = (cart_item.product_id, cart_item.size)
+    with transaction.atomic():
+        stock = reservations.lock_sizes([key]).get(key)
+        if stock is None or stock - reservations.held_by_others(user, [key]).get(key, 0) < quantity:
+            return False
+        CartItem.objects.filter(pk=cart_item.pk).update(quantity=quantity)
+        reservations.hold(user, [key])
+    cart_item.quantity = quantity
+    return True
+
+
+class CartSummary:
+    """A user's cart: `lines` (None for badge-only summaries), `total`,
+    `item_count` (units) and `line_count`."""
+
+    def __init__(self, lines, total, item_count, line_count):
+        self.lines = lines
+        self.total = total
+        self.item_count = item_count
+        self.line_count = line_count
+
+    @property
+    def has_unavailable(self):
+        return any(not line.available for line in self.lines or ())
+
+
+def cart_totals(user):
+    """Totals only (for the header badge): one aggregate query."""
+    totals = CartItem.objects.filter(user=user).aggregate(
+        total=Sum(F('quantity') * F('product__price')),
+        item_count=Sum('quantity'),
+        line_count=Count('id'),
+    )
+    # SQLite hands back computed decimals without their scale
+    total = (totals['total'] or Decimal(0)).quantize(CENTS)
+    return CartSummary(None, total, totals['item_count'] or 0, totals['line_count'])
+
+
+def cart_summary(user):
+    """Cart lines with their product and live stock joined, plus SQL totals: two queries.
+
+    Each line gets `line_total`, `stock` (units left in that size, None when
+    the size row is gone) and `available` (the stock covers the quantity).
+    """
+    lines = list(
+        CartItem.objects.filter(user=user)
+        .select_related('product')
+        .only('id', 'size', 'quantity', 'product__id', 'product__name', 'product__price')
+        .annotate(
+            line_total=F('quantity') * F('product__price'),
+            stock=Subquery(
+                SizeStock.objects.filter(product=OuterRef('product'), size=OuterRef('size'))
+                .annotate(live=ledger.live_stock()).values('live')[:1]
+            ),
+        )
+        .order_by('pk')
+    )
+    for line in lines:
+        line.line_total = line.line_total.quantize(CENTS)
+        line.available = line.stock is not None and line.stock >= line.quantity
+    summary = cart_totals(user)
+    summary.lines = lines
+    return summary
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import group_commit, ledger, reservations
+from .models import CartItem, Order, OrderItem, SizeStock, StockMovement, update_stock_aggregates
+from .orders import build_summary
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be turned into an order. The message is safe
+    to show to the shopper."""
+
+
+def _size_stock_filter(keys):
+    q = Q()
+    for product_id, size in keys:
+        q |= Q(product_id=product_id, size=size)
+    return q
+
+
+def _needed(lines):
+    # Several cart lines may point at the same product+size; collapse them.
+    needed = OrderedDict()
+    for line in lines:
+        key = (line.product_id, line.size)
+        needed[key] = needed.get(key, 0) + line.quantity
+    return needed
+
+
+def _create_order(user, address, lines):
+    total = sum(line.product.price * line.quantity for line in lines)
+    order = Order.objects.create(user=user, address=address, total=total)
+    items = [
+        OrderItem(order=order, product=line.product, size=line.size, quantity=line.quantity, price=line.product.price)
+        for line in lines
+    ]
+    OrderItem.objects.bulk_create(items)
+    build_summary(order, address, items).save(force_insert=True)
+    CartItem.objects.filter(pk__in=[line.pk for line in lines]).delete()
+    return order
+
+
+def place_order(user, address):
+    """Convert the user's cart into an Order using a fixed number of queries.
+
+    All SizeStock rows needed by the cart are locked in a single query in pk
+    order (so two checkouts touching the same SKUs always lock them in the
+    same order and cannot deadlock), the sales are appended to the inventory
+    ledger with one insert, the OrderItem snapshots are written with a
+    single bulk insert and the order history summary with one more.
+    Raises CheckoutError (and rolls back) if the cart is empty or any size is
+    missing / short on stock.
+
+    With STOCK_GROUP_COMMIT on (and reservations off) the stock is taken
+    through the group-commit coordinator instead; see `group_commit`.
+    """
+    if group_commit.enabled() and not reservations.enabled() and not transaction.get_connection().in_atomic_block:
+        return _place_order_grouped(user, address)
+    with transaction.atomic():
+        lines = list(
+            CartItem.objects.select_for_update()
+            .filter(user=user)
+            .select_related('product')
+            .order_by('pk')
+        )
+        if not lines:
+            raise CheckoutError('Your cart is empty.')
+
+        needed = _needed(lines)
+
+        rows = list(
+            SizeStock.objects.select_for_update()
+            .filter(_size_stock_filter(needed))
+            .annotate(live=ledger.live_stock())
+            .order_by('pk')
+        )
+        by_key = {(row.product_id, row.size): row for row in rows}
+        # with reservations on, units other shoppers hold aren't for sale; our
+        # own holds are converted simply by deleting the cart lines below
+        held = reservations.held_by_others(user, needed) if reservations.enabled() else {}
+        for line in lines:
+            key = (line.product_id, line.size)
+            row = by_key.get(key)
+            if row is None:
+                raise CheckoutError('Product size not available.')
+            if row.live - held.get(key, 0) < needed[key]:
+                raise CheckoutError(f'Insufficient stock for {line.product.name} size {line.size}.')
+
+        # the size rows stay locked until commit, so appending the sales is enough
+        ledger.record([(product_id, size, -qty) for (product_id, size), qty in needed.items()], StockMovement.KIND_SALE)
+        update_stock_aggregates([
+            (row.product_id, row.size, -needed[(row.product_id, row.size)], row.live > needed[(row.product_id, row.size)])
+            for row in rows
+        ])
+
+        order = _create_order(user, address, lines)
+    return order
+
+
+def _place_order_grouped(user, address):
+    lines = list(CartItem.objects.filter(user=user).select_related('product').order_by('pk'))
+    if not lines:
+        raise CheckoutError('Your cart is empty.')
+    needed = _needed(lines)
+    results = group_commit.coordinator.decrement(needed)
+    taken = {key: needed[key] for key, ok in results.items() if ok}
+    names = {(line.product_id, line.size): line.product.name for line in lines}
+    try:
+        for key, ok in results.items():
+            if ok is None:
+                raise CheckoutError('Product size not available.')
+            if not ok:
+                raise CheckoutError(f'Insufficient stock for {names[key]} size {key[1]}.')
+        with transaction.atomic():
+            # the stock was taken for the cart as read above; refuse if it changed since
+            locked = set(
+                CartItem.objects.select_for_update()
+                .filter(user=user, pk__in=[line.pk for line in lines])
+                .values_list('pk', 'product_id', 'size', 'quantity')
+            )
+            if locked != {(line.pk, line.product_id, line.size, line.quantity) for line in lines}:
+                raise CheckoutError('Your cart changed during checkout, please try again.')
+            return _create_order(user, address, lines)
+    except BaseException:
+        group_commit.restock(taken)
+        raise
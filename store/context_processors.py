@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import CartSummary, cart_totals
+
+
+def cart(request):
+    """`cart_badge` for the header: cart totals, only queried if a template uses it."""
+    def badge():
+        shop_user = getattr(request, 'shop_user', None) or (request.user if request.user.is_authenticated else None)
+        return cart_totals(shop_user) if shop_user else CartSummary(None, 0, 0, 0)
+    return {'cart_badge': SimpleLazyObject(badge)}
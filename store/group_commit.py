@@ -0,0 +1,148 @@
+"""Group-commit stock decrements for hot SKUs (STOCK_GROUP_COMMIT).
+
+Normally every checkout locks its SizeStock rows until its order is
+written, so checkouts of a popular size run one at a time. With group
+commit on, checkouts take their units through a per-process coordinator
+instead: concurrent requests for the same (product, size) join a batch,
+and one of them (the leader) applies the whole batch in its own short
+transaction: one locking read, one ledger insert, one aggregate update.
+Units are handed out in arrival order and each request learns whether it
+got its quantity. The order itself is then written without
+touching the size row; if that fails, the units are put back.
+
+Batches only form between threads of one process (threaded WSGI/ASGI
+workers); a process serving one request at a time gets no benefit.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import ledger
+from .models import SizeStock, StockMovement, update_stock_aggregates
+
+
+def enabled():
+    return getattr(settings, 'STOCK_GROUP_COMMIT', False)
+
+
+def window():
+    return getattr(settings, 'STOCK_GROUP_COMMIT_WINDOW_MS', 2) / 1000
+
+
+class _Batch:
+    def __init__(self, key):
+        self.key = key
+        self.quantities = []
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def _apply(key, quantities):
+    """Take `quantities` of one size in arrival order. Returns a result per quantity:
+    True (taken), False (not enough left) or None (no such size)."""
+    product_id, size = key
+    with transaction.atomic():
+        live = (
+            SizeStock.objects.select_for_update().filter(product_id=product_id, size=size)
+            .annotate(live=ledger.live_stock()).values_list('live', flat=True).first()
+        )
+        if live is None:
+            return [None] * len(quantities)
+        left = live
+        results = []
+        for quantity in quantities:
+            results.append(quantity <= left)
+            if quantity <= left:
+                left -= quantity
+        taken = live - left
+        if taken:
+            ledger.record([(product_id, size, -taken)], StockMovement.KIND_SALE)
+            update_stock_aggregates([(product_id, size, -taken, left > 0)])
+    return results
+
+
+def restock(taken):
+    """Put back units taken for a checkout that didn't complete. `taken` is {(product_id, size): qty}."""
+    if not taken:
+        return
+    with transaction.atomic():
+        changes = [(product_id, size, quantity) for (product_id, size), quantity in taken.items()]
+        ledger.record(changes, StockMovement.KIND_ADJUST)
+        update_stock_aggregates([change + (True,) for change in changes])
+
+
+class StockCoordinator:
+    """Collects concurrent decrements per (product_id, size) into batches.
+
+    The first request for a size opens a batch and leads it: it waits
+    `window()` and for the size's previous batch to finish (requests keep
+    joining meanwhile), then applies the batch. A request leading several
+    batches handles them in key order before waiting on anyone else's, so
+    leaders never wait on each other in a cycle.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = {}
+        self._running = {}
+        self.batches = 0
+        self.requests = 0
+
+    def decrement(self, needed):
+        """Take `needed` ({(product_id, size): qty}). Returns {key: True/False/None} as `_apply`.
+
+        If any size's batch fails, the units taken for the other sizes are
+        put back before its error is raised.
+        """
+        joined = []
+        led = []
+        with self._lock:
+            for key, quantity in needed.items():
+                batch = self._open.get(key)
+                if batch is None:
+                    batch = self._open[key] = _Batch(key)
+                    led.append(batch)
+                joined.append((batch, len(batch.quantities)))
+                batch.quantities.append(quantity)
+            self.requests += 1
+        if led:
+            time.sleep(window())
+        for batch in sorted(led, key=lambda b: b.key):
+            self._lead(batch)
+        results = {}
+        error = None
+        for batch, index in joined:
+            batch.done.wait()
+            if batch.error is not None:
+                error = error or batch.error
+            else:
+                results[batch.key] = batch.results[index]
+        if error is not None:
+            restock({key: needed[key] for key, ok in results.items() if ok})
+            raise error
+        return results
+
+    def _lead(self, batch):
+        with self._lock:
+            previous = self._running.get(batch.key)
+        if previous is not None:
+            previous.done.wait()
+        with self._lock:
+            del self._open[batch.key]
+            self._running[batch.key] = batch
+            self.batches += 1
+        try:
+            batch.results = _apply(batch.key, batch.quantities)
+        except Exception as exc:
+            batch.error = exc
+        finally:
+            with self._lock:
+                if self._running.get(batch.key) is batch:
+                    del self._running[batch.key]
+            batch.done.set()
+
+
+coordinator = StockCoordinator()
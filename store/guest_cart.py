@@ -0,0 +1,119 @@
+"""Cart and wishlist kept in the session for visitors who aren't logged in.
+
+The cart is stored as {"<product_id>:<size>": quantity}; `merge_into_user`
+moves it (and the guest wishlist) into the database on login with a fixed
+number of queries, however many lines it holds.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .cart import upsert_lines
+from .models import CartItem, Product, Wishlist, wishlist_version_name
+from .page_cache import bump_versions
+
+SESSION_KEY = 'guest_cart'
+WISHLIST_SESSION_KEY = 'guest_wishlist'
+# sessions from before the guest cart remembered a single pending item here
+LEGACY_INTENT_KEY = 'cart_intent'
+
+
+def max_lines():
+    return getattr(settings, 'GUEST_CART_MAX_LINES', 100)
+
+
+def _key(product_id, size):
+    return f'{product_id}:{size}'
+
+
+def get_lines(session):
+    """[(product_id, size, quantity)] in the guest cart (invalid entries are skipped)."""
+    lines = []
+    for key, quantity in (session.get(SESSION_KEY) or {}).items():
+        product_id, _, size = key.partition(':')
+        try:
+            lines.append((int(product_id), size, int(quantity)))
+        except (TypeError, ValueError):
+            continue
+    return lines
+
+
+def quantity_of(session, product_id, size):
+    return int((session.get(SESSION_KEY) or {}).get(_key(product_id, size), 0))
+
+
+def add(session, product_id, size, quantity):
+    """Add `quantity` of a product size. Returns False when the cart is full."""
+    cart = dict(session.get(SESSION_KEY) or {})
+    key = _key(product_id, size)
+    if key not in cart and len(cart) >= max_lines():
+        return False
+    cart[key] = int(cart.get(key, 0)) + quantity
+    session[SESSION_KEY] = cart
+    return True
+
+
+def _pop_lines(session):
+    lines = get_lines(session)
+    session.pop(SESSION_KEY, None)
+    intent = session.pop(LEGACY_INTENT_KEY, None)
+    if intent:
+        try:
+            lines.append((int(intent.get('product_id')), intent.get('size'), int(intent.get('quantity') or 1)))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return lines
+
+
+def _pop_wishlist(session):
+    ids = set()
+    for pid in session.pop(WISHLIST_SESSION_KEY, None) or []:
+        try:
+            ids.add(int(pid))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+def merge_into_user(session, user):
+    """Move the session's guest cart and wishlist into `user`'s, in one transaction.
+
+    The cart is written by a single `upsert_lines` statement (lines for
+    unknown sizes, or that would exceed the stock of the size, are dropped)
+    with a read of the affected lines before and after, then one query
+    checks the wishlisted products exist and one ignore-conflicts insert
+    writes them. Returns the (product_id, size) keys of the cart lines
+    merged and of those dropped.
+    """
+    wanted = {}
+    dropped = set()
+    for product_id, size, quantity in _pop_lines(session):
+        if size in dict(CartItem.SIZE_CHOICES) and quantity > 0:
+            wanted[(product_id, size)] = wanted.get((product_id, size), 0) + quantity
+        else:
+            dropped.add((product_id, size))
+    wishlist_ids = _pop_wishlist(session)
+    merged = set()
+    with transaction.atomic():
+        if wanted:
+            before = _quantities(user, wanted)
+            upsert_lines(user, [(product_id, size, qty) for (product_id, size), qty in wanted.items()])
+            # the upsert's row count can't say which lines went in (MySQL counts an update twice)
+            after = _quantities(user, wanted)
+            merged = {key for key in wanted if after.get(key, 0) > before.get(key, 0)}
+            dropped |= set(wanted) - merged
+        if wishlist_ids:
+            wishlist_ids = set(Product.objects.filter(pk__in=wishlist_ids).values_list('pk', flat=True))
+        if wishlist_ids:
+            Wishlist.objects.bulk_create(
+                [Wishlist(user=user, product_id=product_id) for product_id in wishlist_ids],
+                ignore_conflicts=True,
+            )
+            # bulk_create skips the signal that bumps the wishlist version
+            bump_versions(wishlist_version_name(user.pk))
+    return sorted(merged), sorted(dropped)
+
+
+def _quantities(user, keys):
+    product_ids = {product_id for product_id, _ in keys}
+    rows = CartItem.objects.filter(user=user, product_id__in=product_ids).values_list('product_id', 'size', 'quantity')
+    return {(product_id, size): quantity for product_id, size, quantity in rows if (product_id, size) in keys}
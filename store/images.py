@@ -0,0 +1,156 @@
+"""Responsive derivatives for Product.image.
+
+Every product image gets resized WebP and JPEG copies at the widths in
+`PRODUCT_IMAGE_WIDTHS`, written next to the originals under
+`products/derivatives/`. Rendering happens in a process pool so uploads
+don't block the request; `render_derivatives` only touches files (no ORM)
+so it is safe to run in a spawned worker.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = 'products/derivatives'
+DERIVATIVE_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+DEFAULT_WIDTHS = (160, 320, 640, 960)
+
+_pool = None
+
+
+def image_widths():
+    return tuple(sorted(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', DEFAULT_WIDTHS)))
+
+
+def derivative_stem(image_name):
+    """`products/shirt.jpg` -> `shirt_jpg` (keeps the extension so a.png and a.jpg don't clash)."""
+    return Path(image_name).name.replace('.', '_')
+
+
+def derivative_name(image_name, digest, width, ext):
+    return f'{DERIVATIVE_DIR}/{derivative_stem(image_name)}-{digest[:12]}-{width}.{ext}'
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def render_derivatives(image_name, media_root, widths, known_hash='', quality=80, force=False, keep=()):
+    """Write the derivatives for one image and return (digest, widths_written).
+
+    `widths_written` is None when the source hash still matches `known_hash`
+    and nothing had to be regenerated. Derivatives of earlier versions are
+    removed, except those of the digests in `keep` (see `referenced_hashes`).
+    """
+    source = os.path.join(media_root, image_name)
+    digest = file_hash(source)
+    if digest == known_hash and not force:
+        return digest, None
+    out_dir = os.path.join(media_root, DERIVATIVE_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    with Image.open(source) as im:
+        im = ImageOps.exif_transpose(im).convert('RGB')
+        # never upscale: widths wider than the source collapse to the source width
+        targets = sorted({min(w, im.width) for w in widths})
+        for width in targets:
+            resized = im if width == im.width else im.resize(
+                (width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+            for ext, fmt in DERIVATIVE_FORMATS.items():
+                resized.save(os.path.join(media_root, derivative_name(image_name, digest, width, ext)),
+                             fmt, quality=quality, optimize=True)
+    # drop derivatives of previous versions of this image
+    prefix = derivative_stem(image_name) + '-'
+    kept = tuple(prefix + h[:12] + '-' for h in {digest, *keep})
+    for entry in os.scandir(out_dir):
+        if entry.name.startswith(prefix) and not entry.name.startswith(kept):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    return digest, targets
+
+
+def referenced_hashes(product_ids=None):
+    """{product_id: digests} of the images stored in OrderSummary.thumbnails.
+
+    Order history keeps showing the derivatives a summary was built with, so
+    they must survive the product's image changing. Limited to `product_ids`
+    when given.
+    """
+    from .models import OrderItem, OrderSummary
+    summaries = OrderSummary.objects.all()
+    if product_ids is not None:
+        summaries = summaries.filter(
+            order__in=OrderItem.objects.filter(product_id__in=product_ids).values('order_id'))
+    wanted = None if product_ids is None else set(product_ids)
+    referenced = {}
+    for thumbnails in summaries.values_list('thumbnails', flat=True).iterator():
+        for t in thumbnails:
+            if t.get('image_hash') and (wanted is None or t['product_id'] in wanted):
+                referenced.setdefault(t['product_id'], set()).add(t['image_hash'])
+    return referenced
+
+
+def get_pool(workers=None):
+    """Process pool shared by the web process (created on first use)."""
+    global _pool
+    if _pool is None:
+        workers = workers or getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2)
+        # spawn: don't fork a (possibly threaded) web worker holding DB connections
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _record_result(product_id, image_name, future):
+    from django.db import connection
+    from .models import Product
+    from .page_cache import bump_versions
+    try:
+        digest, widths = future.result()
+    except Exception:
+        logger.exception('Could not build image derivatives for product %s', product_id)
+        return
+    try:
+        if widths is not None:
+            # only if the product still points at the image we rendered
+            if Product.objects.filter(pk=product_id, image=image_name).update(
+                    image_hash=digest, image_widths=','.join(str(w) for w in widths)):
+                bump_versions('catalog', product_ids=[product_id])
+    finally:
+        connection.close()
+
+
+def schedule_derivatives(product):
+    """Queue derivative generation for `product` in the background pool."""
+    if not product.image or getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2) <= 0:
+        return None
+    keep = referenced_hashes([product.pk]).get(product.pk, ())
+    future = get_pool().submit(
+        render_derivatives, product.image.name, str(settings.MEDIA_ROOT), image_widths(),
+        product.image_hash, keep=keep,
+    )
+    future.add_done_callback(lambda f, pk=product.pk, name=product.image.name: _record_result(pk, name, f))
+    return future
+
+
+def srcset_for(product, ext):
+    """`srcset` attribute value for the derivatives of `product.image`, or ''."""
+    if not product.image or not product.image_hash or not product.image_widths:
+        return ''
+    from django.core.files.storage import default_storage
+    parts = []
+    for width in product.image_widths.split(','):
+        url = default_storage.url(derivative_name(product.image.name, product.image_hash, width, ext))
+        parts.append(f'{url} {width}w')
+    return ', '.join(parts)
@@ -0,0 +1,149 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Floor
+
+from .ledger import live_stock, record
+from .models import OrderItem, Product, SizeStock, StockMovement, update_stock_aggregates
+
+
+def default_restock_qty(initial_total_stock):
+    """Per-size restock target used after delivery: an even fifth of the product's initial stock, at least 2."""
+    qty = (initial_total_stock // 5) if initial_total_stock else 2
+    return qty if qty > 0 else 2
+
+
+def restock_out_of_stock(pairs):
+    """Restock every sold-out size among `pairs` ((product_id, size) tuples).
+
+    Uses one locking SELECT and one ledger insert no matter how many pairs are given.
+    Sizes with no SizeStock row at all are created, unless someone else creates
+    them first. Returns the number of size rows restocked or created.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    q = Q()
+    for product_id, size in pairs:
+        q |= Q(product_id=product_id, size=size)
+    with transaction.atomic():
+        rows = list(
+            SizeStock.objects.select_for_update(of=('self',))
+            .filter(q)
+            .annotate(live=live_stock())
+            .values_list('pk', 'product_id', 'size', 'live', 'product__initial_total_stock')
+        )
+        targets = {pk: (product_id, size, default_restock_qty(initial))
+                   for pk, product_id, size, stock, initial in rows if stock == 0}
+        record(targets.values(), StockMovement.KIND_RESTOCK)
+        missing = pairs - {(product_id, size) for _, product_id, size, _, _ in rows}
+        created = []
+        if missing:
+            initial = dict(Product.objects.filter(pk__in={p for p, _ in missing}).values_list('pk', 'initial_total_stock'))
+            for product_id, size in missing:
+                if product_id not in initial:
+                    continue
+                size_stock = SizeStock(product_id=product_id, size=size, stock=default_restock_qty(initial[product_id]),
+                                       status=SizeStock.STATUS_IN)
+                # one at a time: a row another request created meanwhile must
+                # not be counted (or added to the aggregates) as ours
+                try:
+                    with transaction.atomic():
+                        size_stock.save(force_insert=True)
+                except IntegrityError:
+                    continue
+                created.append(size_stock)
+        update_stock_aggregates(
+            [(product_id, size, qty, True) for product_id, size, qty in targets.values()]
+            + [(ss.product_id, ss.size, ss.stock, True) for ss in created]
+        )
+    return len(targets) + len(created)
+
+
+def return_order_items(order_ids):
+    """Put the units of the given orders' items back in stock (cancellation).
+
+    One aggregate query, one ledger insert and one product aggregate
+    UPDATE, however many orders and items. Returns the units returned.
+    """
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids).values('product_id', 'size')
+        .annotate(units=Sum('quantity')).order_by().values_list('product_id', 'size', 'units')
+    )
+    changes = [(product_id, size, units) for product_id, size, units in rows if units]
+    if not changes:
+        return 0
+    with transaction.atomic():
+        record(changes, StockMovement.KIND_RETURN)
+        update_stock_aggregates([change + (True,) for change in changes])
+    return sum(units for _, _, units in changes)
+
+
+def _fallback_qty():
+    qty = getattr(settings, 'RESTOCK_SIZE_QUANTITY', 2)
+    return qty if qty and qty > 0 else 2
+
+
+def restock_target_expression(prefer_setting=False):
+    """SQL expression for a SizeStock row's restock target.
+
+    With `prefer_setting` a positive RESTOCK_SIZE_QUANTITY wins outright;
+    otherwise (or when it's unset) the target is initial_total_stock // 5,
+    falling back to RESTOCK_SIZE_QUANTITY (or 2) for small products.
+    """
+    setting = getattr(settings, 'RESTOCK_SIZE_QUANTITY', None)
+    if prefer_setting and setting and setting > 0:
+        return Value(setting, output_field=IntegerField())
+    return Case(
+        When(product__initial_total_stock__gte=5,
+             then=Cast(Floor(F('product__initial_total_stock') / 5), IntegerField())),
+        default=Value(_fallback_qty()),
+        output_field=IntegerField(),
+    )
+
+
+def bulk_restock(size_stocks, prefer_setting=False, chunk_size=500, dry_run=False):
+    """Restock every SizeStock in `size_stocks` to its restock target.
+
+    Targets are computed in the database and only rows whose live stock
+    differs are touched. Each chunk re-locks its rows, appends one restock
+    movement per row and applies one product aggregate UPDATE. Returns the
+    number of rows changed (or that would change, with `dry_run`).
+    """
+    pending = (
+        size_stocks.annotate(restock_target=restock_target_expression(prefer_setting), live=live_stock())
+        .exclude(live=F('restock_target'))
+        .order_by('pk')
+        .values_list('pk', 'restock_target')
+    )
+    if dry_run:
+        return pending.count()
+    changed = 0
+    chunk = []
+    for pk, target in pending.iterator(chunk_size=chunk_size):
+        chunk.append((pk, int(target)))
+        if len(chunk) >= chunk_size:
+            changed += _apply_restock_chunk(dict(chunk))
+            chunk = []
+    if chunk:
+        changed += _apply_restock_chunk(dict(chunk))
+    return changed
+
+
+def _apply_restock_chunk(targets):
+    with transaction.atomic():
+        rows = list(
+            SizeStock.objects.select_for_update()
+            .filter(pk__in=targets)
+            .annotate(live=live_stock())
+            .values_list('pk', 'product_id', 'size', 'live')
+        )
+        rows = [row for row in rows if row[3] != targets[row[0]]]
+        if not rows:
+            return 0
+        changes = [(product_id, size, targets[pk] - stock) for pk, product_id, size, stock in rows]
+        record(changes, StockMovement.KIND_RESTOCK)
+        update_stock_aggregates([
+            (product_id, size, targets[pk] - stock, targets[pk] > 0) for pk, product_id, size, stock in rows
+        ])
+    return len(rows)
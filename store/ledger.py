@@ -0,0 +1,126 @@
+"""Inventory ledger: stock changes are appended as StockMovement rows.
+
+A size's live stock is its SizeStock snapshot (`stock`, which covers every
+movement up to `ledger_position`) plus the movements recorded since.
+Writers insert movements instead of rewriting the size row, which keeps
+an audit trail of every sale, restock and adjustment. Sales still lock the
+size row while they check the live stock, so two checkouts can't sell the
+same units. `compact` (the `compact_inventory` command) periodically folds
+movements into the snapshots so the pending part stays short.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import SizeStock, StockMovement, update_stock_aggregates
+
+
+def _pending(upto=None):
+    movements = StockMovement.objects.filter(
+        product_id=OuterRef('product_id'), size=OuterRef('size'), pk__gt=OuterRef('ledger_position'),
+    )
+    if upto is not None:
+        movements = movements.filter(pk__lte=upto)
+    total = movements.order_by().values('product_id', 'size').annotate(total=Sum('delta')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def live_stock():
+    """Expression for a SizeStock row's live stock (snapshot plus pending movements)."""
+    return F('stock') + _pending()
+
+
+def live_stock_sql(alias):
+    """The same as raw SQL, for a size stock table aliased `alias`."""
+    return (
+        f'({alias}.stock + COALESCE((SELECT SUM(m.delta) FROM {StockMovement._meta.db_table} m '
+        f'WHERE m.product_id = {alias}.product_id AND m.size = {alias}.size AND m.id > {alias}.ledger_position), 0))'
+    )
+
+
+def pending_delta(size_stock):
+    """Units moved since `size_stock`'s snapshot."""
+    return StockMovement.objects.filter(
+        product_id=size_stock.product_id, size=size_stock.size, pk__gt=size_stock.ledger_position,
+    ).aggregate(total=Sum('delta'))['total'] or 0
+
+
+def record(changes, kind):
+    """Append a movement per (product_id, size, delta) in `changes` (zero deltas are skipped)."""
+    movements = [
+        StockMovement(product_id=product_id, size=size, delta=delta, kind=kind)
+        for product_id, size, delta in changes if delta
+    ]
+    StockMovement.objects.bulk_create(movements)
+    return len(movements)
+
+
+def live_stock_of(size_stock):
+    return size_stock.stock + pending_delta(size_stock)
+
+
+def move(product_id, size, delta, kind):
+    """Record one movement and apply it to the product aggregates. Returns the live stock afterwards."""
+    # one transaction, so nobody sees the movement without its aggregate change
+    with transaction.atomic():
+        record([(product_id, size, delta)], kind)
+        live = SizeStock.objects.filter(product_id=product_id, size=size).annotate(live=live_stock()).values_list('live', flat=True).first() or 0
+        update_stock_aggregates([(product_id, size, delta, live > 0)])
+    return live
+
+
+def set_live(size_stock, target, kind):
+    """Record the movement that brings `size_stock` to `target` live units. Returns the delta."""
+    with transaction.atomic():
+        current = (
+            SizeStock.objects.select_for_update().filter(pk=size_stock.pk)
+            .annotate(live=live_stock()).values_list('live', flat=True).first()
+        )
+        if current is None or current == target:
+            return 0
+        record([(size_stock.product_id, size_stock.size, target - current)], kind)
+        update_stock_aggregates([(size_stock.product_id, size_stock.size, target - current, target > 0)])
+    return target - current
+
+
+def compaction_lag():
+    return datetime.timedelta(seconds=getattr(settings, 'INVENTORY_COMPACTION_LAG', 60))
+
+
+def compact(batch_size=500):
+    """Fold movements into the SizeStock snapshots. Returns the number of size rows updated.
+
+    Only movements older than INVENTORY_COMPACTION_LAG are folded, so a
+    movement whose transaction committed late (with an id below ones already
+    visible) isn't skipped over. Each batch of rows is one UPDATE that adds
+    the pending sum and advances `ledger_position`, then one status UPDATE.
+    """
+    upto = StockMovement.objects.filter(
+        created_at__lt=timezone.now() - compaction_lag(),
+    ).aggregate(upto=Max('pk'))['upto']
+    if not upto:
+        return 0
+    behind = SizeStock.objects.filter(ledger_position__lt=upto).filter(Exists(
+        StockMovement.objects.filter(
+            product_id=OuterRef('product_id'), size=OuterRef('size'),
+            pk__gt=OuterRef('ledger_position'), pk__lte=upto,
+        )
+    )).order_by('pk').values_list('pk', flat=True)
+    compacted = 0
+    while True:
+        pks = list(behind[:batch_size])
+        if not pks:
+            return compacted
+        with transaction.atomic():
+            # `stock` is assigned before `ledger_position`, so MySQL (which
+            # applies SET clauses left to right) still sums from the old position
+            SizeStock.objects.filter(pk__in=pks).update(stock=F('stock') + _pending(upto), ledger_position=upto)
+            SizeStock.objects.filter(pk__in=pks).update(status=Case(
+                When(stock__gt=0, then=Value(SizeStock.STATUS_IN)),
+                default=Value(SizeStock.STATUS_OUT),
+            ))
+        compacted += len(pks)
@@ -0,0 +1,131 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+
+from store.models import Category, Product, Wishlist
+
+PREFIX = 'bench-asgi'
+DEFAULT_PATHS = ('/api/wishlist/status/?product_id={pid}', '/api/wishlist/', '/api/wishlist/status/batch/?ids={ids}')
+
+
+class Command(BaseCommand):
+    help = ('Compare concurrent throughput of the JSON endpoints under ecommerce.wsgi (a pool of worker '
+            'threads) and ecommerce.asgi (one event loop), in process (creates and removes its own data)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per run')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight (ASGI)')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request (repeatable); {pid} and {ids} are filled in')
+
+    def handle(self, *args, **options):
+        from ecommerce.asgi import application as asgi_app
+        from ecommerce.wsgi import application as wsgi_app
+
+        user, session, paths = self._setup(options['paths'] or DEFAULT_PATHS)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+        try:
+            total = options['requests']
+            wsgi = self._run_wsgi(wsgi_app, paths, cookie, total, options['threads'])
+            asgi = asyncio.run(self._run_asgi(asgi_app, paths, cookie, total, options['concurrency']))
+            for label, (elapsed, latencies, errors) in (('wsgi', wsgi), ('asgi', asgi)):
+                latencies.sort()
+                self.stdout.write(
+                    f'{label}: {total / elapsed:.0f} req/s, p50 {statistics.median(latencies) * 1000:.1f}ms, '
+                    f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms, {errors} errors'
+                )
+        finally:
+            Product.objects.filter(name__startswith=PREFIX).delete()
+            Category.objects.filter(name=PREFIX).delete()
+            session.delete()
+            user.delete()
+
+    def _setup(self, paths):
+        category, _ = Category.objects.get_or_create(name=PREFIX)
+        products = [Product.objects.create(category=category, name=f'{PREFIX}-{i}', price='10.00',
+                                           specification=PREFIX) for i in range(20)]
+        user, _ = User.objects.get_or_create(username=PREFIX)
+        Wishlist.objects.bulk_create([Wishlist(user=user, product=p) for p in products[::2]])
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        ids = ','.join(str(p.pk) for p in products)
+        return user, session, [path.format(pid=products[0].pk, ids=ids) for path in paths]
+
+    def _host(self):
+        hosts = [h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')]
+        return hosts[0] if hosts else 'localhost'
+
+    def _run_wsgi(self, app, paths, cookie, total, threads):
+        host = self._host()
+
+        def one(i):
+            path, _, query = paths[i % len(paths)].partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': host, 'SERVER_PORT': '80', 'HTTP_HOST': host, 'HTTP_COOKIE': cookie,
+                'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+                'wsgi.errors': io.StringIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            }
+            status = []
+            started = time.perf_counter()
+            body = app(environ, lambda s, headers, exc_info=None: status.append(s))
+            b''.join(body)
+            body.close()
+            return time.perf_counter() - started, not status[0].startswith('200')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(one, range(total)))
+        return time.perf_counter() - started, [r[0] for r in results], sum(r[1] for r in results)
+
+    async def _run_asgi(self, app, paths, cookie, total, concurrency):
+        host = self._host()
+        limit = asyncio.Semaphore(concurrency)
+        results = []
+
+        async def one(i):
+            path, _, query = paths[i % len(paths)].partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', host.encode()), (b'cookie', cookie.encode())],
+                'server': (host, 80), 'client': ('127.0.0.1', 0),
+            }
+            sent = []
+            disconnect = asyncio.Event()
+
+            async def receive():
+                if not sent:
+                    sent.append(None)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # the client stays connected until the handler is done with it
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            status = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with limit:
+                started = time.perf_counter()
+                await app(scope, receive, send)
+                results.append((time.perf_counter() - started, status[0] != 200))
+                disconnect.set()
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(total)])
+        return time.perf_counter() - started, [r[0] for r in results], sum(r[1] for r in results)
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections
+from django.test.utils import override_settings
+
+from store.checkout import CheckoutError, place_order
+from store.group_commit import coordinator
+from store.ledger import live_stock_of, set_live
+from store.models import Address, CartItem, Category, Product, SizeStock, StockMovement
+
+PREFIX = 'bench-hot-sku'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark checkouts of a single hot SKU with STOCK_GROUP_COMMIT off and on (creates and removes its own data)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent shoppers')
+        parser.add_argument('--orders', type=int, default=50, help='Orders per shopper')
+        parser.add_argument('--window-ms', type=float, default=2, help='STOCK_GROUP_COMMIT_WINDOW_MS for the "on" run')
+        parser.add_argument('--keep', action='store_true', help="Don't delete the benchmark data afterwards")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING('SQLite serialises all writers; run this against MySQL for meaningful numbers.'))
+        threads, per_thread = options['threads'], options['orders']
+        category, _ = Category.objects.get_or_create(name=PREFIX)
+        product = Product.objects.create(category=category, name=PREFIX, price='10.00', specification=PREFIX,
+                                         initial_total_stock=0)
+        SizeStock.objects.update_or_create(product=product, size='M', defaults={'stock': 0})
+        shoppers = []
+        for i in range(threads):
+            user, _ = User.objects.get_or_create(username=f'{PREFIX}-{i}')
+            address = Address.objects.create(user=user, address_line='1 Bench St', city='Bench', state='B',
+                                             postal_code='00000', country='Bench')
+            shoppers.append((user, address))
+        try:
+            for label, group in (('off', False), ('on', True)):
+                with override_settings(STOCK_GROUP_COMMIT=group, STOCK_GROUP_COMMIT_WINDOW_MS=options['window_ms']):
+                    self._run(label, product, shoppers, per_thread)
+        finally:
+            if not options['keep']:
+                product.delete()
+                User.objects.filter(username__startswith=f'{PREFIX}-').delete()
+                category.delete()
+
+    def _run(self, label, product, shoppers, per_thread):
+        # enough stock for every order, so only throughput is measured
+        size_stock = SizeStock.objects.get(product=product, size='M')
+        set_live(size_stock, len(shoppers) * per_thread, StockMovement.KIND_ADJUST)
+        counts = {'ok': 0, 'failed': 0}
+        lock = threading.Lock()
+        batches, requests = coordinator.batches, coordinator.requests
+
+        def shopper(user, address):
+            try:
+                for _ in range(per_thread):
+                    CartItem.objects.create(user=user, product=product, size='M', quantity=1)
+                    try:
+                        place_order(user, address)
+                        outcome = 'ok'
+                    except (CheckoutError, DatabaseError):
+                        CartItem.objects.filter(user=user).delete()
+                        outcome = 'failed'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=shopper, args=shopper_args) for shopper_args in shoppers]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        line = (f'group commit {label}: {counts["ok"]} orders ({counts["failed"]} failed) in {elapsed:.2f}s '
+                f'= {counts["ok"] / elapsed:.1f} orders/s')
+        if coordinator.requests > requests:
+            line += f', {(coordinator.requests - requests) / (coordinator.batches - batches):.1f} checkouts per batch'
+        self.stdout.write(line)
+        left = live_stock_of(SizeStock.objects.get(product=product, size='M'))
+        if left != len(shoppers) * per_thread - counts['ok']:
+            self.stdout.write(self.style.ERROR(f'stock mismatch: {left} left'))
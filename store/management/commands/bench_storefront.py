@@ -0,0 +1,251 @@
+import datetime
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from store.cart import add_item
+from store.models import Address, CartItem, Category, Order, OrderItem, Product
+from store.orders import refresh_summaries
+
+PREFIX = 'bench-load'
+SIZES = ('S', 'M', 'L', 'XL', 'XXL')
+SCENARIOS = ('product_list', 'product_detail', 'add_to_cart', 'checkout', 'my_orders', 'delivery_dashboard')
+ADDRESS = {'address_line': '1 Bench St', 'city': 'Bench', 'state': 'B', 'postal_code': '00000', 'country': 'Bench'}
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Load-test the storefront and checkout views with concurrent in-process clients and report '
+            'throughput, latency percentiles and SQL queries per request (creates and removes its own data)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200, help='Products in the seeded catalog')
+        parser.add_argument('--users', type=int, default=50, help='Seeded shoppers')
+        parser.add_argument('--orders', type=int, default=500, help='Seeded past orders, spread over the shoppers')
+        parser.add_argument('--stock', type=int, default=10000, help='Initial stock per product')
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per client and scenario')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per client before each scenario')
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=SCENARIOS,
+                            help='Scenario to run (repeatable, default all)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the data and request mix')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Compare against the results in this JSON file')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative slowdown against the baseline before flagging (0.2 = 20%%)')
+        parser.add_argument('--keep', action='store_true', help="Don't delete the benchmark data afterwards")
+
+    def handle(self, *args, **options):
+        if options['clients'] > options['users']:
+            raise CommandError('--clients can not exceed --users (each client logs in as its own shopper)')
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING('SQLite serialises all writers; write scenarios will queue up.'))
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        rng = random.Random(options['seed'])
+        try:
+            category, product_ids, users = self._seed(options, rng)
+            results = {}
+            for name in options['scenarios'] or SCENARIOS:
+                results[name] = self._run(name, category, product_ids, users[:options['clients']], options)
+                self._report(name, results[name])
+        finally:
+            if not options['keep']:
+                Product.objects.filter(name__startswith=PREFIX).delete()
+                User.objects.filter(username__startswith=f'{PREFIX}-').delete()
+                Category.objects.filter(name=PREFIX).delete()
+        run = {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'vendor': connection.vendor,
+            'config': {key: options[key] for key in ('products', 'users', 'orders', 'clients', 'requests', 'seed')},
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(run, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if baseline is not None:
+            regressions = self._compare(run, baseline, options['threshold'])
+            if regressions:
+                raise CommandError(f'{regressions} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def _seed(self, options, rng):
+        category, _ = Category.objects.get_or_create(name=PREFIX)
+        product_ids = [
+            Product.objects.create(category=category, name=f'{PREFIX}-{i}', price=f'{rng.randint(5, 200)}.00',
+                                   specification=PREFIX, initial_total_stock=options['stock']).pk
+            for i in range(options['products'])
+        ]
+        # clients are logged in with force_login, so nobody needs a usable password
+        password = make_password(None)
+        User.objects.bulk_create([User(username=f'{PREFIX}-{i}', password=password) for i in range(options['users'])])
+        users = list(User.objects.filter(username__startswith=f'{PREFIX}-').order_by('pk'))
+        Address.objects.bulk_create([Address(user=user, **ADDRESS) for user in users])
+        addresses = dict(Address.objects.filter(user__in=users).values_list('user_id', 'pk'))
+        statuses = [status for status, _ in Order.STATUS_CHOICES]
+        labels = dict(Order.STATUS_CHOICES)
+        placed = []
+        for _ in range(options['orders']):
+            status = rng.choice(statuses)
+            user = rng.choice(users)
+            placed.append(Order(user=user, address_id=addresses[user.pk], total=0, status=status, tracking_status=labels[status]))
+        Order.objects.bulk_create(placed)
+        # bulk_create doesn't return ids on MySQL; read the orders back
+        orders = list(Order.objects.filter(user__in=users).order_by('pk'))
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+        items = []
+        for order in orders:
+            for product_id in rng.sample(product_ids, min(len(product_ids), rng.randint(1, 4))):
+                item = OrderItem(order=order, product_id=product_id, size=rng.choice(SIZES),
+                                 quantity=rng.randint(1, 3), price=prices[product_id])
+                order.total += item.price * item.quantity
+                items.append(item)
+        OrderItem.objects.bulk_create(items, batch_size=1000)
+        Order.objects.bulk_update(orders, ['total'], batch_size=1000)
+        refresh_summaries([order.pk for order in orders])
+        self.stdout.write(f'Seeded {len(product_ids)} products, {len(users)} shoppers, {len(orders)} orders')
+        return category, product_ids, users
+
+    def _host(self):
+        hosts = [h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')]
+        return hosts[0] if hosts else 'localhost'
+
+    def _client(self, user):
+        client = Client(HTTP_HOST=self._host(), raise_request_exception=False)
+        client.force_login(user)
+        session = client.session
+        session['shop_user_id'] = user.pk
+        session['delivery_partner_authenticated'] = True
+        session.save()
+        return client
+
+    def _request(self, name, client, user, category, product_ids, rng):
+        """One request of scenario `name`. Returns (response, ok)."""
+        if name == 'product_list':
+            response = client.get(reverse('product_list', args=[category.name]))
+        elif name == 'product_detail':
+            response = client.get(reverse('product_detail', args=[rng.choice(product_ids)]))
+        elif name == 'add_to_cart':
+            response = client.post(reverse('add_to_cart', args=[rng.choice(product_ids)]),
+                                   {'size': rng.choice(SIZES), 'quantity': 1})
+            # a refused add redirects back to the product page
+            return response, response.status_code == 302 and response.url == reverse('cart')
+        elif name == 'checkout':
+            response = client.post(reverse('cart'), ADDRESS)
+        elif name == 'my_orders':
+            response = client.get(reverse('my_orders'))
+        else:
+            response = client.get(reverse('delivery_dashboard'))
+        return response, response.status_code == 200
+
+    def _run(self, name, category, product_ids, users, options):
+        if name == 'checkout':
+            CartItem.objects.filter(user__in=users).delete()
+        samples = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def worker(index, user):
+            rng = random.Random(f'{options["seed"]}-{name}-{index}')
+            client = self._client(user)
+            queries = [0]
+
+            def count(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            try:
+                for i in range(options['warmup'] + options['requests']):
+                    if name == 'checkout':
+                        # filling the cart is setup, not part of the timed request
+                        add_item(user, rng.choice(product_ids), rng.choice(SIZES), 1)
+                    queries[0] = 0
+                    with ExitStack() as stack:
+                        for alias in connections:
+                            stack.enter_context(connections[alias].execute_wrapper(count))
+                        started = time.perf_counter()
+                        response, ok = self._request(name, client, user, category, product_ids, rng)
+                        elapsed = time.perf_counter() - started
+                    if i < options['warmup']:
+                        continue
+                    with lock:
+                        if ok:
+                            samples.append((elapsed, queries[0]))
+                        else:
+                            errors[0] += 1
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker, args=(i, user)) for i, user in enumerate(users)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        return {
+            'requests': len(samples) + errors[0],
+            'errors': errors[0],
+            'throughput': round(len(samples) / elapsed, 2),
+            'mean_ms': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries_per_request': round(statistics.fmean(s[1] for s in samples), 2) if samples else 0.0,
+        }
+
+    def _report(self, name, result):
+        line = (f'{name:<20} {result["throughput"]:>8.1f} req/s  p50 {result["p50_ms"]:>7.1f}ms  '
+                f'p95 {result["p95_ms"]:>7.1f}ms  p99 {result["p99_ms"]:>7.1f}ms  '
+                f'{result["queries_per_request"]:>5.1f} queries/req')
+        if result['errors']:
+            line += f'  {result["errors"]} errors'
+        self.stdout.write(line)
+
+    def _compare(self, run, baseline, threshold):
+        """Print each scenario's change against `baseline`; returns the number of regressions."""
+        if baseline.get('vendor') != run['vendor'] or baseline.get('config') != run['config']:
+            self.stdout.write(self.style.WARNING('The baseline was taken with a different database or configuration.'))
+        regressions = 0
+        for name, result in run['scenarios'].items():
+            base = baseline.get('scenarios', {}).get(name)
+            if base is None:
+                continue
+            problems = []
+            if result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+                problems.append(f'p95 {base["p95_ms"]:.1f} -> {result["p95_ms"]:.1f}ms')
+            if result['throughput'] < base['throughput'] * (1 - threshold):
+                problems.append(f'throughput {base["throughput"]:.1f} -> {result["throughput"]:.1f} req/s')
+            # query counts don't vary between runs, so any growth is a change in the code
+            if result['queries_per_request'] > base['queries_per_request'] + 0.5:
+                problems.append(f'queries {base["queries_per_request"]:.1f} -> {result["queries_per_request"]:.1f}')
+            if result['errors'] > base['errors']:
+                problems.append(f'errors {base["errors"]} -> {result["errors"]}')
+            if problems:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f'{name}: ' + ', '.join(problems)))
+            else:
+                self.stdout.write(f'{name}: ok')
+        return regressions
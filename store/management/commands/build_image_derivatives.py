@@ -0,0 +1,49 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from store.images import image_widths, referenced_hashes, render_derivatives
+from store.models import Product
+from store.page_cache import bump_versions
+
+
+class Command(BaseCommand):
+    help = 'Build responsive WebP/JPEG derivatives for product images whose source changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true', help='Regenerate even if the source hash is unchanged')
+        parser.add_argument('--quality', type=int, default=80)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('id', 'image', 'image_hash', 'image_widths')
+        media_root = str(settings.MEDIA_ROOT)
+        widths = image_widths()
+        referenced = referenced_hashes()
+        built, unchanged, failed = [], 0, 0
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=context) as pool:
+            jobs = {
+                pool.submit(render_derivatives, p.image.name, media_root, widths, p.image_hash,
+                            options['quality'], options['force'], referenced.get(p.pk, ())): p
+                for p in products.iterator()
+            }
+            for future in as_completed(jobs):
+                product = jobs[future]
+                try:
+                    digest, written = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'Product {product.pk} ({product.image.name}): {e}')
+                    continue
+                if written is None:
+                    unchanged += 1
+                    continue
+                product.image_hash = digest
+                product.image_widths = ','.join(str(w) for w in written)
+                built.append(product)
+        Product.objects.bulk_update(built, ['image_hash', 'image_widths'], batch_size=500)
+        bump_versions('catalog', product_ids=[p.pk for p in built])
+        self.stdout.write(self.style.SUCCESS(
+            f'Built derivatives for {len(built)} images ({unchanged} unchanged, {failed} failed)'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.ledger import compact
+
+
+class Command(BaseCommand):
+    help = 'Fold inventory ledger movements into the SizeStock snapshots (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Size rows per UPDATE statement')
+
+    def handle(self, *args, **options):
+        compacted = compact(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Compacted {compacted} size rows'))
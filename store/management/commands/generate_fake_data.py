@@ -0,0 +1,339 @@
+import datetime
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from store.models import (
+    SIZE_BITS, Address, CartItem, Category, Order, OrderItem, OrderSummary, Product, SizeStock, Wishlist,
+)
+from store.orders import format_address, thumbnail_count
+from store.page_cache import bump_versions
+from store.search import FTS_TABLE, SQLiteFTSBackend, get_backend
+
+SIZES = tuple(SIZE_BITS)
+ADJECTIVES = ('Classic', 'Slim', 'Relaxed', 'Vintage', 'Everyday', 'Premium', 'Organic', 'Urban', 'Summer', 'Winter')
+NOUNS = ('Tee', 'Shirt', 'Hoodie', 'Jacket', 'Jeans', 'Chinos', 'Sweater', 'Polo', 'Shorts', 'Dress', 'Skirt', 'Blazer')
+WORDS = ('cotton', 'soft', 'breathable', 'stretch', 'regular', 'fit', 'machine', 'wash', 'durable', 'lightweight',
+         'comfortable', 'tailored', 'casual', 'blend', 'linen', 'denim', 'ribbed', 'knit', 'classic', 'modern')
+CITIES = (('Mumbai', 'MH'), ('Delhi', 'DL'), ('Bengaluru', 'KA'), ('Chennai', 'TN'), ('Kolkata', 'WB'), ('Pune', 'MH'))
+# spreads popularity ranks over the catalog so the bestsellers aren't all the first products created
+SCATTER = 2654435761
+
+_cum_weights = {}
+
+
+def zipf_cum_weights(n, skew):
+    """Cumulative weights 1/rank**skew for ranks 1..n (skew 0 is uniform); cached per process."""
+    key = (n, skew)
+    if key not in _cum_weights:
+        total, weights = 0.0, []
+        for rank in range(1, n + 1):
+            total += rank ** -skew
+            weights.append(total)
+        _cum_weights[key] = weights
+    return _cum_weights[key]
+
+
+def pick(rng, n, skew, k=1):
+    """`k` indices below `n`, drawn with Zipf popularity."""
+    ranks = rng.choices(range(n), cum_weights=zipf_cum_weights(n, skew), k=k)
+    if n % SCATTER == 0:
+        return ranks
+    return [rank * SCATTER % n for rank in ranks]
+
+
+def product_name(i):
+    return f'{ADJECTIVES[i % len(ADJECTIVES)]} {NOUNS[i // len(ADJECTIVES) % len(NOUNS)]} {i + 1}'
+
+
+def product_price(plan, i):
+    # a pure function of the index, so order items price products without reading them back
+    return Decimal(500 + (i * 7919 + plan['seed'] * 104729) % 19500) / 100
+
+
+def user_address(plan, i):
+    """The address of user `i` (a pure function, like `product_price`)."""
+    city, state = CITIES[i % len(CITIES)]
+    return Address(
+        pk=plan['address_base'] + i + 1, user_id=plan['user_base'] + i + 1, address_line=f'{i * 37 % 999 + 1} Market Road',
+        city=city, state=state, postal_code=f'{100000 + i * 7919 % 900000}', country='India',
+    )
+
+
+def order_size(rng, mean, cap):
+    """Items in an order: geometric with the given mean, at least 1, at most `cap`."""
+    if mean <= 1:
+        return 1
+    count, p = 1, 1 / mean
+    while count < cap and rng.random() > p:
+        count += 1
+    return count
+
+
+@contextmanager
+def historical(model, field_name):
+    """Let bulk_create keep explicit values of an auto_now_add field."""
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def _setup_worker():
+    django.setup()
+
+
+def _products(plan, start, end, rng):
+    products, sizes = [], []
+    for i in range(start, end):
+        pk = plan['product_base'] + i + 1
+        specification = ' '.join(rng.choices(WORDS, k=rng.randint(20, 60)))
+        total, mask = 0, 0
+        for j, size in enumerate(SIZES):
+            stock = 0 if rng.random() < plan['out_of_stock'] else rng.randint(1, plan['stock'])
+            total += stock
+            mask |= SIZE_BITS[size] if stock else 0
+            sizes.append(SizeStock(
+                pk=plan['size_base'] + i * len(SIZES) + j + 1, product_id=pk, size=size, stock=stock,
+                status=SizeStock.STATUS_IN if stock else SizeStock.STATUS_OUT,
+            ))
+        products.append(Product(
+            pk=pk, category_id=plan['categories'][i % len(plan['categories'])], name=product_name(i),
+            image=plan['image'], specification=specification, blurb=Product.make_blurb(specification),
+            price=product_price(plan, i), initial_total_stock=total, stock_total=total, stock_size_mask=mask,
+        ))
+    Product.objects.bulk_create(products, batch_size=plan['batch_size'])
+    SizeStock.objects.bulk_create(sizes, batch_size=plan['batch_size'])
+    if isinstance(get_backend(), SQLiteFTSBackend):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, specification) '
+                f'SELECT id, name, specification FROM {Product._meta.db_table} WHERE id BETWEEN %s AND %s',
+                [products[0].pk, products[-1].pk],
+            )
+    return {'products': len(products), 'size stocks': len(sizes)}
+
+
+def _users(plan, start, end, rng):
+    joined = plan['now'] - datetime.timedelta(days=plan['days'])
+    users, addresses = [], []
+    for i in range(start, end):
+        pk = plan['user_base'] + i + 1
+        users.append(User(
+            pk=pk, username=f'{plan["username_prefix"]}{pk}', email=f'{plan["username_prefix"]}{pk}@example.com',
+            password=plan['password'], date_joined=joined + datetime.timedelta(seconds=rng.randrange(plan['days'] * 86400)),
+        ))
+        addresses.append(user_address(plan, i))
+    User.objects.bulk_create(users, batch_size=plan['batch_size'])
+    Address.objects.bulk_create(addresses, batch_size=plan['batch_size'])
+    return {'users': len(users), 'addresses': len(addresses)}
+
+
+def _order_status(rng, age_days):
+    # old orders have run their course; recent ones are spread over the pipeline
+    if age_days > 14:
+        roll = rng.random()
+        return Order.STATUS_CANCELLED if roll < 0.05 else Order.STATUS_DELIVERED if roll < 0.15 else Order.STATUS_COMPLETED
+    return rng.choice([status for status, _ in Order.STATUS_CHOICES])
+
+
+def _orders(plan, start, end, rng):
+    labels = dict(Order.STATUS_CHOICES)
+    orders, items, summaries = [], [], []
+    user_indices = pick(rng, plan['users'], plan['user_skew'], k=end - start)
+    for i, user_index in zip(range(start, end), user_indices):
+        pk = plan['order_base'] + i + 1
+        age = rng.random() * plan['days']
+        created_at = plan['now'] - datetime.timedelta(days=age)
+        status = _order_status(rng, age)
+        order = Order(
+            pk=pk, user_id=plan['user_base'] + user_index + 1, address_id=plan['address_base'] + user_index + 1,
+            created_at=created_at, total=0, status=status, tracking_status=labels[status],
+        )
+        thumbnails = []
+        count = order_size(rng, plan['items_per_order'], plan['max_items'])
+        for product_index in pick(rng, plan['products'], plan['product_skew'], k=count):
+            price, quantity = product_price(plan, product_index), 1 if rng.random() < 0.8 else rng.randint(2, 3)
+            product_id = plan['product_base'] + product_index + 1
+            items.append(OrderItem(order_id=pk, product_id=product_id, size=rng.choice(SIZES), quantity=quantity, price=price))
+            order.total += price * quantity
+            if len(thumbnails) < plan['thumbnails']:
+                thumbnails.append({
+                    'product_id': product_id, 'name': product_name(product_index), 'image': plan['image'],
+                    'image_hash': '', 'image_widths': '', 'quantity': quantity, 'price': str(price),
+                })
+        orders.append(order)
+        summaries.append(OrderSummary(
+            order_id=pk, user_id=order.user_id, created_at=created_at, total=order.total, status=status,
+            tracking_status=order.tracking_status, item_count=count,
+            shipping_address=format_address(user_address(plan, user_index)),
+            thumbnails=thumbnails,
+        ))
+    with historical(Order, 'created_at'):
+        Order.objects.bulk_create(orders, batch_size=plan['batch_size'])
+    OrderItem.objects.bulk_create(items, batch_size=plan['batch_size'])
+    OrderSummary.objects.bulk_create(summaries, batch_size=plan['batch_size'])
+    return {'orders': len(orders), 'order items': len(items), 'order summaries': len(summaries)}
+
+
+def _carts(plan, start, end, rng):
+    lines = []
+    for i in range(start, end):
+        if rng.random() >= plan['cart_fraction']:
+            continue
+        keys = {(product_index, rng.choice(SIZES)) for product_index in pick(rng, plan['products'], plan['product_skew'], k=rng.randint(1, 4))}
+        lines.extend(
+            CartItem(user_id=plan['user_base'] + i + 1, product_id=plan['product_base'] + product_index + 1,
+                     size=size, quantity=rng.randint(1, 2))
+            for product_index, size in sorted(keys)
+        )
+    CartItem.objects.bulk_create(lines, batch_size=plan['batch_size'])
+    return {'cart items': len(lines)}
+
+
+def _wishlists(plan, start, end, rng):
+    entries = []
+    for i in range(start, end):
+        wanted = round(rng.expovariate(1 / plan['wishlist_per_user'])) if plan['wishlist_per_user'] else 0
+        for product_index in sorted(set(pick(rng, plan['products'], plan['product_skew'], k=wanted))):
+            entries.append(Wishlist(user_id=plan['user_base'] + i + 1, product_id=plan['product_base'] + product_index + 1))
+    Wishlist.objects.bulk_create(entries, batch_size=plan['batch_size'])
+    return {'wishlist entries': len(entries)}
+
+
+TASKS = {'products': _products, 'users': _users, 'orders': _orders, 'carts': _carts, 'wishlists': _wishlists}
+
+
+def run_chunk(plan, task, start, end):
+    """Generate rows [start, end) of `task` in one transaction. The random
+    stream depends only on the seed, task and chunk, so the data doesn't
+    depend on how chunks are spread over workers."""
+    rng = random.Random(f'{plan["seed"]}:{task}:{start}')
+    with transaction.atomic():
+        return TASKS[task](plan, start, end, rng)
+
+
+class Command(BaseCommand):
+    help = ('Bulk-load a large synthetic data set (products, size stocks, users, addresses, carts, orders, '
+            'order items, order summaries and wishlists) with bulk_create, bypassing model signals')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--seed', type=int, default=1, help='Same seed and counts give the same data')
+        parser.add_argument('--product-skew', type=float, default=1.1,
+                            help='Zipf exponent of product popularity in orders, carts and wishlists (0 = uniform)')
+        parser.add_argument('--user-skew', type=float, default=0.8, help='Zipf exponent of orders per user (0 = uniform)')
+        parser.add_argument('--items-per-order', type=float, default=2.5, help='Mean items per order (geometric)')
+        parser.add_argument('--max-items', type=int, default=12, help='Most items in one order')
+        parser.add_argument('--cart-fraction', type=float, default=0.2, help='Share of users with a non-empty cart')
+        parser.add_argument('--wishlist-per-user', type=float, default=3, help='Mean wishlist entries per user')
+        parser.add_argument('--stock', type=int, default=50, help='Most units per size')
+        parser.add_argument('--out-of-stock', type=float, default=0.1, help='Share of sizes with no stock')
+        parser.add_argument('--days', type=int, default=365, help='Orders are spread over this many past days')
+        parser.add_argument('--image', default='', help='Image path (under MEDIA_ROOT) given to every product')
+        parser.add_argument('--password', help='Password of the generated users (default: unusable)')
+        parser.add_argument('--username-prefix', default='fake')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per transaction')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT')
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPUs, up to 8; always 1 on SQLite)')
+
+    def handle(self, *args, **options):
+        if min(options['products'], options['users']) < 1:
+            raise CommandError('--products and --users must be at least 1')
+        if options['orders'] < 0:
+            raise CommandError('--orders can not be negative')
+        workers = options['workers'] or min(os.cpu_count() or 1, 8)
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write(self.style.WARNING('SQLite allows one writer at a time; using a single worker.'))
+            workers = 1
+        plan = self._plan(options, workers)
+        chunk = options['chunk_size']
+        phases = [
+            [('products', options['products']), ('users', options['users'])],
+            # these point at the products, users and addresses of the first phase
+            [('orders', options['orders']), ('carts', options['users']), ('wishlists', options['users'])],
+        ]
+        totals = {}
+        started = time.perf_counter()
+        pool = None
+        if workers > 1:
+            # children must open their own connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker)
+        try:
+            for phase in phases:
+                chunks = [(plan, task, start, min(start + chunk, count)) for task, count in phase for start in range(0, count, chunk)]
+                if not chunks:
+                    continue
+                results = pool.map(run_chunk, *zip(*chunks)) if pool else (run_chunk(*args) for args in chunks)
+                for done, counts in enumerate(results, 1):
+                    for table, rows in counts.items():
+                        totals[table] = totals.get(table, 0) + rows
+                    if options['verbosity'] > 1 or done % 50 == 0:
+                        self.stdout.write(f'  {done}/{len(chunks)} chunks ({time.perf_counter() - started:.0f}s)')
+        finally:
+            if pool:
+                pool.shutdown()
+        with transaction.atomic():
+            bump_versions('catalog')
+        elapsed = time.perf_counter() - started
+        rows = sum(totals.values())
+        for table, count in totals.items():
+            self.stdout.write(f'{table}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s, {workers} worker(s))'
+        ))
+
+    def _plan(self, options, workers):
+        """Everything the workers need, including the first free primary key of each table.
+
+        Rows get explicit ids from those, so a worker can refer to rows
+        another worker creates without reading them back. Nothing else
+        should be writing these tables meanwhile.
+        """
+        categories = [Category.objects.get_or_create(name=name)[0].pk for name, _ in Category.CATEGORY_CHOICES]
+
+        def base(model):
+            return model.objects.aggregate(top=Max('pk'))['top'] or 0
+
+        return {
+            'seed': options['seed'],
+            'products': options['products'],
+            'users': options['users'],
+            'product_skew': options['product_skew'],
+            'user_skew': options['user_skew'],
+            'items_per_order': options['items_per_order'],
+            'max_items': max(options['max_items'], 1),
+            'cart_fraction': options['cart_fraction'],
+            'wishlist_per_user': options['wishlist_per_user'],
+            'stock': max(options['stock'], 1),
+            'out_of_stock': options['out_of_stock'],
+            'days': max(options['days'], 1),
+            'image': options['image'],
+            'password': make_password(options['password']),
+            'username_prefix': options['username_prefix'],
+            'batch_size': options['batch_size'],
+            'categories': categories,
+            'thumbnails': thumbnail_count(),
+            'now': timezone.now(),
+            'product_base': base(Product),
+            'size_base': base(SizeStock),
+            'user_base': base(User),
+            'address_base': base(Address),
+            'order_base': base(Order),
+        }
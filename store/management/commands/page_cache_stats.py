@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from store.page_cache import reset_stats, stats
+
+PAGE_NAMES = ['home', 'user_home', 'product_list', 'product_detail', 'about']
+FRAGMENT_NAMES = ['fragment:product_card', 'fragment:product_info']
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counters of the catalog page and fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        names = PAGE_NAMES + FRAGMENT_NAMES
+        for name, (hits, misses) in stats(names).items():
+            total = hits + misses
+            ratio = f'{100 * hits / total:.1f}%' if total else '-'
+            self.stdout.write(f'{name:<28} hits={hits:<8} misses={misses:<8} hit rate={ratio}')
+        if options['reset']:
+            reset_stats(names)
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
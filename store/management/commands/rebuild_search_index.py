@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from store.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index from the Product table (e.g. after loaddata)'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the {backend.name} search index'))
@@ -1,22 +1,23 @@
 from django.core.management.base import BaseCommand
+from store.inventory import bulk_restock
+from store.ledger import live_stock
 from store.models import SizeStock
-from django.conf import settings
 
 class Command(BaseCommand):
     help = 'Restock size-level SKUs that are out of stock to configured defaults'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many sizes would be restocked')
+        parser.add_argument('--category', help='Only restock products in this category (e.g. men, Woman)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Size rows restocked per transaction (one ledger insert and one aggregate UPDATE each)')
+
     def handle(self, *args, **options):
-        restocked = 0
-        for ss in SizeStock.objects.filter(stock__lte=0):
-            # Determine restock target: prefer global setting, else product-based default
-            target = getattr(settings, 'RESTOCK_SIZE_QUANTITY', None)
-            if target is None:
-                try:
-                    target = ss.product.initial_total_stock // 5
-                except Exception:
-                    target = 2
-            if not target or target <= 0:
-                target = 2
-            if ss.restock_to(target):
-                restocked += 1
-        self.stdout.write(self.style.SUCCESS(f'Restocked {restocked} sizes'))
+        sizes = SizeStock.objects.annotate(live=live_stock()).filter(live__lte=0)
+        if options['category']:
+            sizes = sizes.filter(product__category__name=options['category'])
+        # Target: prefer the global RESTOCK_SIZE_QUANTITY setting, else the product-based default
+        restocked = bulk_restock(sizes, prefer_setting=True, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Would restock {restocked} sizes'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Restocked {restocked} sizes'))
@@ -0,0 +1,214 @@
+"""Per-view request metrics, served in Prometheus text format at /metrics.
+
+`RequestMetricsMiddleware` times each request and labels it with the
+resolved view name. A wrapper installed on every database connection
+counts the request's SQL statements and their time. The wrapper finds the
+request through a context variable, so queries that async views run in
+worker threads are counted too. Totals are kept per process in
+`registry`. With METRICS_DIR set, each process also writes its totals to
+`<METRICS_DIR>/metrics-<pid>.json` every METRICS_FLUSH_INTERVAL seconds.
+/metrics then adds up the files of every worker. The counters only grow,
+so clear the directory when deploying.
+"""
+import atexit
+import bisect
+import contextvars
+import copy
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNRESOLVED = '<unresolved>'
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def buckets():
+    return tuple(getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_BUCKETS))
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_seconds += time.perf_counter() - started
+        stats.queries += 1
+
+
+def install_sql_wrapper(connection, **kwargs):
+    # First in the list, which makes it the outermost wrapper (Django nests
+    # them in reverse), so sql_seconds includes the time of any other
+    # wrappers, such as the profiler's. At the end of the list a
+    # `with connection.execute_wrapper(...)` block that was open when it was
+    # added would pop it instead of its own wrapper on exit.
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _sql_wrapper)
+
+
+def install_sql_wrappers():
+    """Wrap the connections opened so far; later ones are wrapped on `connection_created`."""
+    connection_created.connect(install_sql_wrapper, dispatch_uid='store.metrics')
+    for connection in connections.all(initialized_only=True):
+        install_sql_wrapper(connection)
+
+
+def start_request():
+    """Start counting SQL for the current request. Pass the result to `finish_request`."""
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+class MetricsRegistry:
+    """Per-view totals for this process: latency histogram, responses by
+    status class, SQL statement count and SQL time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self._flushed_at = time.monotonic()
+
+    def observe(self, view, status, seconds, stats):
+        bounds = buckets()
+        with self._lock:
+            entry = self._views.get(view)
+            if entry is None or len(entry['buckets']) != len(bounds):
+                entry = self._views[view] = {
+                    'buckets': [0] * len(bounds), 'count': 0, 'sum': 0.0,
+                    'status': {}, 'queries': 0, 'sql_seconds': 0.0,
+                }
+            index = bisect.bisect_left(bounds, seconds)
+            if index < len(bounds):
+                entry['buckets'][index] += 1
+            entry['count'] += 1
+            entry['sum'] += seconds
+            status_class = f'{status // 100}xx'
+            entry['status'][status_class] = entry['status'].get(status_class, 0) + 1
+            entry['queries'] += stats.queries
+            entry['sql_seconds'] += stats.sql_seconds
+            due = metrics_dir() and time.monotonic() - self._flushed_at >= flush_interval()
+        if due:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {'buckets': list(buckets()), 'views': copy.deepcopy(self._views)}
+
+    def flush(self):
+        """Write this process's totals to its file in METRICS_DIR."""
+        directory = metrics_dir()
+        if not directory:
+            return
+        with self._lock:
+            self._flushed_at = time.monotonic()
+        data = self.snapshot()
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, os.path.join(directory, f'metrics-{os.getpid()}.json'))
+
+    def collect(self):
+        """Totals per view across every process sharing METRICS_DIR (or just this one)."""
+        if not metrics_dir():
+            return self.snapshot()
+        self.flush()
+        merged = {'buckets': list(buckets()), 'views': {}}
+        for path in glob.glob(os.path.join(metrics_dir(), 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get('buckets') != merged['buckets']:
+                # written with other METRICS_LATENCY_BUCKETS
+                continue
+            for view, entry in data['views'].items():
+                total = merged['views'].setdefault(view, {
+                    'buckets': [0] * len(merged['buckets']), 'count': 0, 'sum': 0.0,
+                    'status': {}, 'queries': 0, 'sql_seconds': 0.0,
+                })
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+                for key in ('count', 'sum', 'queries', 'sql_seconds'):
+                    total[key] += entry[key]
+                for status_class, count in entry['status'].items():
+                    total['status'][status_class] = total['status'].get(status_class, 0) + count
+        return merged
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush_interval():
+    return getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(data):
+    """`collect()` output as Prometheus text exposition format."""
+    views = sorted(data['views'].items())
+    lines = [
+        '# HELP shopfusion_request_duration_seconds Request latency by view.',
+        '# TYPE shopfusion_request_duration_seconds histogram',
+    ]
+    for view, entry in views:
+        cumulative = 0
+        for bound, count in zip(data['buckets'], entry['buckets']):
+            cumulative += count
+            lines.append(f'shopfusion_request_duration_seconds_bucket{{view="{_label(view)}",le="{bound}"}} {cumulative}')
+        lines.append(f'shopfusion_request_duration_seconds_bucket{{view="{_label(view)}",le="+Inf"}} {entry["count"]}')
+        lines.append(f'shopfusion_request_duration_seconds_sum{{view="{_label(view)}"}} {entry["sum"]}')
+        lines.append(f'shopfusion_request_duration_seconds_count{{view="{_label(view)}"}} {entry["count"]}')
+    lines += [
+        '# HELP shopfusion_responses_total Responses by view and status class.',
+        '# TYPE shopfusion_responses_total counter',
+    ]
+    for view, entry in views:
+        for status_class, count in sorted(entry['status'].items()):
+            lines.append(f'shopfusion_responses_total{{view="{_label(view)}",status="{status_class}"}} {count}')
+    lines += [
+        '# HELP shopfusion_sql_queries_total SQL statements executed by view.',
+        '# TYPE shopfusion_sql_queries_total counter',
+    ]
+    lines += [f'shopfusion_sql_queries_total{{view="{_label(view)}"}} {entry["queries"]}' for view, entry in views]
+    lines += [
+        '# HELP shopfusion_sql_duration_seconds_total Time spent in SQL statements by view.',
+        '# TYPE shopfusion_sql_duration_seconds_total counter',
+    ]
+    lines += [f'shopfusion_sql_duration_seconds_total{{view="{_label(view)}"}} {entry["sql_seconds"]}' for view, entry in views]
+    return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush)
@@ -1,28 +1,119 @@
-from django.contrib.auth.models import User
+import cProfile
+import time
+from contextlib import ExitStack
+from functools import partial
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
 from django.utils.functional import SimpleLazyObject
 
 from django.shortcuts import redirect
 
+from . import metrics, profiling
+from .user_cache import user_cache
+
+
+def _has_session(request):
+    """False for visitors without a session cookie (unless this request started one)."""
+    return settings.SESSION_COOKIE_NAME in request.COOKIES or request.session.modified
+
+
+def get_request_user(request):
+    """The Django-authenticated user for this request, resolved at most once.
+
+    Backed by `user_cache` keyed on the session's auth hash; on a miss this
+    is exactly `django.contrib.auth.get_user` (including its session hash
+    verification).
+    """
+    if not _has_session(request):
+        # don't even read the empty session: that would add `Vary: Cookie`
+        return AnonymousUser()
+    if not hasattr(request, '_resolved_user'):
+        session = request.session
+        user_id = session.get(SESSION_KEY)
+        session_hash = session.get(HASH_SESSION_KEY)
+        user = user_cache.get(user_id, session_hash) if user_id is not None and session_hash else None
+        if user is None:
+            user = auth.get_user(request)
+            if user.is_authenticated and session_hash:
+                user_cache.set(user, session_hash)
+        request._resolved_user = user
+    return request._resolved_user
+
+
+def get_shop_user(request):
+    """The storefront user from `session['shop_user_id']`, sharing the request.user instance when they match."""
+    # first, since a stale auth hash flushes the whole session
+    user = get_request_user(request)
+    if not _has_session(request) or 'shop_user_id' not in request.session:
+        return None
+    shop_user_id = request.session['shop_user_id']
+    if user.is_authenticated and str(user.pk) == str(shop_user_id):
+        return user
+    user = user_cache.get(shop_user_id, None)
+    if user is None:
+        try:
+            user = User.objects.using('default').get(pk=shop_user_id)
+        except User.DoesNotExist:
+            return None
+        user_cache.set(user, None)
+    return user
+
+
+class ShopFusionAuthMiddleware(AuthenticationMiddleware):
+    """Replaces Django's AuthenticationMiddleware: `request.user` and
+    `request.shop_user` are resolved through one lazy lookup and share the
+    same User instance.
+    """
+
+    def process_request(self, request):
+        if not hasattr(request, 'session'):
+            raise ImproperlyConfigured(
+                'ShopFusionAuthMiddleware requires session middleware to be installed before it.'
+            )
+        request.user = SimpleLazyObject(lambda: get_request_user(request))
+        request.auser = partial(sync_to_async(get_request_user), request)
+        request.shop_user = SimpleLazyObject(lambda: get_shop_user(request))
+
+
+class _AdminOnlyMiddleware:
+    """Base for middleware that only has work to do under /admin/.
+
+    Works in both sync and async stacks; in an async stack other paths pass
+    straight through to the (async) view without a hop to a worker thread.
+    """
+    sync_capable = True
+    async_capable = True
 
-class ShopFusionAuthMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        request.shop_user = SimpleLazyObject(lambda: self.__get_shop_user(request))
-        response = self.get_response(request)
-        return response
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not (request.path or '').startswith('/admin/'):
+            return self.get_response(request)
+        return self.handle_admin(request, self.get_response)
 
-    def __get_shop_user(self, request):
-        if 'shop_user_id' in request.session:
-            try:
-                return User.objects.using('default').get(pk=request.session['shop_user_id'])
-            except User.DoesNotExist:
-                pass
-        return None
+    async def __acall__(self, request):
+        if not (request.path or '').startswith('/admin/'):
+            return await self.get_response(request)
+        # the admin itself is sync; run the whole thing in a thread
+        return await sync_to_async(self.handle_admin)(request, async_to_sync(self.get_response))
+
+    def handle_admin(self, request, get_response):
+        raise NotImplementedError
 
 
-class AdminRestrictMiddleware:
+class AdminRestrictMiddleware(_AdminOnlyMiddleware):
     """Redirect authenticated non-staff users away from the Django admin.
 
     - If a request path starts with `/admin/` and the requesting user is
@@ -30,10 +121,7 @@ class AdminRestrictMiddleware:
       to the site `home` view.
     - Anonymous users (not logged in) and staff/superusers can proceed.
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+    def handle_admin(self, request, get_response):
         path = request.path or ''
         # Allow admin auth endpoints so superusers can reach the login page
         admin_auth_paths = ('/admin/login/', '/admin/logout/', '/admin/password_change/', '/admin/password_reset/')
@@ -41,7 +129,7 @@ class AdminRestrictMiddleware:
             # If this request is for the admin login/logout/password endpoints, allow it.
             for p in admin_auth_paths:
                 if path.startswith(p):
-                    return self.get_response(request)
+                    return get_response(request)
             user = getattr(request, 'user', None)
             shop_user = getattr(request, 'shop_user', None)
 
@@ -61,10 +149,10 @@ class AdminRestrictMiddleware:
             elif shop_user:
                 if not _is_privileged(shop_user):
                     return redirect('home')
-        return self.get_response(request)
+        return get_response(request)
 
 
-class AdminSessionPreserveMiddleware:
+class AdminSessionPreserveMiddleware(_AdminOnlyMiddleware):
     """Preserve shop-specific session keys across admin login/logout.
 
     The Django admin login/logout flow may call `logout()` which flushes
@@ -77,10 +165,7 @@ class AdminSessionPreserveMiddleware:
     """
     PRESERVE_KEYS = ('shop_user_id', 'shop_user_authenticated')
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+    def handle_admin(self, request, get_response):
         # Only care about admin login/logout paths.
         path = request.path or ''
         stash = {}
@@ -92,7 +177,7 @@ class AdminSessionPreserveMiddleware:
                         stash[k] = session.get(k)
 
         # Run the view (which may flush/modify the session)
-        response = self.get_response(request)
+        response = get_response(request)
 
         # After view, restore any stashed shop session keys if missing.
         if stash:
@@ -111,3 +196,92 @@ class AdminSessionPreserveMiddleware:
                         pass
 
         return response
+
+
+class RequestMetricsMiddleware:
+    """Record each request's latency, SQL count and SQL time under its view
+    name in `store.metrics.registry` (served at /metrics).
+
+    Put it first in MIDDLEWARE so the timing covers the other middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        metrics.install_sql_wrappers()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self._observe(request, response, started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        # sync_to_async copies the context, so the view's ORM calls count too
+        stats, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self._observe(request, response, started, stats)
+        return response
+
+    def _observe(self, request, response, started, stats):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else metrics.UNRESOLVED
+        metrics.registry.observe(view, response.status_code, time.perf_counter() - started, stats)
+
+
+class RequestProfilerMiddleware:
+    """Run sampled requests under cProfile and store the profiles for
+    /admin/profiles/ (see store/profiling.py). Removed from the stack unless
+    PROFILING_ENABLED.
+
+    Sync only: under ASGI an async view runs outside the profiled thread,
+    so neither its code nor its SQL shows up in the profile.
+    """
+
+    def __init__(self, get_response):
+        if not profiling.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = profiling.pick_trigger(request)
+        if trigger is None or not profiling.busy.acquire(blocking=False):
+            started = time.perf_counter()
+            response = self.get_response(request)
+            slow = profiling.slow_seconds()
+            if slow is not None and time.perf_counter() - started > slow:
+                profiling.arm(request.path)
+            return response
+        try:
+            logs = [profiling.SQLLog(alias) for alias in connections]
+            profiler = cProfile.Profile()
+            with ExitStack() as stack:
+                for log in logs:
+                    stack.enter_context(connections[log.alias].execute_wrapper(log))
+                started = time.perf_counter()
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+                seconds = time.perf_counter() - started
+        finally:
+            profiling.busy.release()
+        slow = profiling.slow_seconds()
+        # an armed path is only worth keeping if it was slow again
+        if trigger != 'slow' or (slow is not None and seconds > slow):
+            profiling.save(profiler, request, response, trigger, seconds, logs)
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:16
+
+from django.db import migrations, models
+from django.db.models import Case, IntegerField, Sum, Value, When
+
+
+SIZE_BITS = {'S': 1, 'M': 2, 'L': 4, 'XL': 8, 'XXL': 16}
+
+
+def populate_stock_aggregates(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    SizeStock = apps.get_model('store', 'SizeStock')
+    rows = SizeStock.objects.values('product_id').annotate(
+        total=Sum('stock'),
+        mask=Sum(Case(
+            *[When(size=size, stock__gt=0, then=Value(bit)) for size, bit in SIZE_BITS.items()],
+            default=Value(0), output_field=IntegerField(),
+        )),
+    )
+    for row in rows:
+        Product.objects.filter(pk=row['product_id']).update(stock_total=row['total'] or 0, stock_size_mask=row['mask'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_alter_sizestock_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_size_mask',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_stock_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:17
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def populate_blurbs(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    batch = []
+    for product in Product.objects.only('id', 'specification').iterator(chunk_size=500):
+        product.blurb = Truncator(product.specification or '').words(15)[:255]
+        batch.append(product)
+        if len(batch) >= 500:
+            Product.objects.bulk_update(batch, ['blurb'])
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, ['blurb'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_product_stock_aggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='blurb',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price', 'id'], name='product_cat_price_id'),
+        ),
+        migrations.RunPython(populate_blurbs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_product_blurb_and_list_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_widths',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,46 @@
+"""Full-text index for product search.
+
+MySQL gets a FULLTEXT index on (name, specification); SQLite gets an FTS5
+table populated from the existing products. Other databases (or SQLite
+builds without FTS5) fall back to the in-process index in store/search.py.
+"""
+
+from django.db import OperationalError, migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX product_name_spec_ft ON store_product (name, specification)'
+        )
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts USING fts5(name, specification)'
+            )
+        except OperationalError:
+            return  # no FTS5 in this SQLite build
+        schema_editor.execute(
+            'INSERT INTO store_product_fts (rowid, name, specification) '
+            'SELECT id, name, specification FROM store_product'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('DROP INDEX product_name_spec_ft ON store_product')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS store_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
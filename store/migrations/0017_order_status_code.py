@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _normalize(text):
+    # frozen copy of Order.normalize_status
+    text = (text or '').lower()
+    for needle, code in (('cancel', 'CANCELLED'), ('delivered', 'DELIVERED'), ('complete', 'COMPLETED'),
+                         ('out for delivery', 'OUT_FOR_DELIVERY'), ('ship', 'SHIPPED'), ('pack', 'PACKED')):
+        if needle in text:
+            return code
+    return 'PLACED'
+
+
+def populate_status(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    # one UPDATE per distinct free-text status rather than per order
+    for text in Order.objects.values_list('tracking_status', flat=True).distinct():
+        code = _normalize(text)
+        if code != 'PLACED':
+            Order.objects.filter(tracking_status=text).update(status=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PLACED', 'Order Placed'), ('PACKED', 'Packed'), ('SHIPPED', 'Shipped'), ('OUT_FOR_DELIVERY', 'Out for Delivery'), ('DELIVERED', 'Delivered'), ('COMPLETED', 'Completed'), ('CANCELLED', 'Cancelled')], default='PLACED', editable=False, max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='address',
+            name='postal_code',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='order_status_created'),
+        ),
+        migrations.RunPython(populate_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:34
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    CartItem = apps.get_model('store', 'CartItem')
+    # fold every (user, product, size) group into its oldest line
+    duplicates = (
+        CartItem.objects.values('user_id', 'product_id', 'size')
+        .annotate(lines=Count('id'), total=Sum('quantity'), keep=Min('id'))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates.iterator():
+        CartItem.objects.filter(pk=row['keep']).update(quantity=row['total'])
+        CartItem.objects.filter(
+            user_id=row['user_id'], product_id=row['product_id'], size=row['size'],
+        ).exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_order_status_code'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product', 'size'), name='cartitem_user_product_size'),
+        ),
+    ]
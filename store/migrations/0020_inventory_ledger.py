@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sizestock',
+            name='ledger_position',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(choices=[('S', 'S'), ('M', 'M'), ('L', 'L'), ('XL', 'XL'), ('XXL', 'XXL')], max_length=4)),
+                ('delta', models.IntegerField()),
+                ('kind', models.CharField(choices=[('sale', 'Sale'), ('restock', 'Restock'), ('adjust', 'Manual adjustment'), ('return', 'Return')], max_length=8)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'size', 'id'], name='movement_size_id')],
+            },
+        ),
+    ]
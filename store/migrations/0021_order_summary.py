@@ -0,0 +1,66 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Prefetch
+
+THUMBNAILS = 4
+
+
+def backfill_summaries(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    OrderSummary = apps.get_model('store', 'OrderSummary')
+    orders = Order.objects.select_related('address').prefetch_related(
+        Prefetch('order_items', queryset=OrderItem.objects.select_related('product').order_by('pk'))
+    ).order_by('pk')
+    batch = []
+    for order in orders.iterator(chunk_size=500):
+        items = list(order.order_items.all())
+        address = order.address
+        batch.append(OrderSummary(
+            order_id=order.pk, user_id=order.user_id, created_at=order.created_at, total=order.total,
+            status=order.status, tracking_status=order.tracking_status, item_count=len(items),
+            shipping_address=', '.join([address.address_line, address.city, address.state,
+                                        address.postal_code, address.country]),
+            thumbnails=[
+                {'product_id': item.product_id, 'name': item.product.name, 'image': item.product.image.name or '',
+                 'image_hash': item.product.image_hash, 'image_widths': item.product.image_widths,
+                 'quantity': item.quantity, 'price': str(item.price)}
+                for item in items[:THUMBNAILS]
+            ],
+        ))
+        if len(batch) >= 500:
+            OrderSummary.objects.bulk_create(batch)
+            batch = []
+    OrderSummary.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_inventory_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='store.order')),
+                ('created_at', models.DateTimeField()),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('PLACED', 'Order Placed'), ('PACKED', 'Packed'), ('SHIPPED', 'Shipped'), ('OUT_FOR_DELIVERY', 'Out for Delivery'), ('DELIVERED', 'Delivered'), ('COMPLETED', 'Completed'), ('CANCELLED', 'Cancelled')], default='PLACED', max_length=16)),
+                ('tracking_status', models.CharField(default='Order Placed', max_length=100)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('shipping_address', models.CharField(blank=True, max_length=500)),
+                ('thumbnails', models.JSONField(default=list)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at'], name='order_summary_user_created')],
+            },
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,72 @@
 
-from django.db import models
+from django.db import connections, models, router, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils.text import Truncator
+
+
+class DirtyFieldsMixin:
+    """Track changes to `tracked_fields` without re-reading the row.
+
+    Values are snapshotted when an instance is loaded (`from_db`) and again
+    after every save, so signal handlers can ask for `changed_fields` or
+    `previous(name)` for free. Only instances that were never loaded from
+    the database (e.g. built by hand with a pk) fall back to one SELECT.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked(field_names)
+        return instance
+
+    def _tracked_value(self, name):
+        field = self._meta.get_field(name)
+        return field.get_prep_value(field.value_from_object(self))
+
+    def _snapshot_tracked(self, field_names=None):
+        loaded = self.get_deferred_fields()
+        self._tracked_snapshot = {
+            name: self._tracked_value(name) for name in self.tracked_fields
+            if name not in loaded and (field_names is None or self._meta.get_field(name).attname in field_names)
+        }
+
+    def previous(self, name):
+        """Value of `name` as last loaded from / saved to the database (None for new rows)."""
+        if name not in self.tracked_fields:
+            raise ValueError(f'{name!r} is not a tracked field of {type(self).__name__}')
+        if self.pk is None:
+            return None
+        snapshot = self.__dict__.setdefault('_tracked_snapshot', {})
+        if name not in snapshot:
+            missing = [f for f in self.tracked_fields if f not in snapshot]
+            attnames = [self._meta.get_field(f).attname for f in missing]
+            row = type(self)._base_manager.using(self._state.db or 'default').filter(pk=self.pk).values(*attnames).first() or {}
+            for f, attname in zip(missing, attnames):
+                snapshot[f] = row.get(attname)
+        return snapshot[name]
+
+    @property
+    def changed_fields(self):
+        return {name for name in self.tracked_fields if self._tracked_value(name) != self.previous(name)}
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            self._tracked_snapshot = dict.fromkeys(self.tracked_fields)
+        else:
+            # make sure the snapshot is complete before the row changes
+            for name in self.tracked_fields:
+                self.previous(name)
+        super().save(*args, **kwargs)
+        # post_save receivers have run with the old snapshot; start tracking from here
+        self._snapshot_tracked()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_tracked()
 
 
 # Completely separate table for delivery partner users
@@ -29,7 +93,7 @@ class Category(models.Model):
     def __str__(self):
         return self.get_name_display()
 
-class Product(models.Model):
+class Product(DirtyFieldsMixin, models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
     image = models.ImageField(upload_to='products/')
@@ -38,17 +102,71 @@ class Product(models.Model):
     # initial total stock to distribute across sizes when product is created
     initial_total_stock = models.PositiveIntegerField(default=10)
     # Note: per-size default is derived from `initial_total_stock` (even distribution)
+    # Denormalized availability, kept current with F() updates by every stock
+    # write path (see `update_stock_aggregates`) and repaired by the
+    # `reconcile_stock` command. Signed so a drifted row can't break an UPDATE.
+    stock_total = models.IntegerField(default=0, editable=False)
+    # bitmap of sizes with stock > 0, see SIZE_BITS
+    stock_size_mask = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    # first words of `specification`, precomputed for product cards
+    blurb = models.CharField(max_length=255, blank=True, editable=False)
+    # sha256 of the image the current derivatives were built from, and their widths
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    image_widths = models.CharField(max_length=64, blank=True, editable=False)
+
+    tracked_fields = ('image',)
+    STOCK_AGGREGATE_FIELDS = ('stock_total', 'stock_size_mask')
+    IMAGE_DERIVATIVE_FIELDS = ('image_hash', 'image_widths')
+    # maintained out-of-band, never written back by save()
+    DERIVED_FIELDS = STOCK_AGGREGATE_FIELDS + IMAGE_DERIVATIVE_FIELDS
+    BLURB_WORDS = 15
+    # columns needed to render a product card (leaves out `specification`)
+    CARD_FIELDS = ('id', 'category_id', 'name', 'image', 'image_hash', 'image_widths', 'price', 'blurb', 'stock_total', 'stock_size_mask')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_id'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def make_blurb(cls, specification):
+        return Truncator(specification or '').words(cls.BLURB_WORDS)[:255]
+
+    def save(self, *args, **kwargs):
+        self.blurb = self.make_blurb(self.specification)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'specification' in update_fields and 'blurb' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['blurb']
+        # Never write back a (possibly stale) in-memory copy of the stock
+        # aggregates or image metadata when updating an existing product.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.DERIVED_FIELDS
+            ]
+        update_fields = kwargs.get('update_fields')
+        if (not self._state.adding and (update_fields is None or 'image' in update_fields)
+                and 'image' in self.changed_fields):
+            # the derivatives are of the old image: serve the original until
+            # the background job records the new ones
+            self.image_hash = self.image_widths = ''
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + [
+                    f for f in self.IMAGE_DERIVATIVE_FIELDS if f not in update_fields]
+        super().save(*args, **kwargs)
+
     @property
     def total_stock(self):
-        # Sum of size-level stocks if any exist, otherwise fall back to initial_total_stock
-        sizes = self.sizestock_set.all()
-        if sizes.exists():
-            return sum(s.stock for s in sizes)
-        return self.initial_total_stock
+        return max(self.stock_total, 0)
+
+    @property
+    def size_availability(self):
+        """List of (size, in_stock) pairs read from the size bitmap."""
+        return [(size, bool(self.stock_size_mask & bit)) for size, bit in SIZE_BITS.items()]
 
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -61,6 +179,12 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # one line per size; adding again increments it (see store.cart.upsert_lines)
+            models.UniqueConstraint(fields=['user', 'product', 'size'], name='cartitem_user_product_size'),
+        ]
+
     def __str__(self):
         return f"{self.product.name} ({self.quantity})"
 
@@ -73,23 +197,75 @@ class Address(models.Model):
     address_line = models.CharField(max_length=255)
     city = models.CharField(max_length=100)
     state = models.CharField(max_length=100)
-    postal_code = models.CharField(max_length=20)
+    postal_code = models.CharField(max_length=20, db_index=True)
     country = models.CharField(max_length=100)
 
     def __str__(self):
         return f"{self.address_line}, {self.city}, {self.state}, {self.country}"
 
-class Order(models.Model):
+class Order(DirtyFieldsMixin, models.Model):
+    STATUS_PLACED = 'PLACED'
+    STATUS_PACKED = 'PACKED'
+    STATUS_SHIPPED = 'SHIPPED'
+    STATUS_OUT_FOR_DELIVERY = 'OUT_FOR_DELIVERY'
+    STATUS_DELIVERED = 'DELIVERED'
+    STATUS_COMPLETED = 'COMPLETED'
+    STATUS_CANCELLED = 'CANCELLED'
+    STATUS_CHOICES = [
+        (STATUS_PLACED, 'Order Placed'),
+        (STATUS_PACKED, 'Packed'),
+        (STATUS_SHIPPED, 'Shipped'),
+        (STATUS_OUT_FOR_DELIVERY, 'Out for Delivery'),
+        (STATUS_DELIVERED, 'Delivered'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+    tracked_fields = ('tracking_status', 'status')
+    # orders a delivery partner still has to deal with
+    PENDING_DELIVERY_STATUSES = (STATUS_PLACED, STATUS_PACKED, STATUS_SHIPPED, STATUS_OUT_FOR_DELIVERY)
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     address = models.ForeignKey(Address, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     items = models.ManyToManyField(CartItem)
     total = models.DecimalField(max_digits=10, decimal_places=2)
+    # free text shown to the shopper; `status` is the normalized, indexed code
     tracking_status = models.CharField(max_length=100, default='Order Placed')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PLACED, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='order_status_created'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
 
+    @classmethod
+    def normalize_status(cls, text):
+        """Map free-text tracking status (as typed in the admin) to a status code."""
+        text = (text or '').lower()
+        if 'cancel' in text:
+            return cls.STATUS_CANCELLED
+        if 'delivered' in text:
+            return cls.STATUS_DELIVERED
+        if 'complete' in text:
+            return cls.STATUS_COMPLETED
+        if 'out for delivery' in text:
+            return cls.STATUS_OUT_FOR_DELIVERY
+        if 'ship' in text:
+            return cls.STATUS_SHIPPED
+        if 'pack' in text:
+            return cls.STATUS_PACKED
+        return cls.STATUS_PLACED
+
+    def save(self, *args, **kwargs):
+        self.status = self.normalize_status(self.tracking_status)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'tracking_status' in update_fields and 'status' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['status']
+        super().save(*args, **kwargs)
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey('Order', related_name='order_items', on_delete=models.CASCADE)
@@ -102,6 +278,110 @@ class OrderItem(models.Model):
         return f"{self.product.name} x{self.quantity}"
 
 
+class OrderSummary(models.Model):
+    """Read model for the order history pages: one row per order with
+    everything the lists show, so a page of orders is a single query.
+
+    Written at checkout and kept in step with the order's status (see
+    store.orders).
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=16, choices=Order.STATUS_CHOICES, default=Order.STATUS_PLACED)
+    tracking_status = models.CharField(max_length=100, default='Order Placed')
+    item_count = models.PositiveIntegerField(default=0)
+    shipping_address = models.CharField(max_length=500, blank=True)
+    # the first few items: [{"product_id", "name", "image", "image_hash", "image_widths", "quantity", "price"}]
+    thumbnails = models.JSONField(default=list)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='order_summary_user_created'),
+        ]
+
+    def __str__(self):
+        return f"Summary of order #{self.order_id}"
+
+    @property
+    def id(self):
+        return self.order_id
+
+    @property
+    def items(self):
+        """The stored items with an unsaved Product each (for `product_picture`); no queries."""
+        return [
+            {
+                'product': Product(pk=t['product_id'], name=t['name'], image=t['image'],
+                                   image_hash=t['image_hash'], image_widths=t['image_widths']),
+                'quantity': t['quantity'],
+                'price': t['price'],
+            }
+            for t in self.thumbnails
+        ]
+
+    @property
+    def more_items(self):
+        return max(self.item_count - len(self.thumbnails), 0)
+
+
+# Bit used for each size in Product.stock_size_mask
+SIZE_BITS = {'S': 1, 'M': 2, 'L': 4, 'XL': 8, 'XXL': 16}
+ALL_SIZES_MASK = sum(SIZE_BITS.values())
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields, batch_size=None):
+    """bulk_create that updates `update_fields` of rows clashing on `unique_fields`.
+
+    MySQL's ON DUPLICATE KEY UPDATE takes no conflict target (Django refuses
+    `unique_fields` there), so it's only passed where the backend supports it.
+    """
+    features = connections[router.db_for_write(model)].features
+    return model.objects.bulk_create(
+        objs, batch_size=batch_size, update_conflicts=True, update_fields=update_fields,
+        unique_fields=unique_fields if features.supports_update_conflicts_with_target else None,
+    )
+
+
+def update_stock_aggregates(changes):
+    """Apply stock changes to the Product availability aggregates in one UPDATE.
+
+    `changes` is an iterable of (product_id, size, delta, in_stock) tuples where
+    `delta` is the change in units for that size and `in_stock` whether the
+    size has stock left afterwards. A size may appear more than once: the
+    deltas add up and the last `in_stock` wins.
+    """
+    per_size = {}
+    for product_id, size, delta, in_stock in changes:
+        total, _ = per_size.get((product_id, size), (0, None))
+        per_size[(product_id, size)] = (total + delta, in_stock)
+    per_product = {}
+    for (product_id, size), (delta, in_stock) in per_size.items():
+        total, set_bits, keep_bits = per_product.get(product_id, (0, 0, ALL_SIZES_MASK))
+        bit = SIZE_BITS.get(size, 0)
+        if in_stock:
+            set_bits |= bit
+        else:
+            keep_bits &= ~bit
+        per_product[product_id] = (total + delta, set_bits, keep_bits)
+    if not per_product:
+        return 0
+
+    def _case(index):
+        return models.Case(
+            *[models.When(pk=pid, then=models.Value(v[index])) for pid, v in per_product.items()],
+            output_field=models.IntegerField(),
+        )
+
+    from .page_cache import bump_versions
+    bump_versions(product_ids=per_product)
+    return Product.objects.filter(pk__in=per_product).update(
+        stock_total=models.F('stock_total') + _case(0),
+        stock_size_mask=models.F('stock_size_mask').bitand(_case(2)).bitor(_case(1)),
+    )
+
+
 class SizeStock(models.Model):
     SIZE_CHOICES = [
         ('S', 'S'), ('M', 'M'), ('L', 'L'), ('XL', 'XL'), ('XXL', 'XXL')
@@ -115,7 +395,13 @@ class SizeStock(models.Model):
         (STATUS_IN, 'In Stock'),
         (STATUS_OUT, 'Out of Stock'),
     ]
+    # as of the snapshot (set by compaction); the live status follows the live stock
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_IN)
+    # `stock` is a snapshot covering StockMovement rows up to this id; the
+    # live stock adds the movements after it (see store.ledger)
+    ledger_position = models.BigIntegerField(default=0, editable=False)
+    # only written by the ledger (compaction, set_live): an in-memory copy may be stale
+    LEDGER_FIELDS = ('stock', 'ledger_position', 'status')
 
     class Meta:
         unique_together = ('product', 'size')
@@ -123,21 +409,75 @@ class SizeStock(models.Model):
     def __str__(self):
         return f"{self.product.name} [{self.size}] = {self.stock}"
 
+    def save_details(self):
+        """Save everything but the ledger-owned fields (see LEDGER_FIELDS)."""
+        self.save(update_fields=[
+            f.name for f in self._meta.concrete_fields if not f.primary_key and f.name not in self.LEDGER_FIELDS
+        ])
+
     def mark_status(self):
         """Set status based on current stock value."""
         self.status = self.STATUS_IN if self.stock > 0 else self.STATUS_OUT
         return self.status
 
     def restock_to(self, qty):
-        """Restock this size to a target qty (idempotent)."""
+        """Restock this size to a target qty (idempotent), recorded as a restock movement."""
         if qty is None:
             return False
-        if self.stock != qty:
-            self.stock = qty
-            self.mark_status()
-            self.save(update_fields=['stock', 'status'])
-            return True
-        return False
+        from .ledger import set_live
+        return set_live(self, qty, StockMovement.KIND_RESTOCK) != 0
+
+
+class StockMovement(models.Model):
+    """One change to a size's stock. Rows are only ever inserted;
+    `compact_inventory` folds them into the SizeStock snapshots."""
+    KIND_SALE = 'sale'
+    KIND_RESTOCK = 'restock'
+    KIND_ADJUST = 'adjust'
+    KIND_RETURN = 'return'
+    KIND_CHOICES = [
+        (KIND_SALE, 'Sale'),
+        (KIND_RESTOCK, 'Restock'),
+        (KIND_ADJUST, 'Manual adjustment'),
+        (KIND_RETURN, 'Return'),
+    ]
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    size = models.CharField(max_length=4, choices=SizeStock.SIZE_CHOICES)
+    delta = models.IntegerField()
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # "movements of this size after the snapshot" is a range scan on this index
+            models.Index(fields=['product', 'size', 'id'], name='movement_size_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.delta:+d} {self.product_id} [{self.size}]"
+
+
+class StockReservation(models.Model):
+    """Units of a size held for one cart line until `expires_at`.
+
+    Only used when STOCK_RESERVATIONS is on (see store.reservations). Expired
+    rows simply stop counting; `release_reservations` deletes them.
+    """
+    cart_item = models.OneToOneField(CartItem, on_delete=models.CASCADE, related_name='reservation')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    size = models.CharField(max_length=4, choices=SizeStock.SIZE_CHOICES)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            # "units held on this size right now" is a range scan on this index
+            models.Index(fields=['product', 'size', 'expires_at'], name='reservation_size_expiry'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} [{self.size}] until {self.expires_at:%Y-%m-%d %H:%M}"
 
 
 @receiver(post_save, sender=Product)
@@ -149,6 +489,7 @@ def create_size_stocks(sender, instance, created, **kwargs):
     """
     sizes = ['S', 'M', 'L', 'XL', 'XXL']
     existing = {s.size for s in instance.sizestock_set.all()}
+    changes = []
     # If none exist, distribute initial_total_stock across sizes
     if not existing:
         total = instance.initial_total_stock or 10
@@ -157,61 +498,129 @@ def create_size_stocks(sender, instance, created, **kwargs):
         for i, sz in enumerate(sizes):
             qty = base + (1 if i < rem else 0)
             # create if missing, otherwise leave existing stock alone
-            SizeStock.objects.get_or_create(product=instance, size=sz, defaults={'stock': qty, 'status': SizeStock.STATUS_IN if qty > 0 else SizeStock.STATUS_OUT})
+            ss, was_created = SizeStock.objects.get_or_create(product=instance, size=sz, defaults={'stock': qty, 'status': SizeStock.STATUS_IN if qty > 0 else SizeStock.STATUS_OUT})
+            if was_created:
+                changes.append((instance.pk, sz, ss.stock, ss.stock > 0))
     else:
         # Create any missing sizes with zero stock
         for sz in sizes:
             if sz not in existing:
                 SizeStock.objects.get_or_create(product=instance, size=sz, defaults={'stock': 0, 'status': SizeStock.STATUS_OUT})
+    update_stock_aggregates(changes)
 
 
-from django.db.models.signals import pre_save, post_save
+@receiver(post_save, sender=Product)
+def build_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Render responsive image derivatives in the background once the save commits."""
+    if raw or not instance.image:
+        return
+    if not kwargs.get('created') and 'image' not in instance.changed_fields:
+        return
+    from .images import schedule_derivatives
+    transaction.on_commit(lambda: schedule_derivatives(instance))
+
+
+SEARCHED_FIELDS = {'name', 'specification'}
 
 
-@receiver(pre_save, sender=Order)
-def order_pre_save(sender, instance, **kwargs):
-    """Capture previous tracking_status before Order is saved so post_save can
-    detect a transition (e.g., to 'Delivered').
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the product search index in sync (no-op where the DB maintains it).
+
+    Fixtures (`raw`) are skipped; run `rebuild_search_index` after loaddata.
     """
-    if instance.pk:
-        try:
-            prev = Order.objects.get(pk=instance.pk)
-            instance._previous_tracking_status = prev.tracking_status
-        except Order.DoesNotExist:
-            instance._previous_tracking_status = None
-    else:
-        instance._previous_tracking_status = None
+    if raw or (update_fields is not None and not SEARCHED_FIELDS.intersection(update_fields)):
+        return
+    from .search import get_backend
+    get_backend().index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    from .search import get_backend
+    get_backend().remove(instance.pk)
+
+
+@receiver(post_delete, sender=SizeStock)
+def size_stock_deleted(sender, instance, **kwargs):
+    """Take a deleted size row's units out of the product aggregate; its movements go with it."""
+    from .ledger import pending_delta
+    movements = StockMovement.objects.filter(product_id=instance.product_id, size=instance.size)
+    live = instance.stock + pending_delta(instance)
+    movements.delete()
+    update_stock_aggregates([(instance.product_id, instance.size, -live, False)])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    from .page_cache import bump_versions
+    bump_versions('catalog', product_ids=[instance.pk])
+
+
+@receiver(post_save, sender=SizeStock)
+@receiver(post_delete, sender=SizeStock)
+def size_stock_changed(sender, instance, **kwargs):
+    from .page_cache import bump_versions
+    bump_versions('catalog', product_ids=[instance.product_id])
+
+
+@receiver(post_delete, sender=StockReservation)
+def reservation_released(sender, instance, **kwargs):
+    # availability shown on the product page changed
+    from .page_cache import bump_versions
+    bump_versions(product_ids=[instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    from .page_cache import bump_versions
+    bump_versions('catalog', 'category')
+
+
+@receiver(post_save, sender=Order)
+def sync_order_summary(sender, instance, created, raw=False, **kwargs):
+    """Carry status/total edits (admin, delivery dashboard) over to the order's summary."""
+    if created or raw:
+        return
+    updated = OrderSummary.objects.filter(order=instance).update(
+        status=instance.status, tracking_status=instance.tracking_status, total=instance.total,
+    )
+    if not updated:
+        from .orders import refresh_summaries
+        refresh_summaries([instance.pk])
 
 
 @receiver(post_save, sender=Order)
 def order_post_save(sender, instance, created, **kwargs):
-    """When an order's tracking_status transitions to a delivered/completed state,
+    """When an order's status transitions to a delivered/completed state,
     restock any size-level SKU that is currently out of stock back to the product's
-    `default_size_stock` quantity.
+    default per-size quantity. Cancelling an order puts its units back.
     """
-    prev = getattr(instance, '_previous_tracking_status', None)
-    new = (instance.tracking_status or '').lower()
-    if prev != instance.tracking_status and ('delivered' in new or 'completed' in new):
-        # Restock sizes that are currently zero for items in this order
-        for oi in instance.order_items.select_related('product'):
-            try:
-                ss = SizeStock.objects.get(product=oi.product, size=oi.size)
-            except SizeStock.DoesNotExist:
-                ss = None
-            # Determine restock target per-size by evenly dividing product.initial_total_stock
-            default_qty = (oi.product.initial_total_stock // 5) if oi.product.initial_total_stock else 2
-            if default_qty <= 0:
-                default_qty = 2
-            if ss is None:
-                # create or get existing (handle race conditions) and ensure status set
-                status = SizeStock.STATUS_IN if default_qty > 0 else SizeStock.STATUS_OUT
-                ss, created = SizeStock.objects.get_or_create(product=oi.product, size=oi.size, defaults={'stock': default_qty, 'status': status})
-                if not created and ss.stock == 0:
-                    ss.restock_to(default_qty)
-            else:
-                if ss.stock == 0:
-                    # use restock helper which sets status and saves idempotently
-                    ss.restock_to(default_qty)
+    if 'status' not in instance.changed_fields:
+        return
+    if instance.status in (Order.STATUS_DELIVERED, Order.STATUS_COMPLETED):
+        from .inventory import restock_out_of_stock
+        restock_out_of_stock(instance.order_items.values_list('product_id', 'size').distinct())
+    elif instance.status == Order.STATUS_CANCELLED:
+        from .inventory import return_order_items
+        return_order_items([instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop a user from the request-user cache on save (incl. password change) or delete."""
+    from .user_cache import user_cache
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(user_logged_out)
+def invalidate_cached_user_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        from .user_cache import user_cache
+        user_cache.invalidate(user.pk)
 
 
 class SupportRequest(models.Model):
@@ -236,3 +645,14 @@ class Wishlist(models.Model):
 
     def __str__(self):
         return f"Wishlist: {self.user.username} - {self.product.name}"
+
+
+def wishlist_version_name(user_id):
+    return f'wishlist:{user_id}'
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def wishlist_changed(sender, instance, **kwargs):
+    from .page_cache import bump_versions
+    bump_versions(wishlist_version_name(instance.user_id))
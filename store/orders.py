@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .inventory import restock_out_of_stock, return_order_items
+from .models import Order, OrderItem, OrderSummary, bulk_upsert
+from .pagination import keyset_paginate
+
+# Legal status moves. Orders that skip steps (e.g. Placed -> Delivered) are
+# allowed because most orders are only ever marked delivered.
+ALLOWED_TRANSITIONS = {
+    Order.STATUS_PLACED: {Order.STATUS_PACKED, Order.STATUS_SHIPPED, Order.STATUS_OUT_FOR_DELIVERY,
+                          Order.STATUS_DELIVERED, Order.STATUS_CANCELLED},
+    Order.STATUS_PACKED: {Order.STATUS_SHIPPED, Order.STATUS_OUT_FOR_DELIVERY, Order.STATUS_DELIVERED,
+                          Order.STATUS_CANCELLED},
+    Order.STATUS_SHIPPED: {Order.STATUS_OUT_FOR_DELIVERY, Order.STATUS_DELIVERED},
+    Order.STATUS_OUT_FOR_DELIVERY: {Order.STATUS_DELIVERED},
+    Order.STATUS_DELIVERED: {Order.STATUS_COMPLETED},
+    Order.STATUS_COMPLETED: set(),
+    Order.STATUS_CANCELLED: set(),
+}
+
+# what a delivery partner may set from the dashboard
+DELIVERY_PARTNER_STATUSES = (Order.STATUS_OUT_FOR_DELIVERY, Order.STATUS_DELIVERED)
+
+# entering one of these restocks the sold-out sizes of the order's items
+RESTOCK_STATUSES = (Order.STATUS_DELIVERED, Order.STATUS_COMPLETED)
+
+
+def can_transition(current, new):
+    return new in ALLOWED_TRANSITIONS.get(current, set())
+
+
+def transition_orders(order_ids, new_status):
+    """Move many orders to `new_status` at once.
+
+    Orders are locked, illegal moves are skipped, the legal ones are updated
+    with a single UPDATE (bypassing per-order save signals) and, for
+    delivered/completed, their sizes are restocked in one set-based pass.
+    Cancelled orders' units go back to stock the same way; a cancelled
+    order can't move again, so that happens once. Returns (moved_ids,
+    rejected_ids).
+    """
+    if new_status not in dict(Order.STATUS_CHOICES):
+        raise ValueError(f'Unknown order status {new_status!r}')
+    label = dict(Order.STATUS_CHOICES)[new_status]
+    with transaction.atomic():
+        current = dict(
+            Order.objects.select_for_update().filter(pk__in=list(order_ids)).values_list('pk', 'status')
+        )
+        moved = [pk for pk, status in current.items() if can_transition(status, new_status)]
+        rejected = [pk for pk in current if pk not in moved]
+        if moved:
+            Order.objects.filter(pk__in=moved).update(status=new_status, tracking_status=label)
+            OrderSummary.objects.filter(order_id__in=moved).update(status=new_status, tracking_status=label)
+            if new_status in RESTOCK_STATUSES:
+                restock_out_of_stock(
+                    OrderItem.objects.filter(order_id__in=moved).values_list('product_id', 'size').distinct()
+                )
+            elif new_status == Order.STATUS_CANCELLED:
+                return_order_items(moved)
+    return sorted(moved), sorted(rejected)
+
+
+HISTORY_ORDERING = ('-created_at', '-order')
+
+
+def thumbnail_count():
+    return getattr(settings, 'ORDER_SUMMARY_THUMBNAILS', 4)
+
+
+def format_address(address):
+    return ', '.join([address.address_line, address.city, address.state, address.postal_code, address.country])
+
+
+def build_summary(order, address, items):
+    """Unsaved OrderSummary for `order` from its items (anything with
+    `product`, `quantity` and a price; the products must be loaded)."""
+    items = list(items)
+    return OrderSummary(
+        order=order,
+        user_id=order.user_id,
+        created_at=order.created_at,
+        total=order.total,
+        status=order.status,
+        tracking_status=order.tracking_status,
+        item_count=len(items),
+        shipping_address=format_address(address),
+        thumbnails=[
+            {
+                'product_id': item.product.pk,
+                'name': item.product.name,
+                'image': item.product.image.name or '',
+                'image_hash': item.product.image_hash,
+                'image_widths': item.product.image_widths,
+                'quantity': item.quantity,
+                'price': str(item.price),
+            }
+            for item in items[:thumbnail_count()]
+        ],
+    )
+
+
+def refresh_summaries(order_ids, batch_size=500):
+    """(Re)build the summaries of `order_ids` from the orders and their items."""
+    order_ids = list(order_ids)
+    for start in range(0, len(order_ids), batch_size):
+        orders = (
+            Order.objects.filter(pk__in=order_ids[start:start + batch_size])
+            .select_related('address')
+            .prefetch_related(Prefetch('order_items', queryset=OrderItem.objects.select_related('product').order_by('pk')))
+        )
+        bulk_upsert(
+            OrderSummary,
+            [build_summary(order, order.address, order.order_items.all()) for order in orders],
+            unique_fields=['order'],
+            update_fields=['total', 'status', 'tracking_status', 'item_count', 'shipping_address', 'thumbnails'],
+        )
+
+
+def order_history(user, cursor=None, per_page=20):
+    """A keyset page of `user`'s order summaries, newest first: one query."""
+    return keyset_paginate(
+        OrderSummary.objects.filter(user=user), HISTORY_ORDERING,
+        cursor=cursor, per_page=per_page, salt='order_history',
+    )
@@ -0,0 +1,205 @@
+"""Versioned cache for the public catalog pages.
+
+Nothing is ever deleted: cache keys embed version numbers and a catalog
+change just bumps the relevant versions (on commit), so every stale entry
+stops being addressed and ages out on its own.
+
+* ``catalog``       - bumped by any Product, Category or SizeStock change
+* ``category``      - bumped by Category changes
+* ``product:<pk>``  - bumped by changes to that product or its sizes,
+                      including stock moves made with queryset updates
+
+Versions are microsecond timestamps, so they double as Last-Modified.
+
+Anonymous GET requests get whole pages (`cache_page_for_anonymous`);
+logged-in users get per-product fragments (``{% catalog_fragment %}``).
+With `STOREFRONT_HTTP_CACHE` on, storefront pages requested without a
+session cookie never touch the session or CSRF cookie and carry
+ETag/Last-Modified/Cache-Control, so browsers and a caching proxy can keep
+them; per-user bits come from the `storefront_session` JSON view.
+Works with any Django cache backend; use a shared one (file-based, ...)
+when running several worker processes, since local-memory caches only see
+bumps made in their own process.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+VERSION_PREFIX = 'catalog:v:'
+STATS_PREFIX = 'page_cache:stats:'
+CSRF_PLACEHOLDER = '__PAGE_CACHE_CSRF_TOKEN__'
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]+(")')
+
+
+def get_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def page_cache_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+
+
+def product_version_name(product_id):
+    return f'product:{product_id}'
+
+
+def get_versions(names):
+    """Current value of every version in `names` as a dict, in one cache round trip.
+
+    Missing versions start at the current time in microseconds, so a version
+    that was evicted never comes back with a value used before.
+    """
+    cache = get_cache()
+    keys = {VERSION_PREFIX + name: name for name in names}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, name in keys.items():
+        if key not in found:
+            cache.add(key, time.time_ns() // 1000, timeout=None)
+            found[key] = cache.get(key)
+        versions[name] = found[key]
+    return versions
+
+
+def _bump(names):
+    cache = get_cache()
+    keys = [VERSION_PREFIX + name for name in set(names)]
+    current = cache.get_many(keys)
+    now = time.time_ns() // 1000
+    cache.set_many({key: max(current.get(key, 0) + 1, now) for key in keys}, timeout=None)
+
+
+def bump_versions(*names, product_ids=()):
+    """Invalidate `names` and the given products once the current transaction commits."""
+    names = {*names, *(product_version_name(pk) for pk in product_ids)}
+    if not names:
+        return
+    transaction.on_commit(lambda: _bump(names))
+
+
+def record(name, hit):
+    """Count a hit or miss for `name` in the cache itself, so all workers share the totals."""
+    cache = get_cache()
+    key = f'{STATS_PREFIX}{name}:{"hit" if hit else "miss"}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def stats(names):
+    """{name: (hits, misses)} for the given page/fragment names."""
+    cache = get_cache()
+    keys = [f'{STATS_PREFIX}{name}:{kind}' for name in names for kind in ('hit', 'miss')]
+    found = cache.get_many(keys)
+    return {
+        name: (found.get(f'{STATS_PREFIX}{name}:hit', 0), found.get(f'{STATS_PREFIX}{name}:miss', 0))
+        for name in names
+    }
+
+
+def reset_stats(names):
+    get_cache().delete_many([f'{STATS_PREFIX}{name}:{kind}' for name in names for kind in ('hit', 'miss')])
+
+
+def prime_product_versions(products):
+    """Attach `_catalog_version` to each product so fragments don't look it up one by one."""
+    products = list(products)
+    versions = get_versions([product_version_name(p.pk) for p in products] + ['category'])
+    for product in products:
+        product._catalog_version = (versions[product_version_name(product.pk)], versions['category'])
+    return products
+
+
+def fragment_key(name, product):
+    version = getattr(product, '_catalog_version', None)
+    if version is None:
+        versions = get_versions([product_version_name(product.pk), 'category'])
+        version = (versions[product_version_name(product.pk)], versions['category'])
+    return f'fragment:{name}:{product.pk}:{version[0]}:{version[1]}'
+
+
+def _is_anonymous(request):
+    return not request.user.is_authenticated and not request.shop_user
+
+
+def is_storefront_request(request):
+    """Cookie-less anonymous GET in storefront mode: safe to share between visitors."""
+    return (
+        getattr(settings, 'STOREFRONT_HTTP_CACHE', False)
+        and request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+    )
+
+
+def _serve_page(request, view, args, kwargs, key, name):
+    cache = get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        record(name, True)
+        content, content_type = cached
+        if CSRF_PLACEHOLDER in content:
+            content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+        response = HttpResponse(content, content_type=content_type)
+        response['X-Page-Cache'] = 'hit'
+        return response
+    record(name, False)
+    response = view(request, *args, **kwargs)
+    if response.status_code == 200 and not getattr(response, 'streaming', False):
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        content = CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+        cache.set(key, (content, response['Content-Type']), page_cache_timeout())
+    response['X-Page-Cache'] = 'miss'
+    return response
+
+
+def cache_page_for_anonymous(name, versions=lambda request, **kwargs: ['catalog'], storefront=False, bypass=None):
+    """Serve whole GET pages for anonymous visitors from the cache.
+
+    `versions(request, **view_kwargs)` names the versions the page depends
+    on. The CSRF token is stored as a placeholder and filled in per request.
+    Responses carry an ``X-Page-Cache: hit|miss`` header. While `bypass()`
+    returns true the page is always rendered (for content no version covers).
+
+    With `storefront`, cookie-less requests (see `is_storefront_request`)
+    are rendered with ``request.storefront_cacheable`` set, validated against
+    ETag/Last-Modified (answering 304 when they match) and marked public.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if bypass is not None and bypass():
+                return view(request, *args, **kwargs)
+            shared = storefront and is_storefront_request(request)
+            if not shared and (request.method not in ('GET', 'HEAD') or not _is_anonymous(request)):
+                return view(request, *args, **kwargs)
+            current = get_versions(versions(request, **kwargs))
+            digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            version_part = ':'.join(str(current[v]) for v in sorted(current))
+            if not shared:
+                return _serve_page(request, view, args, kwargs, f'page:{name}:{version_part}:{digest}', name)
+            request.storefront_cacheable = True
+            etag = quote_etag(hashlib.sha1(f'{name}:{version_part}:{digest}'.encode()).hexdigest())
+            last_modified = max(current.values(), default=0) // 1000000 or None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = _serve_page(request, view, args, kwargs, f'storefront:{name}:{version_part}:{digest}', name)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+                patch_cache_control(response, public=True, max_age=getattr(settings, 'STOREFRONT_MAX_AGE', 60))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,79 @@
+from django.core import signing
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset."""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _split(ordering):
+    return [(f[1:], True) if f.startswith('-') else (f, False) for f in ordering]
+
+
+def encode_cursor(obj, ordering, salt):
+    """Signed, URL-safe token holding the ordering key of `obj`."""
+    values = []
+    for name, _ in _split(ordering):
+        field = obj._meta.get_field(name)
+        values.append(field.value_to_string(obj))
+    return signing.dumps(values, salt=salt, compress=True)
+
+
+def decode_cursor(model, cursor, ordering, salt):
+    """Return the typed key values stored in `cursor`, or None if it's invalid."""
+    try:
+        values = signing.loads(cursor, salt=salt)
+    except signing.BadSignature:
+        return None
+    fields = _split(ordering)
+    if not isinstance(values, list) or len(values) != len(fields):
+        return None
+    try:
+        return [model._meta.get_field(name).to_python(v) for (name, _), v in zip(fields, values)]
+    except Exception:
+        return None
+
+
+def _after(ordering, values):
+    # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), flipped for descending fields
+    condition = Q()
+    equal = {}
+    for (name, desc), value in zip(_split(ordering), values):
+        lookup = f'{name}__lt' if desc else f'{name}__gt'
+        condition |= Q(**equal, **{lookup: value})
+        equal[name] = value
+    return condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=24, salt='keyset'):
+    """Return a KeysetPage of `queryset` ordered by `ordering`.
+
+    `ordering` must end in a unique field (normally `id`) so the key is
+    total. Every page is a single indexed range scan of `per_page + 1`
+    rows, so deep pages cost the same as the first one.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(queryset.model, cursor, ordering, salt)
+        if values is not None:
+            queryset = queryset.filter(_after(ordering, values))
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1], ordering, salt)
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,191 @@
+"""Sampled request profiles (PROFILING_ENABLED), browsable at /admin/profiles/.
+
+`RequestProfilerMiddleware` runs a request under cProfile when:
+
+- it is picked at random (PROFILING_SAMPLE_RATE, a fraction of requests),
+- it was sent by a staff user with the PROFILING_HEADER header, or
+- an earlier request for the same path took longer than PROFILING_SLOW_MS.
+  A slow request that wasn't profiled can't be examined afterwards, so its
+  path is armed instead and the next request for it is profiled. That one
+  is kept only if it is slow as well.
+
+A profiled request also records its SQL statements and their timings. Each
+profile is stored as `<id>.json` (request details and SQL) plus `<id>.prof`
+(pstats data, which snakeviz and friends can open) in PROFILING_DIR. Only
+the newest PROFILING_MAX_PROFILES are kept. Unprofiled requests cost a
+random number and a dict lookup; with PROFILING_ENABLED off the middleware
+removes itself from the stack. One request per process is profiled at a
+time; others that would have been are skipped.
+"""
+import datetime
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+
+PROFILE_ID = re.compile(r'^\d+-\d+$')
+SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+_armed_lock = threading.Lock()
+_armed = set()
+# one profiled request per process at a time: Python 3.12+ allows a single
+# active profiler per process, and it bounds the overhead under load
+busy = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, 'PROFILING_ENABLED', False)
+
+
+def sample_rate():
+    return getattr(settings, 'PROFILING_SAMPLE_RATE', 0.01)
+
+
+def slow_seconds():
+    slow_ms = getattr(settings, 'PROFILING_SLOW_MS', 1000)
+    return slow_ms / 1000 if slow_ms else None
+
+
+def header():
+    return getattr(settings, 'PROFILING_HEADER', 'X-Profile')
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def max_profiles():
+    return getattr(settings, 'PROFILING_MAX_PROFILES', 200)
+
+
+def max_queries():
+    return getattr(settings, 'PROFILING_MAX_QUERIES', 500)
+
+
+def pick_trigger(request):
+    """Why `request` should be profiled ('sampled', 'slow' or 'header'), or None."""
+    if random.random() < sample_rate():
+        return 'sampled'
+    if _armed and request.path in _armed:
+        with _armed_lock:
+            _armed.discard(request.path)
+        return 'slow'
+    if header() in request.headers and getattr(request, 'user', None) is not None and request.user.is_staff:
+        return 'header'
+    return None
+
+
+def arm(path):
+    """Profile the next request for `path`."""
+    with _armed_lock:
+        # bounded: a flood of distinct slow paths just starts over
+        if len(_armed) >= 1000:
+            _armed.clear()
+        _armed.add(path)
+
+
+class SQLLog:
+    """`execute_wrapper` that records each statement and its time."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < max_queries():
+                self.queries.append({'alias': self.alias, 'sql': sql, 'ms': round((time.perf_counter() - started) * 1000, 3)})
+
+
+def save(profiler, request, response, trigger, seconds, logs):
+    """Store a profile and drop the oldest beyond PROFILING_MAX_PROFILES. Returns its id."""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f'{time.time_ns()}-{os.getpid()}'
+    queries = [query for log in logs for query in log.queries]
+    match = getattr(request, 'resolver_match', None)
+    user = getattr(request, 'user', None)
+    meta = {
+        'id': profile_id,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': match.view_name if match is not None else '',
+        'status': response.status_code,
+        'trigger': trigger,
+        'user': user.get_username() if user is not None and user.is_authenticated else '',
+        'duration_ms': round(seconds * 1000, 2),
+        'sql_count': len(queries),
+        'sql_ms': round(sum(query['ms'] for query in queries), 2),
+        'queries': queries,
+    }
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+    # the .json goes last: a profile is listed once both files exist
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump(meta, f)
+    for stale in _profile_ids()[:-max_profiles()]:
+        for ext in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(directory, f'{stale}.{ext}'))
+            except FileNotFoundError:
+                pass
+    return profile_id
+
+
+def _profile_ids():
+    """Stored profile ids, oldest first."""
+    try:
+        names = os.listdir(profile_dir())
+    except FileNotFoundError:
+        return []
+    ids = [name[:-5] for name in names if name.endswith('.json') and PROFILE_ID.match(name[:-5])]
+    return sorted(ids, key=lambda profile_id: int(profile_id.split('-')[0]))
+
+
+def list_profiles():
+    """Metadata (without the SQL) of every stored profile, newest first."""
+    profiles = []
+    for profile_id in reversed(_profile_ids()):
+        meta = load(profile_id)
+        if meta is not None:
+            meta.pop('queries', None)
+            profiles.append(meta)
+    return profiles
+
+
+def load(profile_id):
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), f'{profile_id}.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def stats_path(profile_id):
+    """Path of a profile's pstats file, or None."""
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    path = os.path.join(profile_dir(), f'{profile_id}.prof')
+    return path if os.path.exists(path) else None
+
+
+def stats_text(profile_id, sort='cumulative', limit=60):
+    """The profile's top `limit` functions as pstats prints them."""
+    path = stats_path(profile_id)
+    if path is None:
+        return ''
+    stream = io.StringIO()
+    stats = pstats.Stats(path, stream=stream)
+    stats.strip_dirs().sort_stats(sort if sort in SORT_KEYS else 'cumulative').print_stats(limit)
+    return stream.getvalue()
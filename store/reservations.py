@@ -0,0 +1,110 @@
+"""Optional stock reservations for cart lines (STOCK_RESERVATIONS).
+
+Adding to or changing a cart line holds its units for
+STOCK_RESERVATION_TTL seconds, so they can't be put in another cart or
+bought by someone else. Units available to a shopper are the size's stock
+minus what other shoppers hold. Checkout then only has to convert the
+holds: the stock is already set aside, so it doesn't fail after the
+address form has been filled in.
+
+Holds are never released explicitly: an expired row stops counting the
+moment it expires (every read filters on `expires_at`), and the
+`release_reservations` command deletes old rows. Deleting a cart line
+(removal, checkout) deletes its hold. Since nothing happens when a hold
+expires, the product page isn't served from the page cache while
+reservations are on, and shows its availability outside the cached
+fragments.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .ledger import live_stock
+from .models import CartItem, SIZE_BITS, SizeStock, StockReservation, bulk_upsert
+from .page_cache import bump_versions
+
+
+def enabled():
+    return getattr(settings, 'STOCK_RESERVATIONS', False)
+
+
+def ttl():
+    return datetime.timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 900))
+
+
+def active(now=None):
+    return StockReservation.objects.filter(expires_at__gt=now or timezone.now())
+
+
+def _keys_filter(keys):
+    q = Q()
+    for product_id, size in keys:
+        q |= Q(product_id=product_id, size=size)
+    return q
+
+
+def lock_sizes(keys):
+    """Lock the SizeStock rows of `keys` ((product_id, size) pairs) in pk order; returns their live stock."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    rows = SizeStock.objects.select_for_update().filter(_keys_filter(keys)).annotate(live=live_stock()).order_by('pk')
+    return {(row.product_id, row.size): row.live for row in rows}
+
+
+def held_by_others(user, keys):
+    """{(product_id, size): units held by other shoppers}: one aggregate query."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    rows = (
+        active().exclude(user=user).filter(_keys_filter(keys))
+        .values('product_id', 'size').annotate(held=Sum('quantity'))
+    )
+    return {(row['product_id'], row['size']): row['held'] for row in rows}
+
+
+def hold(user, keys):
+    """(Re)hold `user`'s cart lines for `keys` at their current quantity for a fresh TTL."""
+    keys = list(keys)
+    if not keys:
+        return
+    expires_at = timezone.now() + ttl()
+    lines = CartItem.objects.filter(user=user).filter(_keys_filter(keys)).values_list('pk', 'product_id', 'size', 'quantity')
+    bulk_upsert(
+        StockReservation,
+        [StockReservation(cart_item_id=pk, user=user, product_id=product_id, size=size, quantity=quantity,
+                          expires_at=expires_at)
+         for pk, product_id, size, quantity in lines],
+        unique_fields=['cart_item'], update_fields=['quantity', 'expires_at'],
+    )
+    bump_versions(product_ids={product_id for product_id, _ in keys})
+
+
+def availability(product):
+    """([(size, in_stock)], units) for `product`, net of active holds: one query."""
+    held = (
+        active().filter(product_id=OuterRef('product_id'), size=OuterRef('size'))
+        .values('product_id', 'size').annotate(held=Sum('quantity')).values('held')
+    )
+    free = {
+        size: max(stock - held, 0)
+        for size, stock, held in SizeStock.objects.filter(product=product).annotate(
+            live=live_stock(), held=Coalesce(Subquery(held, output_field=IntegerField()), Value(0)),
+        ).values_list('size', 'live', 'held')
+    }
+    return [(size, free.get(size, 0) > 0) for size in SIZE_BITS], sum(free.values())
+
+
+def release_expired(batch_size=1000, now=None):
+    """Delete expired holds in batches. Returns the number deleted."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        pks = list(StockReservation.objects.filter(expires_at__lte=now).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return released
+        released += StockReservation.objects.filter(pk__in=pks).delete()[1].get(StockReservation._meta.label, 0)
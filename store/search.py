@@ -0,0 +1,245 @@
+"""Ranked product search.
+
+Three interchangeable backends behind `get_backend()`:
+
+* MySQL: a FULLTEXT index on (name, specification), maintained by InnoDB.
+* SQLite: an FTS5 table `store_product_fts` kept in sync by Product signals.
+* Anything else (or SQLite without FTS5): an in-process inverted index
+  scored with BM25, built on first use and updated by the same signals.
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.db import OperationalError, connection, transaction
+
+from .models import Product, SIZE_BITS
+
+FTS_TABLE = 'store_product_fts'
+# how much a hit in the name counts compared to one in the specification
+NAME_WEIGHT = 5.0
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall((text or '').lower()) if len(t) > 1]
+
+
+def _filter_sql(category_id, size):
+    """Extra WHERE clauses / params on the `p` (store_product) alias."""
+    clauses, params = [], []
+    if category_id is not None:
+        clauses.append('p.category_id = %s')
+        params.append(category_id)
+    if size in SIZE_BITS:
+        clauses.append('(p.stock_size_mask & %s) != 0')
+        params.append(SIZE_BITS[size])
+    return ''.join(f' AND {c}' for c in clauses), params
+
+
+class MySQLFullTextBackend:
+    name = 'mysql_fulltext'
+
+    def index(self, product):
+        pass  # InnoDB keeps FULLTEXT indexes current
+
+    def remove(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, category_id=None, size=None, limit=20, offset=0):
+        if not tokenize(query):
+            return []
+        where, params = _filter_sql(category_id, size)
+        sql = (
+            f'SELECT p.id FROM {Product._meta.db_table} p '
+            'WHERE MATCH(p.name, p.specification) AGAINST (%s IN NATURAL LANGUAGE MODE)'
+            f'{where} '
+            'ORDER BY MATCH(p.name, p.specification) AGAINST (%s IN NATURAL LANGUAGE MODE) DESC, p.id '
+            'LIMIT %s OFFSET %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [query] + params + [query, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteFTSBackend:
+    name = 'sqlite_fts5'
+
+    def index(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, specification) VALUES (%s, %s, %s)',
+                [product.pk, product.name, product.specification],
+            )
+
+    def remove(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, specification) '
+                f'SELECT id, name, specification FROM {Product._meta.db_table}'
+            )
+
+    def search(self, query, category_id=None, size=None, limit=20, offset=0):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # quote every term so user input can't inject FTS5 syntax
+        match = ' OR '.join('"%s"' % t for t in tokens)
+        where, params = _filter_sql(category_id, size)
+        sql = (
+            f'SELECT p.id FROM {FTS_TABLE} JOIN {Product._meta.db_table} p ON p.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s{where} '
+            f'ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, 1.0), p.id LIMIT %s OFFSET %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match] + params + [limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class InvertedIndexBackend:
+    """Per-process BM25 index. Good enough for development and small catalogs.
+
+    Changes are applied when the saving transaction commits, so a rolled
+    back save leaves the index alone.
+    """
+    name = 'inverted_index'
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._postings = defaultdict(dict)   # token -> {product_id: weighted tf}
+        self._lengths = {}                   # product_id -> weighted length
+
+    def _add(self, pk, name, specification):
+        weighted = Counter()
+        for t in tokenize(name):
+            weighted[t] += NAME_WEIGHT
+        for t in tokenize(specification):
+            weighted[t] += 1
+        for t, tf in weighted.items():
+            self._postings[t][pk] = tf
+        self._lengths[pk] = sum(weighted.values())
+
+    def _drop(self, pk):
+        if self._lengths.pop(pk, None) is None:
+            return
+        for t in list(self._postings):
+            docs = self._postings[t]
+            if docs.pop(pk, None) is not None and not docs:
+                del self._postings[t]
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for pk, name, spec in Product.objects.values_list('pk', 'name', 'specification').iterator(chunk_size=2000):
+                self._add(pk, name, spec)
+            self._loaded = True
+
+    def index(self, product):
+        transaction.on_commit(lambda pk=product.pk, name=product.name, spec=product.specification: self._index(pk, name, spec))
+
+    def _index(self, pk, name, specification):
+        if not self._loaded:
+            return  # picked up by the initial load
+        with self._lock:
+            self._drop(pk)
+            self._add(pk, name, specification)
+
+    def remove(self, product_id):
+        transaction.on_commit(lambda: self._remove(product_id))
+
+    def _remove(self, product_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._drop(product_id)
+
+    def rebuild(self):
+        with self._lock:
+            self._loaded = False
+            self._postings.clear()
+            self._lengths.clear()
+
+    def rank(self, query):
+        self._ensure_loaded()
+        n = len(self._lengths)
+        if not n:
+            return []
+        avg = sum(self._lengths.values()) / n
+        scores = defaultdict(float)
+        for t in set(tokenize(query)):
+            docs = self._postings.get(t)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for pk, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[pk] / avg)
+                scores[pk] += idf * tf * (self.k1 + 1) / norm
+        return sorted(scores, key=lambda pk: (-scores[pk], pk))
+
+    def search(self, query, category_id=None, size=None, limit=20, offset=0):
+        ranked = self.rank(query)
+        if not ranked:
+            return []
+        if category_id is None and size not in SIZE_BITS:
+            return ranked[offset:offset + limit]
+        qs = Product.objects.filter(pk__in=ranked)
+        if category_id is not None:
+            qs = qs.filter(category_id=category_id)
+        bit = SIZE_BITS.get(size, 0)
+        allowed = {pk for pk, mask in qs.values_list('pk', 'stock_size_mask') if not bit or mask & bit}
+        return [pk for pk in ranked if pk in allowed][offset:offset + limit]
+
+
+_backends = {}
+
+
+def _sqlite_fts_available():
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            return cursor.fetchone() is not None
+    except OperationalError:
+        return False
+
+
+def get_backend():
+    """Search backend for the default database (chosen once per process)."""
+    vendor = connection.vendor
+    if vendor not in _backends:
+        if vendor == 'mysql':
+            _backends[vendor] = MySQLFullTextBackend()
+        elif vendor == 'sqlite' and _sqlite_fts_available():
+            _backends[vendor] = SQLiteFTSBackend()
+        else:
+            _backends[vendor] = InvertedIndexBackend()
+    return _backends[vendor]
+
+
+def search_products(query, category_id=None, size=None, page=1, per_page=20):
+    """Return (products, has_next) for one page of ranked results.
+
+    Products are loaded with the card projection and kept in rank order.
+    """
+    page = max(1, page)
+    ids = get_backend().search(query, category_id=category_id, size=size,
+                               limit=per_page + 1, offset=(page - 1) * per_page)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    by_id = Product.objects.only(*Product.CARD_FIELDS).in_bulk(ids)
+    return [by_id[pk] for pk in ids if pk in by_id], has_next
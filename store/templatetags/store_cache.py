@@ -0,0 +1,39 @@
+from django import template
+
+from store.page_cache import fragment_key, get_cache, page_cache_timeout, record
+
+register = template.Library()
+
+
+class CatalogFragmentNode(template.Node):
+    def __init__(self, name, product, nodelist):
+        self.name = name
+        self.product = product
+        self.nodelist = nodelist
+
+    def render(self, context):
+        product = self.product.resolve(context)
+        cache = get_cache()
+        key = fragment_key(self.name, product)
+        html = cache.get(key)
+        record(f'fragment:{self.name}', html is not None)
+        if html is None:
+            html = self.nodelist.render(context)
+            cache.set(key, html, page_cache_timeout())
+        return html
+
+
+@register.tag
+def catalog_fragment(parser, token):
+    """Cache a per-product block, keyed by the product and category versions.
+
+        {% catalog_fragment "product_card" product %} ... {% endcatalog_fragment %}
+
+    The block must not contain per-user or per-request output (CSRF tokens etc.).
+    """
+    bits = token.split_contents()
+    if len(bits) != 3 or bits[1][0] not in '"\'' or bits[1][0] != bits[1][-1]:
+        raise template.TemplateSyntaxError(f'{bits[0]} takes a quoted name and a product')
+    nodelist = parser.parse(('endcatalog_fragment',))
+    parser.delete_first_token()
+    return CatalogFragmentNode(bits[1][1:-1], parser.compile_filter(bits[2]), nodelist)
@@ -0,0 +1,29 @@
+from django import template
+from django.utils.html import format_html
+
+from store.images import srcset_for
+
+register = template.Library()
+
+
+@register.filter
+def srcset(product, ext='jpg'):
+    """`{{ product|srcset:"webp" }}` -> "url 160w, url 320w, ..." (empty until derivatives exist)."""
+    return srcset_for(product, ext)
+
+
+@register.simple_tag
+def product_picture(product, sizes='100vw', css_class='', alt=None, style=''):
+    """Render a <picture> with WebP/JPEG srcsets, falling back to the original upload."""
+    if not product.image:
+        return ''
+    alt = product.name if alt is None else alt
+    webp = srcset_for(product, 'webp')
+    if not webp:
+        return format_html('<img src="{}" class="{}" alt="{}" style="{}" loading="lazy">',
+                           product.image.url, css_class, alt, style)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" class="{}" alt="{}" style="{}" loading="lazy"></picture>',
+        webp, sizes, product.image.url, srcset_for(product, 'jpg'), sizes, css_class, alt, style,
+    )
@@ -1,3 +1,835 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from PIL import Image
+
+from . import checkout, group_commit, images, inventory, ledger, page_cache, reservations, search
+from .admin import SizeStockAdmin, SizeStockInline
+from .cart import add_item, upsert_lines
+from .checkout import CheckoutError, place_order
+from .management.commands import reconcile_stock
+from .models import (
+    Address, CartItem, Category, Order, OrderItem, OrderSummary, Product, SizeStock, StockMovement, StockReservation,
+    Wishlist, update_stock_aggregates,
+)
+from .orders import refresh_summaries, transition_orders
+from .pagination import decode_cursor, encode_cursor, keyset_paginate
+from .user_cache import TTLUserCache, user_cache
+
+
+class StoreTestCase(TestCase):
+    """Shared fixtures: one category, products with 2 units per size, two shoppers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='men')
+        cls.alice = User.objects.create_user('alice', password='pw12345!x')
+        cls.bob = User.objects.create_user('bob', password='pw12345!x')
+
+    def make_address(self, user):
+        return Address.objects.create(user=user, address_line='1 Main St', city='Pune', state='MH',
+                                      postal_code='411001', country='India')
+
+    def make_product(self, stock=10, price='10.00', name='Tee'):
+        return Product.objects.create(category=self.category, name=name, specification='soft cotton tee',
+                                      price=price, initial_total_stock=stock)
+
+
+class StockAggregateTests(StoreTestCase):
+    def test_repeated_size_last_entry_wins(self):
+        product = self.make_product()
+        update_stock_aggregates([(product.pk, 'M', -2, False), (product.pk, 'M', 1, True), (product.pk, 'L', -2, False)])
+        product.refresh_from_db()
+        self.assertEqual(product.total_stock, 7)
+        self.assertEqual(dict(product.size_availability), {'S': True, 'M': True, 'L': False, 'XL': True, 'XXL': True})
+        update_stock_aggregates([(product.pk, 'M', 1, True), (product.pk, 'M', -2, False)])
+        product.refresh_from_db()
+        self.assertEqual(product.total_stock, 6)
+        self.assertFalse(dict(product.size_availability)['M'])
+
+    def test_reconcile_recomputes_under_lock(self):
+        product, other = self.make_product(), self.make_product(name='Polo')
+        Product.objects.filter(pk=product.pk).update(stock_total=3, stock_size_mask=0)
+        command = reconcile_stock.Command()
+        repair = command._repair
+
+        def sale_then_repair(pks):
+            # a checkout committing between the scan and the repair
+            ledger.move(product.pk, 'M', -2, StockMovement.KIND_SALE)
+            repair(pks)
+
+        with mock.patch.object(command, '_repair', sale_then_repair):
+            call_command(command, stdout=io.StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.total_stock, 8)
+        self.assertEqual(dict(product.size_availability), {'S': True, 'M': False, 'L': True, 'XL': True, 'XXL': True})
+        self.assertEqual(Product.objects.get(pk=other.pk).total_stock, 10)
+
+
+class RestockTests(StoreTestCase):
+    def test_restock_out_of_stock(self):
+        product = self.make_product()
+        ledger.move(product.pk, 'M', -2, StockMovement.KIND_SALE)
+        SizeStock.objects.filter(product=product, size='XL').delete()
+        self.assertEqual(inventory.restock_out_of_stock([(product.pk, 'M'), (product.pk, 'L'), (product.pk, 'XL')]), 2)
+        self.assertEqual(ledger.live_stock_of(SizeStock.objects.get(product=product, size='M')), 2)
+        self.assertEqual(SizeStock.objects.get(product=product, size='XL').stock, 2)
+        self.assertEqual(Product.objects.get(pk=product.pk).total_stock, 10)
+
+    def test_size_created_meanwhile_is_not_counted(self):
+        product = self.make_product()
+        SizeStock.objects.filter(product=product, size='XL').delete()
+        restock_qty = inventory.default_restock_qty
+
+        def created_by_someone_else(initial):
+            SizeStock.objects.get_or_create(product=product, size='XL', defaults={'stock': 7})
+            return restock_qty(initial)
+
+        with mock.patch.object(inventory, 'default_restock_qty', created_by_someone_else):
+            self.assertEqual(inventory.restock_out_of_stock([(product.pk, 'XL')]), 0)
+        self.assertEqual(SizeStock.objects.get(product=product, size='XL').stock, 7)
+        self.assertEqual(Product.objects.get(pk=product.pk).total_stock, 8)
+
+
+
+class KeysetPaginationTests(StoreTestCase):
+    ORDERING = ('-price', 'id')
+
+    def setUp(self):
+        # ties on price, so the id has to break them
+        self.products = [self.make_product(price=price, name=f'Tee {i}')
+                         for i, price in enumerate(['5.00', '9.50', '9.50', '9.50', '5.00'])]
+
+    def pages(self, per_page):
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(Product.objects.all(), self.ORDERING, cursor=cursor, per_page=per_page)
+            pages.append(page)
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_cursor_round_trip(self):
+        product = self.products[1]
+        cursor = encode_cursor(product, self.ORDERING, salt='test')
+        self.assertEqual(decode_cursor(Product, cursor, self.ORDERING, salt='test'), [Decimal('9.50'), product.pk])
+
+    def test_tampered_or_foreign_cursor_is_rejected(self):
+        cursor = encode_cursor(self.products[1], self.ORDERING, salt='test')
+        self.assertIsNone(decode_cursor(Product, cursor, self.ORDERING, salt='other'))
+        tampered = cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B')
+        self.assertIsNone(decode_cursor(Product, tampered, self.ORDERING, salt='test'))
+        self.assertIsNone(decode_cursor(Product, cursor, ('price', 'name', 'id'), salt='test'))
+        # a bad cursor starts over at the first page
+        page = keyset_paginate(Product.objects.all(), self.ORDERING, cursor=tampered, per_page=2, salt='test')
+        self.assertEqual([p.pk for p in page], [self.products[1].pk, self.products[2].pk])
+
+    def test_ties_are_paged_without_gaps_or_repeats(self):
+        expected = list(Product.objects.order_by(*self.ORDERING).values_list('pk', flat=True))
+        for per_page in (1, 2, 3):
+            pages = self.pages(per_page)
+            self.assertEqual([p.pk for page in pages for p in page], expected)
+            self.assertEqual([len(page) for page in pages[:-1]], [per_page] * (len(pages) - 1))
+
+    def test_has_next_on_the_last_page(self):
+        # 5 rows: pages of 5 and of 6 are the only page; pages of 4 end with one row
+        self.assertFalse(self.pages(5)[0].has_next)
+        self.assertFalse(self.pages(6)[0].has_next)
+        pages = self.pages(4)
+        self.assertEqual([(len(page), page.has_next) for page in pages], [(4, True), (1, False)])
+
+
+class CartUpsertTests(StoreTestCase):
+    def quantities(self):
+        return dict(CartItem.objects.filter(user=self.alice).values_list('size', 'quantity'))
+
+    def test_new_line(self):
+        product = self.make_product()
+        self.assertTrue(add_item(self.alice, product.pk, 'M', 2))
+        line = CartItem.objects.get(user=self.alice)
+        self.assertEqual((line.product_id, line.size, line.quantity), (product.pk, 'M', 2))
+        self.assertIsNotNone(line.added_at)
+
+    def test_repeated_line_is_merged(self):
+        product = self.make_product()
+        self.assertTrue(add_item(self.alice, product.pk, 'M', 1))
+        self.assertTrue(add_item(self.alice, product.pk, 'M', 1))
+        self.assertEqual(self.quantities(), {'M': 2})
+
+    def test_stock_caps_the_cart(self):
+        product = self.make_product()
+        self.assertFalse(add_item(self.alice, product.pk, 'M', 3))
+        self.assertTrue(add_item(self.alice, product.pk, 'M', 2))
+        # what is already in the cart counts against the stock
+        self.assertFalse(add_item(self.alice, product.pk, 'M', 1))
+        self.assertEqual(self.quantities(), {'M': 2})
+        # so do sales not yet compacted into the snapshot
+        ledger.move(product.pk, 'L', -1, StockMovement.KIND_SALE)
+        self.assertFalse(add_item(self.alice, product.pk, 'L', 2))
+        self.assertFalse(add_item(self.alice, product.pk + 1000, 'M', 1))
+        self.assertEqual(self.quantities(), {'M': 2})
+
+    def test_short_lines_are_left_out(self):
+        product = self.make_product()
+        upsert_lines(self.alice, [(product.pk, 'S', 1), (product.pk, 'M', 5), (product.pk, 'L', 0)])
+        self.assertEqual(self.quantities(), {'S': 1})
+
+
+class GuestCartMergeTests(StoreTestCase):
+    def log_in_with_guest_session(self, cart, wishlist=()):
+        session = self.client.session
+        session['guest_cart'] = cart
+        session['guest_wishlist'] = list(wishlist)
+        session.save()
+        return self.client.post(reverse('login'), {'username': 'alice', 'password': 'pw12345!x'})
+
+    def test_merge_on_login(self):
+        tee, polo = self.make_product(), self.make_product(name='Polo')
+        CartItem.objects.create(user=self.alice, product=tee, size='M', quantity=1)
+        Wishlist.objects.create(user=self.alice, product=tee)
+        response = self.log_in_with_guest_session(
+            {f'{tee.pk}:M': 1, f'{tee.pk}:S': 2, f'{polo.pk}:L': 3}, wishlist=[tee.pk, polo.pk, polo.pk])
+
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        # the guest line is added to the existing one; the polo doesn't fit the stock
+        self.assertEqual(sorted(CartItem.objects.filter(user=self.alice).values_list('product_id', 'size', 'quantity')),
+                         sorted([(tee.pk, 'M', 2), (tee.pk, 'S', 2)]))
+        self.assertEqual(sorted(Wishlist.objects.filter(user=self.alice).values_list('product_id', flat=True)),
+                         sorted([tee.pk, polo.pk]))
+        [message] = get_messages(response.wsgi_request)
+        self.assertEqual(message.level_tag, 'warning')
+        self.assertIn('Polo (L)', message.message)
+        self.assertNotIn('guest_cart', self.client.session)
+
+    def test_nothing_merged(self):
+        tee = self.make_product()
+        response = self.log_in_with_guest_session({f'{tee.pk}:M': 5})
+        self.assertRedirects(response, reverse('user_home'), fetch_redirect_response=False)
+        self.assertFalse(CartItem.objects.filter(user=self.alice).exists())
+        [message] = get_messages(response.wsgi_request)
+        self.assertIn('Tee (M)', message.message)
+
+
+class CheckoutTests(StoreTestCase):
+    def live(self, product, size):
+        return ledger.live_stock_of(SizeStock.objects.get(product=product, size=size))
+
+    def test_place_order(self):
+        tee, polo = self.make_product(), self.make_product(price='25.00', name='Polo')
+        CartItem.objects.create(user=self.alice, product=tee, size='M', quantity=2)
+        CartItem.objects.create(user=self.alice, product=polo, size='L', quantity=2)
+        order = place_order(self.alice, self.make_address(self.alice))
+
+        self.assertEqual(order.total, 70)
+        self.assertEqual((self.live(tee, 'M'), self.live(polo, 'L'), self.live(tee, 'S')), (0, 0, 2))
+        self.assertEqual(sorted(StockMovement.objects.filter(kind=StockMovement.KIND_SALE)
+                                .values_list('product_id', 'size', 'delta')),
+                         sorted([(tee.pk, 'M', -2), (polo.pk, 'L', -2)]))
+        self.assertEqual(sorted(order.order_items.values_list('product_id', 'size', 'quantity')),
+                         sorted([(tee.pk, 'M', 2), (polo.pk, 'L', 2)]))
+        summary = OrderSummary.objects.get(order=order)
+        self.assertEqual((summary.item_count, summary.total), (2, order.total))
+        self.assertFalse(CartItem.objects.filter(user=self.alice).exists())
+        tee.refresh_from_db()
+        self.assertEqual(tee.total_stock, 8)
+        self.assertEqual(dict(tee.size_availability)['M'], False)
+
+    def test_insufficient_stock_writes_nothing(self):
+        tee, polo = self.make_product(), self.make_product(name='Polo')
+        CartItem.objects.create(user=self.alice, product=tee, size='M', quantity=1)
+        CartItem.objects.create(user=self.alice, product=polo, size='L', quantity=3)
+        with self.assertRaisesMessage(CheckoutError, 'Insufficient stock for Polo size L.'):
+            place_order(self.alice, self.make_address(self.alice))
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertEqual((self.live(tee, 'M'), self.live(polo, 'L')), (2, 2))
+        self.assertEqual(CartItem.objects.filter(user=self.alice).count(), 2)
+        self.assertEqual(Product.objects.get(pk=tee.pk).total_stock, 10)
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        address = self.make_address(self.alice)
+
+        def checkout_queries(product_count):
+            for i in range(product_count):
+                CartItem.objects.create(user=self.alice, product=self.make_product(name=f'Tee {i}'), size='M', quantity=1)
+            with CaptureQueriesContext(connection) as queries:
+                place_order(self.alice, address)
+            return len(queries)
+
+        self.assertEqual(checkout_queries(1), checkout_queries(4))
+
+
+@override_settings(STOCK_GROUP_COMMIT=True, STOCK_GROUP_COMMIT_WINDOW_MS=0)
+class GroupCommitCheckoutTests(StoreTestCase):
+    """`place_order` only groups outside a transaction, so these call the grouped path directly."""
+
+    def setUp(self):
+        self.tee, self.polo = self.make_product(), self.make_product(name='Polo')
+        CartItem.objects.create(user=self.alice, product=self.tee, size='M', quantity=2)
+        CartItem.objects.create(user=self.alice, product=self.polo, size='L', quantity=1)
+        self.address = self.make_address(self.alice)
+
+    def live(self, product, size):
+        return ledger.live_stock_of(SizeStock.objects.get(product=product, size=size))
+
+    def assert_put_back(self):
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual((self.live(self.tee, 'M'), self.live(self.polo, 'L')), (2, 2))
+        self.assertEqual(sorted(StockMovement.objects.filter(kind=StockMovement.KIND_ADJUST)
+                                .values_list('product_id', 'size', 'delta')),
+                         sorted([(self.tee.pk, 'M', 2), (self.polo.pk, 'L', 1)]))
+        self.assertEqual(Product.objects.get(pk=self.tee.pk).total_stock, 10)
+
+    def test_place_order(self):
+        order = checkout._place_order_grouped(self.alice, self.address)
+        self.assertEqual(order.order_items.count(), 2)
+        self.assertEqual((self.live(self.tee, 'M'), self.live(self.polo, 'L')), (0, 1))
+        self.assertFalse(StockMovement.objects.filter(kind=StockMovement.KIND_ADJUST).exists())
+
+    def test_failed_order_write_puts_stock_back(self):
+        with mock.patch.object(checkout, '_create_order', side_effect=RuntimeError('disk full')), \
+                self.assertRaisesMessage(RuntimeError, 'disk full'):
+            checkout._place_order_grouped(self.alice, self.address)
+        self.assert_put_back()
+
+    def test_cart_changed_after_decrement_puts_stock_back(self):
+        decrement = group_commit.coordinator.decrement
+
+        def decrement_then_edit_cart(needed):
+            results = decrement(needed)
+            CartItem.objects.filter(user=self.alice, size='L').update(quantity=2)
+            return results
+
+        with mock.patch.object(group_commit.coordinator, 'decrement', decrement_then_edit_cart), \
+                self.assertRaisesMessage(CheckoutError, 'Your cart changed during checkout'):
+            checkout._place_order_grouped(self.alice, self.address)
+        self.assert_put_back()
+
+    def test_failed_batch_puts_other_sizes_back(self):
+        apply = group_commit._apply
+
+        def fail_for_polo(key, quantities):
+            if key[0] == self.polo.pk:
+                raise RuntimeError('lock wait timeout')
+            return apply(key, quantities)
+
+        with mock.patch.object(group_commit, '_apply', fail_for_polo), \
+                self.assertRaisesMessage(RuntimeError, 'lock wait timeout'):
+            checkout._place_order_grouped(self.alice, self.address)
+        self.assertEqual(self.live(self.tee, 'M'), 2)
+        self.assertEqual(list(StockMovement.objects.filter(kind=StockMovement.KIND_ADJUST)
+                              .values_list('product_id', 'delta')), [(self.tee.pk, 2)])
+
+
+class StockCoordinatorTests(SimpleTestCase):
+    @override_settings(STOCK_GROUP_COMMIT_WINDOW_MS=100)
+    def test_concurrent_requests_share_a_batch(self):
+        coordinator = group_commit.StockCoordinator()
+        batches = []
+
+        def apply(key, quantities):
+            batches.append((key, list(quantities)))
+            # 3 units left: handed out in arrival order
+            left, results = 3, []
+            for quantity in quantities:
+                results.append(quantity <= left)
+                left -= quantity if quantity <= left else 0
+            return results
+
+        results = [None] * 3
+        started = threading.Barrier(3)
+
+        def shopper(index, quantity):
+            started.wait()
+            results[index] = coordinator.decrement({(1, 'M'): quantity})
+
+        with mock.patch.object(group_commit, '_apply', apply):
+            threads = [threading.Thread(target=shopper, args=(i, q)) for i, q in enumerate((2, 2, 1))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual((coordinator.batches, coordinator.requests), (1, 3))
+        self.assertEqual(sorted(batches[0][1]), [1, 2, 2])
+        self.assertEqual(sum(r[(1, 'M')] for r in results), 2)
+        self.assertEqual([r[(1, 'M')] for r in results].count(False), 1)
+
+
+@override_settings(STOCK_RESERVATIONS=True)
+class ReservationTests(StoreTestCase):
+    def test_hold_and_rehold(self):
+        product = self.make_product()
+        self.assertTrue(add_item(self.alice, product.pk, 'M', 1))
+        first = StockReservation.objects.get(user=self.alice)
+        self.assertEqual(first.quantity, 1)
+        # adding again re-holds the same row at the new quantity with a fresh expiry
+        self.assertTrue(add_item(self.alice, product.pk, 'M', 1))
+        second = StockReservation.objects.get(user=self.alice)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(second.quantity, 2)
+        self.assertGreaterEqual(second.expires_at, first.expires_at)
+        # alice holds both units, so bob can't have one
+        self.assertFalse(add_item(self.bob, product.pk, 'M', 1))
+
+    @override_settings(STOREFRONT_HTTP_CACHE=True)
+    def test_product_page_drops_expired_holds(self):
+        product = self.make_product()
+        self.assertTrue(add_item(self.bob, product.pk, 'M', 2))
+        url = reverse('product_detail', args=[product.pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'Available: <strong>8</strong>')
+        self.assertNotIn('ETag', response)
+        # expiring bumps no version: the page must not be served from any cache
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertContains(self.client.get(url), 'Available: <strong>10</strong>')
+        self.client.force_login(self.alice)
+        self.assertContains(self.client.get(url), 'Available: <strong>10</strong>')
+
+    def test_hold_without_conflict_target(self):
+        # MySQL: ON DUPLICATE KEY UPDATE can't name the unique key
+        product = self.make_product()
+        CartItem.objects.create(user=self.alice, product=product, size='M', quantity=1)
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(StockReservation.objects, 'bulk_create') as bulk_create:
+            reservations.hold(self.alice, [(product.pk, 'M')])
+        self.assertIsNone(bulk_create.call_args.kwargs['unique_fields'])
+        self.assertTrue(bulk_create.call_args.kwargs['update_conflicts'])
+
+
+class OrderSummaryTests(StoreTestCase):
+    def test_saving_order_without_summary_rebuilds_it(self):
+        product = self.make_product()
+        order = Order.objects.create(user=self.alice, address=self.make_address(self.alice), total='20.00')
+        OrderItem.objects.create(order=order, product=product, size='M', quantity=2, price='10.00')
+        self.assertFalse(OrderSummary.objects.filter(order=order).exists())
+        order.tracking_status = 'Packed'
+        order.save()
+        summary = OrderSummary.objects.get(order=order)
+        self.assertEqual((summary.item_count, summary.tracking_status), (1, 'Packed'))
+        self.assertEqual(summary.thumbnails[0]['product_id'], product.pk)
+
+    def test_refresh_without_conflict_target(self):
+        order = Order.objects.create(user=self.alice, address=self.make_address(self.alice), total='0.00')
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(OrderSummary.objects, 'bulk_create') as bulk_create:
+            refresh_summaries([order.pk])
+        self.assertIsNone(bulk_create.call_args.kwargs['unique_fields'])
+
+
+class DirtyFieldsTests(StoreTestCase):
+    def setUp(self):
+        self.order = Order.objects.create(user=self.alice, address=self.make_address(self.alice), total='10.00')
+
+    def test_snapshot_from_load(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.tracking_status = 'Packed'
+        with self.assertNumQueries(0):
+            self.assertEqual(order.changed_fields, {'tracking_status'})
+            self.assertEqual(order.previous('tracking_status'), 'Order Placed')
+        order.save()
+        # tracking restarts from the saved values
+        with self.assertNumQueries(0):
+            self.assertEqual(order.changed_fields, set())
+            self.assertEqual(order.previous('status'), Order.STATUS_PACKED)
+        with self.assertRaises(ValueError):
+            order.previous('total')
+
+    def test_new_instance(self):
+        order = Order(user=self.alice, total='1.00')
+        with self.assertNumQueries(0):
+            self.assertIsNone(order.previous('status'))
+
+    def test_database_fallback(self):
+        # built by hand, or loaded with the tracked fields deferred: one SELECT, then cached
+        for order in (Order(pk=self.order.pk, status=Order.STATUS_SHIPPED), Order.objects.only('id').get(pk=self.order.pk)):
+            with self.assertNumQueries(1):
+                self.assertEqual(order.previous('status'), Order.STATUS_PLACED)
+                self.assertEqual(order.previous('tracking_status'), 'Order Placed')
+        order = Order(pk=self.order.pk, status=Order.STATUS_SHIPPED, tracking_status='Shipped')
+        self.assertEqual(order.changed_fields, {'status', 'tracking_status'})
+
+    def test_save_does_not_reread_the_order(self):
+        refresh_summaries([self.order.pk])
+        order = Order.objects.get(pk=self.order.pk)
+        order.tracking_status = 'Delivered'
+        table = connection.ops.quote_name(Order._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+        self.assertEqual([q['sql'] for q in queries if q['sql'].startswith('SELECT') and f'FROM {table}' in q['sql']], [])
+
+
+class OrderTransitionTests(StoreTestCase):
+    def setUp(self):
+        self.tee, self.polo = self.make_product(), self.make_product(name='Polo')
+        self.address = self.make_address(self.alice)
+
+    def order(self, *lines):
+        for product, size, quantity in lines:
+            CartItem.objects.create(user=self.alice, product=product, size=size, quantity=quantity)
+        return place_order(self.alice, self.address)
+
+    def live(self, product, size):
+        return ledger.live_stock_of(SizeStock.objects.get(product=product, size=size))
+
+    def test_illegal_moves_are_rejected(self):
+        placed = self.order((self.tee, 'M', 1))
+        delivered = self.order((self.tee, 'L', 1))
+        transition_orders([delivered.pk], Order.STATUS_DELIVERED)
+        moved, rejected = transition_orders([placed.pk, delivered.pk], Order.STATUS_PACKED)
+        self.assertEqual((moved, rejected), ([placed.pk], [delivered.pk]))
+        self.assertEqual(dict(Order.objects.values_list('pk', 'status')),
+                         {placed.pk: Order.STATUS_PACKED, delivered.pk: Order.STATUS_DELIVERED})
+        self.assertEqual(dict(OrderSummary.objects.values_list('order_id', 'tracking_status')),
+                         {placed.pk: 'Packed', delivered.pk: 'Delivered'})
+        with self.assertRaises(ValueError):
+            transition_orders([placed.pk], 'LOST')
+
+    def test_cancel_returns_units_once_in_bulk(self):
+        orders = [self.order((self.tee, 'M', 1), (self.polo, 'S', 1)), self.order((self.tee, 'M', 1))]
+        self.assertEqual(self.live(self.tee, 'M'), 0)
+        moved, _ = transition_orders([o.pk for o in orders], Order.STATUS_CANCELLED)
+        self.assertEqual(len(moved), 2)
+        # one movement per size, summed over the orders
+        self.assertEqual(sorted(StockMovement.objects.filter(kind=StockMovement.KIND_RETURN)
+                                .values_list('product_id', 'size', 'delta')),
+                         sorted([(self.tee.pk, 'M', 2), (self.polo.pk, 'S', 1)]))
+        self.assertEqual((self.live(self.tee, 'M'), self.live(self.polo, 'S')), (2, 2))
+        self.assertEqual(Product.objects.get(pk=self.tee.pk).total_stock, 10)
+        self.assertTrue(dict(Product.objects.get(pk=self.tee.pk).size_availability)['M'])
+        # already cancelled: rejected, nothing returned twice
+        self.assertEqual(transition_orders([o.pk for o in orders], Order.STATUS_CANCELLED), ([], sorted(o.pk for o in orders)))
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.KIND_RETURN).count(), 2)
+
+    def test_cancel_query_count_does_not_grow(self):
+        def cancel_queries(order_count):
+            ids = [self.order((self.tee, size, 1), (self.polo, size, 1)).pk for size in ['S', 'M', 'L', 'XL'][:order_count]]
+            with CaptureQueriesContext(connection) as queries:
+                transition_orders(ids, Order.STATUS_CANCELLED)
+            return len(queries)
+
+        self.assertEqual(cancel_queries(1), cancel_queries(4))
+
+    def test_saving_a_cancelled_order_returns_units(self):
+        order = self.order((self.tee, 'M', 2))
+        order = Order.objects.get(pk=order.pk)
+        order.tracking_status = 'Cancelled'
+        order.save()
+        order.save()
+        self.assertEqual(self.live(self.tee, 'M'), 2)
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.KIND_RETURN).count(), 1)
+
+    def test_delivery_restocks_sold_out_sizes(self):
+        order = self.order((self.tee, 'M', 2))
+        transition_orders([order.pk], Order.STATUS_DELIVERED)
+        self.assertEqual(self.live(self.tee, 'M'), 2)
+
+
+@override_settings(INVENTORY_COMPACTION_LAG=0)
+class AdminStockEditTests(StoreTestCase):
+    """An admin edit must not write back a snapshot compaction has moved on from."""
+
+    def stale_row_after_compaction(self):
+        product = self.make_product()
+        ledger.move(product.pk, 'M', -1, StockMovement.KIND_SALE)
+        # the admin form loaded the row before compaction folded the sale in
+        stale = SizeStock.objects.get(product=product, size='M')
+        self.assertEqual(ledger.compact(), 1)
+        return stale
+
+    def assert_adjusted(self, size_stock):
+        sale = StockMovement.objects.get(kind=StockMovement.KIND_SALE)
+        fresh = SizeStock.objects.get(pk=size_stock.pk)
+        self.assertEqual((fresh.stock, fresh.ledger_position), (1, sale.pk))
+        self.assertEqual(ledger.live_stock_of(fresh), 5)
+        # 1 unit left after the sale, so the adjustment is +4
+        self.assertEqual(StockMovement.objects.get(kind=StockMovement.KIND_ADJUST).delta, 4)
+
+    def test_change_form(self):
+        obj = self.stale_row_after_compaction()
+        obj.stock = 5
+        SizeStockAdmin(SizeStock, admin.site).save_model(None, obj, None, change=True)
+        self.assert_adjusted(obj)
+
+    def test_status_follows_live_stock(self):
+        product = self.make_product()
+        ledger.move(product.pk, 'M', -2, StockMovement.KIND_SALE)
+        # not compacted yet: the stored status still says in stock
+        self.assertEqual(SizeStock.objects.get(product=product, size='M').status, SizeStock.STATUS_IN)
+        self.client.force_login(User.objects.create_superuser('root', password='pw12345!x'))
+        url = reverse('admin:store_sizestock_changelist')
+        sold_out = self.client.get(url, {'status': SizeStock.STATUS_OUT}).context['cl'].result_list
+        self.assertEqual([(row.size, row.live) for row in sold_out], [('M', 0)])
+        in_stock = self.client.get(url, {'status': SizeStock.STATUS_IN}).context['cl'].result_list
+        self.assertEqual(sorted(row.size for row in in_stock), ['L', 'S', 'XL', 'XXL'])
+        response = self.client.get(reverse('admin:store_product_change', args=[product.pk]))
+        self.assertContains(response, 'Out of Stock', count=1)
+
+    def test_product_inline(self):
+        obj = self.stale_row_after_compaction()
+        obj.stock = 5
+        SizeStockInline.SizeStockInlineFormset.save_existing(None, None, obj)
+        self.assert_adjusted(obj)
+
+
+class SearchIndexTests(StoreTestCase):
+    def test_only_searched_fields_reindex(self):
+        product = self.make_product()
+        with mock.patch.object(search, 'get_backend') as get_backend:
+            product.save(update_fields=['image_hash', 'image_widths'])
+            product.save(update_fields=['price'])
+            get_backend().index.assert_not_called()
+            product.name = 'Polo'
+            product.save(update_fields=['name'])
+            product.save()
+            self.assertEqual(get_backend().index.call_count, 2)
+
+    def test_fixtures_are_skipped(self):
+        product = self.make_product()
+        with mock.patch.object(search, 'get_backend') as get_backend:
+            post_save.send(Product, instance=product, created=False, raw=True, update_fields=None)
+        get_backend().index.assert_not_called()
+
+    def test_inverted_index_waits_for_commit(self):
+        backend = search.InvertedIndexBackend()
+        product = self.make_product(name='Linen shirt')
+        self.assertEqual(backend.rank('linen'), [product.pk])
+        product.name = 'Denim jacket'
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            backend.index(product)
+            raise RuntimeError
+        self.assertEqual((backend.rank('linen'), backend.rank('denim')), ([product.pk], []))
+        with self.captureOnCommitCallbacks(execute=True):
+            backend.index(product)
+        self.assertEqual((backend.rank('linen'), backend.rank('denim')), ([], [product.pk]))
+
+    def test_rebuild(self):
+        product = self.make_product(name='Linen shirt')
+        backend = search.get_backend()
+        backend.remove(product.pk)
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(backend.search('linen'), [product.pk])
+
+
+class PageCacheTests(StoreTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.product = self.make_product()
+        self.detail = reverse('product_detail', args=[self.product.pk])
+
+    def change(self, apply):
+        # versions are bumped when the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            apply()
+
+    def get(self, client, url):
+        response = client.get(url)
+        return response, response.get('X-Page-Cache')
+
+    @override_settings(STOREFRONT_HTTP_CACHE=False)
+    def test_catalog_changes_invalidate_pages(self):
+        self.assertEqual(self.get(self.client, self.detail)[1], 'miss')
+        self.assertEqual(self.get(self.client, self.detail)[1], 'hit')
+        self.change(lambda: ledger.move(self.product.pk, 'M', -2, StockMovement.KIND_SALE))
+        response, state = self.get(self.client, self.detail)
+        self.assertEqual(state, 'miss')
+        self.assertContains(response, 'Available: <strong>8</strong>')
+
+        self.product.price = '12.00'
+        self.change(self.product.save)
+        self.assertContains(self.client.get(self.detail), '$12.00')
+
+        listing = reverse('product_list', args=[self.category.name])
+        self.get(self.client, listing)
+        self.assertEqual(self.get(self.client, listing)[1], 'hit')
+        self.change(self.category.save)
+        self.assertEqual(self.get(self.client, listing)[1], 'miss')
+
+    def test_fragments_follow_product_changes(self):
+        self.client.force_login(self.alice)
+        self.assertContains(self.client.get(self.detail), '$10.00')
+        # an update that bumps no version keeps serving the cached fragment...
+        Product.objects.filter(pk=self.product.pk).update(price='11.00')
+        self.assertContains(self.client.get(self.detail), '$10.00')
+        # ...a save does not
+        self.product.price = '12.00'
+        self.change(self.product.save)
+        self.assertContains(self.client.get(self.detail), '$12.00')
+
+    @override_settings(STOREFRONT_HTTP_CACHE=False)
+    def test_csrf_token_filled_in_per_request(self):
+        tokens = []
+        for expected in ('miss', 'hit'):
+            client = Client(enforce_csrf_checks=True)
+            response, state = self.get(client, self.detail)
+            self.assertEqual(state, expected)
+            self.assertNotContains(response, page_cache.CSRF_PLACEHOLDER)
+            token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode())[1]
+            tokens.append(token)
+            posted = client.post(reverse('add_to_cart', args=[self.product.pk]),
+                                 {'size': 'M', 'quantity': 1, 'csrfmiddlewaretoken': token})
+            self.assertEqual(posted.status_code, 302)
+        self.assertNotEqual(tokens[0], tokens[1])
+
+    @override_settings(STOREFRONT_HTTP_CACHE=True)
+    def test_storefront_revalidation(self):
+        response = Client().get(self.detail)
+        etag = response['ETag']
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+        self.assertFalse(response.cookies)
+        self.assertEqual(Client().get(self.detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.change(lambda: ledger.move(self.product.pk, 'M', -1, StockMovement.KIND_SALE))
+        response = Client().get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Available: <strong>9</strong>')
+
+
+class WishlistStatusBatchTests(StoreTestCase):
+    url = reverse_lazy('wishlist_status_batch')
+
+    def setUp(self):
+        caches['default'].clear()
+        self.products = [self.make_product(name=f'Tee {i}') for i in range(10)]
+        self.client.force_login(self.alice)
+
+    def ids(self, products):
+        return ','.join(str(p.pk) for p in products)
+
+    def test_id_cap(self):
+        response = self.client.get(self.url, {'ids': ','.join(str(i) for i in range(1, 502))})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'ids': ','.join(str(i) for i in range(1, 501))}).status_code, 200)
+
+    def test_etag_revalidation(self):
+        ids = self.ids(self.products[:3])
+        response = self.client.get(self.url, {'ids': ids})
+        self.assertEqual(response.json()['wishlisted'], [])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, {'ids': ids}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            added = self.client.post(reverse('wishlist_add'), json.dumps({'product_id': self.products[1].pk}),
+                                     content_type='application/json')
+        self.assertTrue(added.json()['ok'])
+        response = self.client.get(self.url, {'ids': ids}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['wishlisted'], [self.products[1].pk])
+
+    def test_bitset(self):
+        for i in (0, 7, 8, 9):
+            Wishlist.objects.create(user=self.alice, product=self.products[i])
+        ids = [p.pk for p in self.products]
+        data = self.client.get(self.url, {'ids': self.ids(self.products), 'format': 'bitset'}).json()
+        self.assertEqual(data['ids'], ids)
+        # LSB first: ids[0] and ids[7] in the first byte, ids[8] and ids[9] in the second
+        self.assertEqual(base64.b64decode(data['bits']), bytes([0b10000001, 0b00000011]))
+
+
+class UserCacheTests(StoreTestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.key = self.alice.get_session_auth_hash()
+
+    def test_hit_is_a_copy_and_other_hash_misses(self):
+        cache = TTLUserCache()
+        cache.set(self.alice, self.key)
+        cached = cache.get(self.alice.pk, self.key)
+        self.assertEqual(cached, self.alice)
+        self.assertIsNot(cached, self.alice)
+        self.assertIsNone(cache.get(self.alice.pk, 'rotated-by-a-password-change'))
+        self.assertIsNone(cache.get(self.bob.pk, self.key))
+
+    def test_expiry(self):
+        cache = TTLUserCache()
+        with mock.patch('store.user_cache.time.monotonic', return_value=1000.0):
+            cache.set(self.alice, self.key)
+        with mock.patch('store.user_cache.time.monotonic', return_value=1029.0):
+            self.assertIsNotNone(cache.get(self.alice.pk, self.key))
+        with mock.patch('store.user_cache.time.monotonic', return_value=1031.0):
+            self.assertIsNone(cache.get(self.alice.pk, self.key))
+        with override_settings(USER_CACHE_TTL=0):
+            cache.set(self.alice, self.key)
+        self.assertIsNone(cache.get(self.alice.pk, self.key))
+
+    def test_save_and_delete_invalidate(self):
+        user_cache.set(self.alice, self.key)
+        self.alice.is_staff = True
+        self.alice.save()
+        self.assertIsNone(user_cache.get(self.alice.pk, self.key))
+        user_cache.set(self.bob, None)
+        bob_pk = self.bob.pk
+        self.bob.delete()
+        self.assertIsNone(user_cache.get(bob_pk, None))
+
+    def test_requests_fill_it_and_logout_invalidates(self):
+        self.client.force_login(self.alice)
+        self.client.get(reverse('cart'))
+        self.assertEqual(user_cache.get(self.alice.pk, self.key), self.alice)
+        self.client.logout()
+        self.assertIsNone(user_cache.get(self.alice.pk, self.key))
+
+
+class ProductImageTests(StoreTestCase):
+    def test_changing_image_clears_derivatives(self):
+        product = self.make_product()
+        Product.objects.filter(pk=product.pk).update(image='products/old.jpg', image_hash='a' * 64, image_widths='160')
+        product = Product.objects.get(pk=product.pk)
+        product.image = 'products/new.jpg'
+        product.save()
+        fresh = Product.objects.get(pk=product.pk)
+        self.assertEqual((fresh.image.name, fresh.image_hash, fresh.image_widths), ('products/new.jpg', '', ''))
+        self.assertEqual(images.srcset_for(fresh, 'webp'), '')
+
+    def test_other_edits_keep_derivatives(self):
+        product = self.make_product()
+        Product.objects.filter(pk=product.pk).update(image='products/old.jpg', image_hash='a' * 64, image_widths='160')
+        product = Product.objects.get(pk=product.pk)
+        product.name = 'Polo'
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).image_hash, 'a' * 64)
+
+    def test_referenced_hashes(self):
+        product, other = self.make_product(), self.make_product(name='Polo')
+        order = Order.objects.create(user=self.alice, address=self.make_address(self.alice), total='10.00')
+        OrderItem.objects.create(order=order, product=product, size='M', quantity=1, price='10.00')
+        OrderSummary.objects.filter(order=order).delete()
+        Product.objects.filter(pk=product.pk).update(image='products/old.jpg', image_hash='a' * 64)
+        refresh_summaries([order.pk])
+        self.assertEqual(images.referenced_hashes([product.pk]), {product.pk: {'a' * 64}})
+        self.assertEqual(images.referenced_hashes([other.pk]), {})
+
+    def test_render_keeps_referenced_derivatives(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            os.makedirs(os.path.join(media_root, images.DERIVATIVE_DIR))
+            Image.new('RGB', (200, 100)).save(os.path.join(media_root, 'shirt.jpg'))
+            for old in ('a' * 64, 'b' * 64):
+                open(os.path.join(media_root, images.derivative_name('shirt.jpg', old, 160, 'jpg')), 'w').close()
+            digest, widths = images.render_derivatives('shirt.jpg', media_root, [160], keep={'a' * 64})
+            left = sorted(os.listdir(os.path.join(media_root, images.DERIVATIVE_DIR)))
+        self.assertEqual(widths, [160])
+        self.assertEqual(left, sorted([
+            f'shirt_jpg-{"a" * 12}-160.jpg',
+            f'shirt_jpg-{digest[:12]}-160.jpg',
+            f'shirt_jpg-{digest[:12]}-160.webp',
+        ]))
@@ -9,6 +9,9 @@ urlpatterns = [
     path('public-home/', views.home, name='home'),
     path('category/<str:category_name>/', views.product_list, name='product_list'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'),
+    path('search/', views.search, name='search'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('api/storefront/session/', views.storefront_session, name='storefront_session'),
     path('add-to-cart/<int:pk>/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.cart, name='cart'),
     path('remove-from-cart/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
@@ -27,6 +30,7 @@ urlpatterns = [
     path('delivery-partner/login/', views.delivery_partner_login, name='delivery_partner_login'),
     path('delivery-partner/dashboard/', views.delivery_dashboard, name='delivery_dashboard'),
     path('delivery-partner/order/<int:order_id>/', views.delivery_order_detail, name='delivery_order_detail'),
+    path('delivery-partner/orders/status/', views.delivery_bulk_status, name='delivery_bulk_status'),
     path('delivery-partner/logout/', views.delivery_partner_logout, name='delivery_partner_logout'),
     path('about/', views.about, name='about_us'),
     path('support/', views.support, name='support'),
@@ -34,11 +38,14 @@ urlpatterns = [
     path('wishlist/', views.wishlist_page, name='wishlist_page'),
     path('api/wishlist/', views.wishlist_api, name='wishlist_api'),
     path('api/wishlist/status/', views.wishlist_status, name='wishlist_status'),
+    path('api/wishlist/status/batch/', views.wishlist_status_batch, name='wishlist_status_batch'),
     path('api/wishlist/add/', views.wishlist_add, name='wishlist_add'),
     path('api/wishlist/remove/', views.wishlist_remove, name='wishlist_remove'),
     path('api/wishlist/move-to-cart/', views.wishlist_move_to_cart, name='wishlist_move_to_cart'),
     path('api/wishlist/guest/', views.wishlist_guest_save, name='wishlist_guest_save'),
     path('save-for-later/', views.save_for_later, name='save_for_later'),
+    # Prometheus scrape target (no trailing slash, as scrapers expect)
+    path('metrics', views.metrics, name='metrics'),
     
     # Aliases for common order URLs to prevent 404s
     path('orders/', views.my_orders, name='orders'),
@@ -0,0 +1,64 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+
+
+class TTLUserCache:
+    """Small per-process cache of User rows used to resolve request users.
+
+    Entries are keyed by (user id, key) where key is the session's auth hash
+    (derived from the password hash), so a password change that rotates the
+    session hash misses the cache. Entries expire after `USER_CACHE_TTL`
+    seconds and are dropped on user save/delete and logout. Callers always
+    get their own copy of the cached instance.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'USER_CACHE_TTL', 30)
+
+    def get(self, user_id, key):
+        entry_key = (str(user_id), key or '')
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[entry_key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            user = entry[1]
+        return copy.copy(user)
+
+    def set(self, user, key):
+        if self.ttl <= 0 or user is None or user.pk is None:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[(str(user.pk), key or '')] = (time.monotonic() + self.ttl, copy.copy(user))
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[entry_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = TTLUserCache()
@@ -40,13 +40,29 @@ def delivery_partner_login(request):
     return render(request, 'store/delivery_login.html', {'error': error})
     def get_success_url(self):
         return '/delivery-partner/dashboard/'
-from .models import DeliveryPartnerUser, Category, Product, CartItem, Address, Order, SupportRequest
+from .models import DeliveryPartnerUser, Category, Product, CartItem, Address, Order, OrderItem, SupportRequest
+from .pagination import keyset_paginate
+from .orders import transition_orders, DELIVERY_PARTNER_STATUSES
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+import datetime
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, JsonResponse
+from django.contrib import admin
 from django.views.decorators.http import require_POST
 from django.core import serializers
 import json
-from .models import Wishlist
+from .models import OrderSummary, Wishlist, wishlist_version_name
+from .orders import order_history
+from .page_cache import get_versions
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+import base64
+from asgiref.sync import sync_to_async
+import hashlib
+import hmac
 from django import forms
 
 # Delivery partner order detail view (uses delivery partner session auth)
@@ -100,8 +116,15 @@ def delivery_dashboard(request):
     # Check if delivery partner is authenticated via session
     if not request.session.get('delivery_partner_authenticated'):
         return redirect('delivery_partner_login')
-    # Base queryset
-    orders_qs = Order.objects.select_related('user', 'address').prefetch_related('items__product').all()
+    # Only open orders, newest first: served by the (status, created_at) index
+    orders_qs = (
+        Order.objects.filter(status__in=Order.PENDING_DELIVERY_STATUSES)
+        .select_related('user', 'address')
+        .prefetch_related(Prefetch(
+            'order_items',
+            queryset=OrderItem.objects.select_related('product').only('id', 'order_id', 'size', 'product__id', 'product__name'),
+        ))
+    )
 
     # Filters from GET params
     order_id = request.GET.get('order_id') or request.GET.get('q')
@@ -117,23 +140,29 @@ def delivery_dashboard(request):
             # no-op if not numeric; could search username or similar instead
             orders_qs = orders_qs.none()
 
-    # Filter by postal code (partial match)
+    # Prefix matches (LIKE 'x%') so the postal_code / username indexes are usable
     if postal_code:
-        orders_qs = orders_qs.filter(address__postal_code__icontains=postal_code)
+        orders_qs = orders_qs.filter(address__postal_code__istartswith=postal_code.strip())
 
-    # Filter by username (partial, case-insensitive)
     if username:
-        orders_qs = orders_qs.filter(user__username__icontains=username)
+        orders_qs = orders_qs.filter(user__username__istartswith=username.strip())
 
-    # Filter by a single date (YYYY-MM-DD)
+    # Filter by a single date (YYYY-MM-DD) as a created_at range rather than DATE(created_at)
     if date:
-        orders_qs = orders_qs.filter(created_at__date=date)
-
-    # Exclude orders that have been marked delivered in the admin.
-    # This assumes admins set `tracking_status` to a value containing 'delivered'.
-    orders_qs = orders_qs.exclude(tracking_status__icontains='delivered')
+        day = parse_date(date)
+        if day:
+            start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+            orders_qs = orders_qs.filter(created_at__gte=start, created_at__lt=start + datetime.timedelta(days=1))
+        else:
+            orders_qs = orders_qs.none()
 
-    orders = orders_qs.order_by('-created_at')
+    page = keyset_paginate(
+        orders_qs,
+        ('-created_at', '-id'),
+        cursor=request.GET.get('cursor'),
+        per_page=getattr(settings, 'DELIVERY_DASHBOARD_PAGE_SIZE', 50),
+        salt='delivery_dashboard',
+    )
 
     # Keep current filter values for form population
     filters = {
@@ -143,25 +172,52 @@ def delivery_dashboard(request):
         'date': date or '',
     }
 
-    return render(request, 'store/delivery_dashboard.html', {'orders': orders, 'filters': filters})
+    status_choices = [(code, label) for code, label in Order.STATUS_CHOICES if code in DELIVERY_PARTNER_STATUSES]
+    return render(request, 'store/delivery_dashboard.html', {'orders': page, 'page': page, 'filters': filters, 'status_choices': status_choices})
+# Bulk status change from the delivery partner dashboard
+@require_POST
+def delivery_bulk_status(request):
+    if not request.session.get('delivery_partner_authenticated'):
+        return redirect('delivery_partner_login')
+    status = request.POST.get('status')
+    if status not in DELIVERY_PARTNER_STATUSES:
+        messages.error(request, 'Please choose a valid status.')
+        return redirect('delivery_dashboard')
+    order_ids = [int(pk) for pk in request.POST.getlist('order_ids') if pk.isdigit()]
+    if not order_ids:
+        messages.error(request, 'Select at least one order.')
+        return redirect('delivery_dashboard')
+    moved, rejected = transition_orders(order_ids, status)
+    label = dict(Order.STATUS_CHOICES)[status]
+    if moved:
+        messages.success(request, f'Marked {len(moved)} order(s) as {label}.')
+    if rejected:
+        messages.warning(request, f'Skipped order(s) {", ".join(f"#{pk}" for pk in rejected)}: cannot move to {label} from their current status.')
+    return redirect('delivery_dashboard')
+
 from django.contrib.auth.decorators import login_required
 # Order detail view
 def order_detail(request, order_id):
     shop_user = request.shop_user if getattr(request, 'shop_user', None) else (request.user if request.user.is_authenticated else None)
     if not shop_user:
         return redirect('login')
-    order = Order.objects.filter(id=order_id, user=shop_user).select_related('address').prefetch_related('items__product').first()
+    order = OrderSummary.objects.filter(order_id=order_id, user=shop_user).first()
     if not order:
         return HttpResponse('Order not found or access denied.', status=404)
-    return render(request, 'store/order_detail.html', {'order': order})
+    items = (
+        OrderItem.objects.filter(order_id=order_id).select_related('product')
+        .only('quantity', 'price', 'product__name', 'product__image', 'product__specification').order_by('pk')
+    )
+    return render(request, 'store/order_detail.html', {'order': order, 'items': items})
 
 # My Orders view
 def my_orders(request):
     shop_user = request.shop_user if getattr(request, 'shop_user', None) else (request.user if request.user.is_authenticated else None)
     if not shop_user:
         return redirect('login')
-    orders = Order.objects.filter(user=shop_user).select_related('address').prefetch_related('items__product').order_by('-created_at')
-    return render(request, 'store/my_orders.html', {'orders': orders})
+    page = order_history(shop_user, cursor=request.GET.get('cursor'),
+                         per_page=getattr(settings, 'ORDER_HISTORY_PAGE_SIZE', 20))
+    return render(request, 'store/my_orders.html', {'orders': page})
 from django.contrib.auth import logout # Ensure logout is imported
 
 # Custom logout view to allow GET requests and redirect to home
@@ -179,6 +235,21 @@ def custom_logout(request):
     return redirect('home')
 from django.shortcuts import render, get_object_or_404, redirect
 from .models import Category, Product, CartItem, Address, Order, OrderItem, SizeStock
+from .checkout import place_order, CheckoutError
+from .pagination import keyset_paginate
+from .search import search_products
+from .page_cache import cache_page_for_anonymous, prime_product_versions, product_version_name
+from . import guest_cart
+from .cart import add_item, cart_summary, set_held_quantity
+from . import reservations
+from . import metrics as request_metrics
+from . import profiling
+from .ledger import live_stock
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import never_cache
+from .user_cache import user_cache
+from django.contrib.auth import HASH_SESSION_KEY
+from django.conf import settings
 from django.db import transaction
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -187,10 +258,11 @@ from django import forms
 from django.http import HttpResponse
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.forms import UserCreationForm
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 
 # Landing page with categories and featured products
 
+@cache_page_for_anonymous('home', versions=lambda request, **kwargs: ['category'], storefront=True)
 def home(request):
     categories = Category.objects.all()
     return render(request, 'store/home.html', {
@@ -199,55 +271,131 @@ def home(request):
 
 # Product list by category
 
+PRODUCT_LIST_ORDERINGS = {
+    'default': ('id',),
+    'price': ('price', 'id'),
+}
+
+@cache_page_for_anonymous('product_list', storefront=True)
 def product_list(request, category_name):
     category = get_object_or_404(Category, name=category_name)
-    products = Product.objects.filter(category=category)
-    return render(request, 'store/product_list.html', {'category': category, 'products': products})
+    sort = request.GET.get('sort')
+    if sort not in PRODUCT_LIST_ORDERINGS:
+        sort = 'default'
+    products = Product.objects.filter(category=category).only(*Product.CARD_FIELDS)
+    page = keyset_paginate(
+        products,
+        PRODUCT_LIST_ORDERINGS[sort],
+        cursor=request.GET.get('cursor'),
+        per_page=getattr(settings, 'PRODUCT_LIST_PAGE_SIZE', 24),
+        salt=f'product_list:{sort}',
+    )
+    prime_product_versions(page.items)
+    return render(request, 'store/product_list.html', {'category': category, 'products': page, 'page': page, 'sort': sort})
+
+def _search_params(request):
+    query = (request.GET.get('q') or '').strip()[:200]
+    category = Category.objects.filter(name=request.GET.get('category')).first() if request.GET.get('category') else None
+    size = request.GET.get('size') if request.GET.get('size') in dict(CartItem.SIZE_CHOICES) else None
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except (TypeError, ValueError):
+        page = 1
+    return query, category, size, page
+
+def search(request):
+    query, category, size, page = _search_params(request)
+    products, has_next = [], False
+    if query:
+        products, has_next = search_products(query, category_id=category.pk if category else None, size=size,
+                                             page=page, per_page=getattr(settings, 'SEARCH_PAGE_SIZE', 24))
+    return render(request, 'store/search.html', {
+        'query': query, 'category': category, 'size': size, 'page': page, 'has_next': has_next,
+        'products': products, 'categories': Category.objects.all(), 'sizes': [s for s, _ in CartItem.SIZE_CHOICES],
+    })
 
+def search_api(request):
+    """JSON search: GET q, category, size, page."""
+    query, category, size, page = _search_params(request)
+    if not query:
+        return JsonResponse({'ok': False, 'error': 'q required'}, status=400)
+    products, has_next = search_products(query, category_id=category.pk if category else None, size=size,
+                                         page=page, per_page=getattr(settings, 'SEARCH_PAGE_SIZE', 24))
+    results = [{
+        'id': p.id,
+        'name': p.name,
+        'price': str(p.price),
+        'image': p.image.url if p.image else '',
+        'blurb': p.blurb,
+        'in_stock': p.stock_total > 0,
+        'url': reverse('product_detail', args=[p.id]),
+    } for p in products]
+    return JsonResponse({'ok': True, 'results': results, 'page': page, 'has_next': has_next})
+
+# with reservations the availability changes when a hold expires, which bumps no version
+@cache_page_for_anonymous('product_detail', versions=lambda request, pk: [product_version_name(pk), 'category'],
+                          storefront=True, bypass=reservations.enabled)
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
-    return render(request, 'store/product_detail.html', {'product': product})
+    prime_product_versions([product])
+    if reservations.enabled():
+        size_availability, total_stock = reservations.availability(product)
+    else:
+        size_availability, total_stock = product.size_availability, product.total_stock
+    return render(request, 'store/product_detail.html', {
+        'product': product, 'size_availability': size_availability, 'total_stock': total_stock,
+    })
+
+@never_cache
+async def storefront_session(request):
+    """Per-visitor bits of the HTTP-cached storefront pages: login state and a CSRF token."""
+    shop_user = await sync_to_async(
+        lambda: request.shop_user if getattr(request, 'shop_user', None) else (request.user if request.user.is_authenticated else None)
+    )()
+    return JsonResponse({
+        'ok': True,
+        'authenticated': bool(shop_user),
+        'username': shop_user.username if shop_user else None,
+        'csrf_token': get_token(request),
+    })
 
 def add_to_cart(request, pk):
     if request.method != 'POST':
         return redirect('product_detail', pk=pk)
     shop_user = request.shop_user if getattr(request, 'shop_user', None) else (request.user if request.user.is_authenticated else None)
-    product = get_object_or_404(Product, pk=pk)
     size = request.POST.get('size')
     try:
-        qty = int(request.POST.get('quantity', '1'))
+        qty = max(1, int(request.POST.get('quantity', '1')))
     except Exception:
         qty = 1
-    if not shop_user:
-        request.session['cart_intent'] = {
-            'product_id': product.id,
-            'size': size,
-            'quantity': qty,
-        }
-        return redirect('login')
     if size not in dict(CartItem.SIZE_CHOICES):
         messages.error(request, 'Please select a valid size.')
         return redirect('product_detail', pk=pk)
+    # logged in: one statement inserts or increments the line if stock allows
+    if shop_user and add_item(shop_user, pk, size, qty):
+        messages.success(request, 'Added to cart')
+        return redirect('cart')
+    product = get_object_or_404(Product, pk=pk)
     try:
-        size_row = SizeStock.objects.get(product=product, size=size)
+        size_row = SizeStock.objects.annotate(live=live_stock()).get(product=product, size=size)
     except SizeStock.DoesNotExist:
         messages.error(request, 'Size information not available for this product.')
         return redirect('product_detail', pk=pk)
-    existing_qty = 0
-    existing = CartItem.objects.filter(user=shop_user, product=product, size=size).first()
-    if existing:
-        existing_qty = existing.quantity
-    if size_row.stock < existing_qty + qty:
-        messages.error(request, f'Insufficient stock for size {size}. Available: {size_row.stock - existing_qty}')
-        return redirect('product_detail', pk=pk)
-    cart_item, created = CartItem.objects.get_or_create(user=shop_user, product=product, size=size)
-    if not created:
-        cart_item.quantity += qty
+    if shop_user:
+        existing_qty = CartItem.objects.filter(user=shop_user, product=product, size=size).values_list('quantity', flat=True).first() or 0
     else:
-        cart_item.quantity = qty
-    cart_item.save()
-    messages.success(request, 'Added to cart')
-    return redirect('cart')
+        existing_qty = guest_cart.quantity_of(request.session, product.id, size)
+    if size_row.live < existing_qty + qty:
+        messages.error(request, f'Insufficient stock for size {size}. Available: {size_row.live - existing_qty}')
+        return redirect('product_detail', pk=pk)
+    if shop_user:
+        # stock changed between the upsert and the checks above; let them retry
+        messages.error(request, 'Could not add to cart, please try again.')
+        return redirect('product_detail', pk=pk)
+    # keep it in the session cart; it's merged into the real cart on login
+    if not guest_cart.add(request.session, product.id, size, qty):
+        messages.error(request, 'Your cart is full. Log in to check out.')
+    return redirect('login')
 
 class AddressForm(forms.ModelForm):
     class Meta:
@@ -286,52 +434,27 @@ def cart(request):
     shop_user = request.shop_user if getattr(request, 'shop_user', None) else (request.user if request.user.is_authenticated else None)
     if not shop_user:
         return redirect('login')
-    cart_items = CartItem.objects.filter(user=shop_user)
-    total = sum(item.product.price * item.quantity for item in cart_items)
     address_form = AddressForm()
     quantity_range = range(1, 11)
     if request.method == 'POST':
         address_form = AddressForm(request.POST)
         if address_form.is_valid():
-            user_id = request.session.get('shop_user_id')
-            from django.contrib.auth.models import User
-            shop_user = User.objects.get(id=user_id)
             address = address_form.save(commit=False)
             address.user = shop_user
             address.save()
 
             # Create order and decrement size-level stock atomically
-            with transaction.atomic():
-                order = Order.objects.create(user=shop_user, address=address, total=total)
-
-                # For each cart item, lock the corresponding SizeStock row and verify availability
-                for cart_item in cart_items.select_for_update():
-                    try:
-                        size_row = SizeStock.objects.select_for_update().get(product=cart_item.product, size=cart_item.size)
-                    except SizeStock.DoesNotExist:
-                        transaction.set_rollback(True)
-                        return HttpResponse('Product size not available.', status=400)
-
-                    if size_row.stock < cart_item.quantity:
-                        transaction.set_rollback(True)
-                        return HttpResponse(f'Insufficient stock for {cart_item.product.name} size {cart_item.size}.', status=400)
-
-                    # Deduct stock
-                    size_row.stock -= cart_item.quantity
-                    # ensure stock never goes below zero
-                    if size_row.stock < 0:
-                        size_row.stock = 0
-                    size_row.mark_status()
-                    size_row.save()
-
-                    # Create order item snapshot including size
-                    OrderItem.objects.create(order=order, product=cart_item.product, size=cart_item.size, quantity=cart_item.quantity, price=cart_item.product.price)
-
-                # After all deductions, delete cart items
-                cart_items.delete()
+            try:
+                order = place_order(shop_user, address)
+            except CheckoutError as e:
+                return HttpResponse(str(e), status=400)
 
             return render(request, 'store/order_success.html', {'order': order, 'show_order_id_modal': True})
-    return render(request, 'store/cart.html', {'cart_items': cart_items, 'total': total, 'address_form': address_form, 'quantity_range': quantity_range})
+    summary = cart_summary(shop_user)
+    return render(request, 'store/cart.html', {
+        'cart_items': summary.lines, 'total': summary.total, 'cart_badge': summary,
+        'address_form': address_form, 'quantity_range': quantity_range,
+    })
 
 def remove_from_cart(request, item_id):
     shop_user = request.shop_user if getattr(request, 'shop_user', None) else (request.user if request.user.is_authenticated else None)
@@ -355,13 +478,16 @@ def update_cart_item(request, item_id):
                 qty = int(selected)
                 if qty == 11:  # 10+ chosen but no menual provided
                     return redirect('cart')
-            if qty > 0:
+            if qty > 0 and reservations.enabled():
+                if not set_held_quantity(shop_user, cart_item, qty):
+                    messages.error(request, f'Insufficient stock for size {cart_item.size}.')
+            elif qty > 0:
                 # Check size-level availability before updating
                 try:
-                    size_row = SizeStock.objects.get(product=cart_item.product, size=cart_item.size)
+                    size_row = SizeStock.objects.annotate(live=live_stock()).get(product=cart_item.product, size=cart_item.size)
                 except SizeStock.DoesNotExist:
                     return redirect('cart')
-                if size_row.stock + cart_item.quantity < qty:  # allow reducing or same
+                if size_row.live + cart_item.quantity < qty:  # allow reducing or same
                     # not enough stock to increase to desired qty
                     messages.error(request, f'Insufficient stock for size {cart_item.size}.')
                     return redirect('cart')
@@ -386,55 +512,28 @@ class StoreLoginView(LoginView):
         self.request.session['shop_user_username'] = user.username
         self.request.session['shop_user_email'] = user.email
         self.request.session['shop_user_date_joined'] = str(user.date_joined)
-        guest_wishlist = self.request.session.pop('guest_wishlist', None)
-        if guest_wishlist and isinstance(guest_wishlist, list):
-            for pid in guest_wishlist:
-                try:
-                    prod_id = int(pid)
-                except Exception:
-                    continue
-                try:
-                    prod = Product.objects.get(pk=prod_id)
-                except Product.DoesNotExist:
-                    continue
-                Wishlist.objects.get_or_create(user=user, product=prod)
-        cart_intent = self.request.session.pop('cart_intent', None)
-        if cart_intent:
-            try:
-                product_id = int(cart_intent.get('product_id'))
-                quantity = int(cart_intent.get('quantity') or 1)
-            except Exception:
-                return redirect('cart')
-            size = cart_intent.get('size')
-            try:
-                product = Product.objects.get(pk=product_id)
-            except Product.DoesNotExist:
-                return redirect('cart')
-            if size not in dict(CartItem.SIZE_CHOICES):
-                return redirect('cart')
-            try:
-                size_row = SizeStock.objects.get(product=product, size=size)
-            except SizeStock.DoesNotExist:
-                return redirect('cart')
-            existing_qty = 0
-            existing = CartItem.objects.filter(user=user, product=product, size=size).first()
-            if existing:
-                existing_qty = existing.quantity
-            if size_row.stock < existing_qty + quantity:
-                return redirect('cart')
-            cart_item, created = CartItem.objects.get_or_create(user=user, product=product, size=size)
-            if not created:
-                cart_item.quantity += quantity
-            else:
-                cart_item.quantity = quantity
-            cart_item.save()
-            return redirect('user_home')
+        # resolve request.user / shop_user from the instance we already have,
+        # now and (through the cache) on the next request
+        self.request._resolved_user = user
+        user_cache.set(user, self.request.session.get(HASH_SESSION_KEY))
+        merged, dropped = guest_cart.merge_into_user(self.request.session, user)
+        if dropped:
+            names = dict(Product.objects.filter(pk__in={product_id for product_id, _ in dropped}).values_list('pk', 'name'))
+            lines = ', '.join(f'{names[product_id]} ({size})' for product_id, size in dropped if product_id in names)
+            messages.warning(self.request, 'Some items from your cart are no longer available in that quantity '
+                                           f'and were not added{": " + lines if lines else ""}.')
+        if merged:
+            return redirect('cart')
         return redirect(self.get_success_url())
 
 
+# The small JSON endpoints below are async views: under ASGI (ecommerce.asgi)
+# they don't hold a worker thread while waiting on the database.
+
 @require_POST
-def wishlist_add(request):
-    if not request.user.is_authenticated:
+async def wishlist_add(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'ok': False, 'login_required': True}, status=401)
     try:
         data = json.loads(request.body.decode() or '{}')
@@ -444,16 +543,17 @@ def wishlist_add(request):
     if not pid:
         return JsonResponse({'ok': False, 'error': 'product_id required'}, status=400)
     try:
-        product = Product.objects.get(pk=int(pid))
+        product = await Product.objects.only('pk').aget(pk=int(pid))
     except Exception:
         return JsonResponse({'ok': False, 'error': 'invalid product'}, status=400)
-    obj, created = Wishlist.objects.get_or_create(user=request.user, product=product)
+    obj, created = await Wishlist.objects.aget_or_create(user=user, product=product)
     return JsonResponse({'ok': True, 'created': created, 'message': 'Added to wishlist'})
 
 
 @require_POST
-def wishlist_remove(request):
-    if not request.user.is_authenticated:
+async def wishlist_remove(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'ok': False, 'login_required': True}, status=401)
     try:
         data = json.loads(request.body.decode() or '{}')
@@ -462,20 +562,21 @@ def wishlist_remove(request):
     pid = data.get('product_id') or request.POST.get('product_id')
     if not pid:
         return JsonResponse({'ok': False, 'error': 'product_id required'}, status=400)
-    Wishlist.objects.filter(user=request.user, product_id=pid).delete()
+    await Wishlist.objects.filter(user=user, product_id=pid).adelete()
     return JsonResponse({'ok': True, 'message': 'Removed from wishlist'})
 
 
-def wishlist_api(request):
+async def wishlist_api(request):
     """Return JSON list of wishlisted product ids for authenticated user."""
-    if not request.user.is_authenticated:
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'ok': False, 'login_required': True}, status=401)
-    items = Wishlist.objects.filter(user=request.user).select_related('product')
-    data = [{'id': w.product.id, 'name': w.product.name, 'price': str(w.product.price), 'image': w.product.image.url if w.product.image else ''} for w in items]
+    items = Wishlist.objects.filter(user=user).select_related('product')
+    data = [{'id': w.product.id, 'name': w.product.name, 'price': str(w.product.price), 'image': w.product.image.url if w.product.image else ''} async for w in items]
     return JsonResponse({'ok': True, 'items': data})
 
 
-def wishlist_status(request):
+async def wishlist_status(request):
     """Return whether the given product_id is in the authenticated user's wishlist.
     GET param: product_id
     """
@@ -486,16 +587,68 @@ def wishlist_status(request):
         pid_int = int(pid)
     except Exception:
         return JsonResponse({'ok': False, 'error': 'invalid product_id'}, status=400)
-    if not request.user.is_authenticated:
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'ok': True, 'is_wishlisted': False, 'login_required': True})
-    exists = Wishlist.objects.filter(user=request.user, product_id=pid_int).exists()
+    exists = await Wishlist.objects.filter(user=user, product_id=pid_int).aexists()
     return JsonResponse({'ok': True, 'is_wishlisted': exists})
 
 
-@login_required
+WISHLIST_STATUS_MAX_IDS = 500
+
+async def wishlist_status_batch(request):
+    """Which of many products are in the user's wishlist, from one indexed query.
+
+    GET ids=1,2,3 (up to WISHLIST_STATUS_MAX_IDS). Returns
+    {'ok': True, 'wishlisted': [ids]}, or with format=bitset
+    {'ok': True, 'ids': [...], 'bits': base64} where bit i (LSB first within
+    each byte) is set when ids[i] is wishlisted. Responses carry an ETag from
+    the user's wishlist version, so unchanged wishlists revalidate with 304.
+    """
+    try:
+        ids = list(dict.fromkeys(int(pid) for pid in request.GET.get('ids', '').split(',') if pid.strip()))
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'invalid ids'}, status=400)
+    if not ids:
+        return JsonResponse({'ok': False, 'error': 'ids required'}, status=400)
+    if len(ids) > WISHLIST_STATUS_MAX_IDS:
+        return JsonResponse({'ok': False, 'error': f'at most {WISHLIST_STATUS_MAX_IDS} ids'}, status=400)
+    bitset = request.GET.get('format') == 'bitset'
+    user = await request.auser()
+    if not user.is_authenticated:
+        data = {'ok': True, 'wishlisted': [], 'login_required': True}
+        if bitset:
+            data.update(ids=ids, bits=base64.b64encode(bytes((len(ids) + 7) // 8)).decode())
+        return JsonResponse(data)
+    name = wishlist_version_name(user.pk)
+    version = (await sync_to_async(get_versions)([name]))[name]
+    etag = quote_etag(hashlib.sha1(
+        f'{user.pk}:{version}:{bitset}:{",".join(map(str, ids))}'.encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        wishlisted = {
+            pid async for pid in
+            Wishlist.objects.filter(user=user, product_id__in=ids).values_list('product_id', flat=True)
+        }
+        if bitset:
+            bits = bytearray((len(ids) + 7) // 8)
+            for i, pid in enumerate(ids):
+                if pid in wishlisted:
+                    bits[i // 8] |= 1 << (i % 8)
+            response = JsonResponse({'ok': True, 'ids': ids, 'bits': base64.b64encode(bits).decode()})
+        else:
+            response = JsonResponse({'ok': True, 'wishlisted': [pid for pid in ids if pid in wishlisted]})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @require_POST
-def wishlist_move_to_cart(request):
+async def wishlist_move_to_cart(request):
     """Move product from wishlist to cart for logged-in user."""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'ok': False, 'login_required': True}, status=401)
     try:
         data = json.loads(request.body.decode() or '{}')
     except Exception:
@@ -504,19 +657,15 @@ def wishlist_move_to_cart(request):
     if not pid:
         return JsonResponse({'ok': False, 'error': 'product_id required'}, status=400)
     try:
-        product = Product.objects.get(pk=int(pid))
+        product = await Product.objects.only('pk').aget(pk=int(pid))
     except Exception:
         return JsonResponse({'ok': False, 'error': 'invalid product'}, status=400)
     # create or increment cart item with default size M if not provided
     size = data.get('size') or request.POST.get('size') or 'M'
-    cart_item, created = CartItem.objects.get_or_create(user=request.user, product=product, size=size)
-    if not created:
-        cart_item.quantity += 1
-    else:
-        cart_item.quantity = 1
-    cart_item.save()
+    if not await sync_to_async(add_item)(user, product.pk, size, 1):
+        return JsonResponse({'ok': False, 'error': f'Size {size} is not available'}, status=400)
     # remove from wishlist
-    Wishlist.objects.filter(user=request.user, product=product).delete()
+    await Wishlist.objects.filter(user=user, product=product).adelete()
     return JsonResponse({'ok': True, 'message': 'Moved to cart'})
 
 
@@ -528,7 +677,7 @@ def wishlist_page(request):
 
 
 @require_POST
-def wishlist_guest_save(request):
+async def wishlist_guest_save(request):
     """Save guest wishlist (from client localStorage) into server session so it
     can be merged on login.
     Expects JSON {items: [product_id, ...]} or form POST `items[]`.
@@ -545,7 +694,8 @@ def wishlist_guest_save(request):
             out.append(int(p))
         except Exception:
             continue
-    request.session['guest_wishlist'] = out
+    # loading the session hits the database; sessions have no async API in Django 5.0
+    await sync_to_async(request.session.__setitem__)('guest_wishlist', out)
     return JsonResponse({'ok': True, 'saved': len(out)})
 
 
@@ -593,6 +743,7 @@ def signup(request):
     return render(request, 'store/signup.html', {'form': form, 'error_message': error_message, 'form_errors': form_errors})
 
 # Authenticated user's home (same functionality as public home)
+@cache_page_for_anonymous('user_home', versions=lambda request, **kwargs: ['category'])
 def user_home(request):
     categories = Category.objects.all()
     return render(request, 'store/user_home.html', {
@@ -608,7 +759,7 @@ def profile(request):
     email = request.shop_user.email
     date_joined = request.shop_user.date_joined
     addresses = Address.objects.filter(user=request.shop_user)
-    recent_orders = Order.objects.filter(user=request.shop_user).order_by('-created_at')[:5]
+    recent_orders = order_history(request.shop_user, per_page=5)
     profile_user = {
         'username': username,
         'email': email,
@@ -621,6 +772,7 @@ def profile(request):
     })
 
 
+@cache_page_for_anonymous('about', versions=lambda request, **kwargs: ['category'], storefront=True)
 def about(request):
     return render(request, 'store/about.html')
 
@@ -648,6 +800,59 @@ def support(request):
     return render(request, 'store/support.html', {'success': success, 'error': error})
 
 
+@never_cache
+def metrics(request):
+    """Per-view request metrics in Prometheus text format (see store/metrics.py).
+
+    Open to staff sessions and to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    scraper = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not scraper and not (request.user.is_authenticated and request.user.is_staff):
+        response = HttpResponse('Authentication required\n', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(request_metrics.render(request_metrics.registry.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+PROFILE_ORDERINGS = {'created': 'id', 'duration': 'duration_ms', 'sql': 'sql_count', 'sql_time': 'sql_ms'}
+
+
+def admin_profiles(request):
+    """Staff page listing the stored request profiles (see store/profiling.py)."""
+    order = request.GET.get('o', '-created')
+    key = PROFILE_ORDERINGS.get(order.lstrip('-'), 'id')
+    profiles = profiling.list_profiles()
+    if key == 'id':
+        profiles.sort(key=lambda p: int(p['id'].split('-')[0]), reverse=order.startswith('-'))
+    else:
+        profiles.sort(key=lambda p: p[key], reverse=order.startswith('-'))
+    return render(request, 'admin/store/request_profiles.html', {
+        **admin.site.each_context(request), 'title': 'Request profiles',
+        'profiles': profiles, 'order': order, 'enabled': profiling.enabled(),
+    })
+
+
+def admin_profile_detail(request, profile_id):
+    profile = profiling.load(profile_id)
+    if profile is None:
+        raise Http404('No such profile')
+    sort = request.GET.get('sort', 'cumulative')
+    return render(request, 'admin/store/request_profile.html', {
+        **admin.site.each_context(request), 'title': f'{profile["method"]} {profile["path"]}',
+        'profile': profile, 'stats': profiling.stats_text(profile_id, sort),
+        'sort': sort, 'sort_keys': profiling.SORT_KEYS,
+    })
+
+
+def admin_profile_download(request, profile_id):
+    path = profiling.stats_path(profile_id)
+    if path is None:
+        raise Http404('No such profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
+
+
 def admin_logout_view(request):
     # menually remove Django's authentication keys from the session
     if '_auth_user_id' in request.session: